@@ -0,0 +1,288 @@
+""" Load generator for the todo server
+
+N concurrent async clients run a weighted mix of operations for a fixed duration,
+in-process against the app of main.init_app (the default) or against a running server:
+
+    python -m benchmarks.load --clients 50 --duration 30 --size 100000
+    python -m benchmarks.load --url http://127.0.0.1:8000 --username u --password p
+
+Throughput and p50/p95/p99/max latency are reported per operation. The event loop lag
+(how late a 10 ms sleep wakes up) is reported as well, in-process it shows work that
+blocks the event loop, e.g. password hashing stalling unrelated routes.
+"""
+
+import asyncio
+import json
+import random
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from collections import defaultdict
+from contextlib import AsyncExitStack
+from typing import Any, Dict, List, Optional
+from unittest.mock import patch
+from httpx import AsyncClient
+from benchmarks.suite import (
+    NEW_TODO,
+    PASSWORD,
+    SEARCH_QUERY,
+    START,
+    USERNAME,
+    add_benchmark_user,
+    create_storage,
+)
+from main import init_app
+from mock_data.generate_todos import generate_todos
+
+DEFAULT_MIX = "login=1,search=2,list=5,get=10,create=2,update=2,delete=1"
+OPERATIONS = ["login", "search", "list", "get", "create", "update", "delete"]
+
+PAGE_SIZE = 100
+LAG_INTERVAL = 0.01
+
+
+def parse_mix(mix: str) -> Dict[str, int]:
+    """Parse the weights of the operations, e.g. "get=10,list=5" """
+
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise ValueError(f"Unknown operation: {name}")
+        weights[name] = int(weight or 1)
+
+    if not any(weights.values()):
+        raise ValueError("The mix needs at least one operation with a weight")
+    return weights
+
+
+def percentile(timings: List[float], percent: float) -> float:
+    """Get the nearest-rank percentile of sorted timings"""
+
+    rank = max(int(len(timings) * percent / 100 + 0.5), 1)
+    return timings[min(rank, len(timings)) - 1]
+
+
+def summarize(name: str, timings: List[float], errors: int, seconds: float) -> dict:
+    """Get the throughput and the latency percentiles (in milliseconds) of an
+    operation"""
+
+    timings = sorted(x * 1000 for x in timings)
+    summary = {
+        "name": name,
+        "requests": len(timings),
+        "errors": errors,
+        "throughput": len(timings) / seconds,
+    }
+    if timings:
+        summary.update(
+            {
+                "p50_ms": percentile(timings, 50),
+                "p95_ms": percentile(timings, 95),
+                "p99_ms": percentile(timings, 99),
+                "max_ms": timings[-1],
+            }
+        )
+    return summary
+
+
+class LoadClient:
+    """A client running random operations of the mix until the deadline"""
+
+    def __init__(
+        self,
+        client: AsyncClient,
+        credentials: Dict[str, str],
+        ids: List[int],
+        weights: Dict[str, int],
+        rng: random.Random,
+    ):
+        self.client = client
+        self.credentials = credentials
+        self.ids = ids
+        self.names = list(weights)
+        self.weights = list(weights.values())
+        self.rng = rng
+        self.headers = {}
+        self.created = []
+
+    async def login(self):
+        response = await self.client.post("/api/token", data=self.credentials)
+        if response.status_code == 200:
+            token = response.json()["access_token"]
+            self.headers = {"Authorization": f"Bearer {token}"}
+        return response
+
+    async def search(self):
+        params = {"title": SEARCH_QUERY, "page_size": PAGE_SIZE}
+        return await self.client.get("/api/todos", params=params, headers=self.headers)
+
+    async def list(self):
+        sort_by = self.rng.choice(["id", "title", "due_date"])
+        params = {"sort_by": sort_by, "page": self.rng.randint(1, 10)}
+        params["page_size"] = PAGE_SIZE
+        return await self.client.get("/api/todos", params=params, headers=self.headers)
+
+    async def get(self):
+        _id = self.rng.choice(self.ids)
+        return await self.client.get(f"/api/todos/{_id}", headers=self.headers)
+
+    async def create(self):
+        response = await self.client.post(
+            "/api/todos", json=NEW_TODO, headers=self.headers
+        )
+        if response.status_code == 200:
+            self.created.append(response.json()["id"])
+        return response
+
+    async def update(self):
+        _id = self.rng.choice(self.ids)
+        return await self.client.put(
+            f"/api/todos/{_id}", json=NEW_TODO, headers=self.headers
+        )
+
+    async def delete(self):
+        # Only todos created by this client are deleted, the others stay available
+        _id = self.created.pop()
+        return await self.client.delete(f"/api/todos/{_id}", headers=self.headers)
+
+    async def run(self, deadline: float, timings: dict, errors: dict):
+        await self.login()
+
+        while time.perf_counter() < deadline:
+            name = self.rng.choices(self.names, self.weights)[0]
+            if name == "delete" and not self.created:
+                name = "create"
+
+            started = time.perf_counter()
+            try:
+                response = await getattr(self, name)()
+                failed = response.status_code >= 400
+            except Exception:
+                failed = True
+
+            if failed:
+                errors[name] += 1
+            else:
+                timings[name].append(time.perf_counter() - started)
+
+
+async def measure_lag(deadline: float, lags: List[float]):
+    """Measure how late the event loop wakes up from short sleeps"""
+
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        await asyncio.sleep(LAG_INTERVAL)
+        lags.append(max(time.perf_counter() - started - LAG_INTERVAL, 0))
+
+
+async def run_load(
+    client: AsyncClient,
+    credentials: Dict[str, str],
+    clients: int,
+    duration: float,
+    weights: Dict[str, int],
+    seed: int,
+) -> List[Dict[str, Any]]:
+    """Run the clients concurrently and summarize every operation"""
+
+    # Gets and updates target the todos of the first listing page
+    response = await client.post("/api/token", data=credentials)
+    response.raise_for_status()
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    params = {"page_size": 1000}
+    response = await client.get("/api/todos", params=params, headers=headers)
+    response.raise_for_status()
+    ids = [todo["id"] for todo in response.json()["result"]]
+    if not ids:
+        raise ValueError("The server has no todos to load")
+
+    timings, errors, lags = defaultdict(list), defaultdict(int), []
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    deadline = started + duration
+    await asyncio.gather(
+        measure_lag(deadline, lags),
+        *(
+            LoadClient(client, credentials, ids, weights, random.Random(rng.random()))
+            .run(deadline, timings, errors)
+            for _ in range(clients)
+        ),
+    )
+    seconds = time.perf_counter() - started
+
+    summaries = [
+        summarize(name, timings[name], errors[name], seconds)
+        for name in OPERATIONS
+        if timings[name] or errors[name]
+    ]
+    summaries.append(summarize("total", sum(timings.values(), []), 0, seconds))
+    summaries[-1]["errors"] = sum(errors.values())
+    summaries.append(summarize("event_loop_lag", lags, 0, seconds))
+    return summaries
+
+
+async def run(args) -> List[Dict[str, Any]]:
+    weights = parse_mix(args.mix)
+    async with AsyncExitStack() as stack:
+        if args.url:
+            credentials = {"username": args.username, "password": args.password}
+            client = AsyncClient(base_url=args.url, timeout=None)
+        else:
+            add_benchmark_user()
+            credentials = {"username": USERNAME, "password": PASSWORD}
+            directory = stack.enter_context(tempfile.TemporaryDirectory())
+            todos = generate_todos(args.size, args.seed, START)
+            storage = create_storage(args.storage, todos, directory)
+            stack.callback(storage.close)
+            stack.enter_context(patch("routes.todos.todos", storage))
+            client = AsyncClient(app=init_app(), base_url="http://load", timeout=None)
+
+        await stack.enter_async_context(client)
+        return await run_load(
+            client, credentials, args.clients, args.duration, weights, args.seed
+        )
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = ArgumentParser(description="Generate load on the todo server")
+    parser.add_argument("--url", help="load a running server instead of the app")
+    parser.add_argument("--username", default=USERNAME)
+    parser.add_argument("--password", default=PASSWORD)
+    parser.add_argument("--clients", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--mix", default=DEFAULT_MIX)
+    parser.add_argument("--size", type=int, default=10000)
+    parser.add_argument(
+        "--storage", default="memory", choices=["memory", "columnar", "sqlite"]
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results (JSON) to this file")
+    args = parser.parse_args(argv)
+
+    summaries = asyncio.run(run(args))
+
+    print(
+        f"{'operation':<16} {'requests':>9} {'errors':>7} {'req/s':>9} "
+        f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}"
+    )
+    for x in summaries:
+        latencies = " ".join(
+            f"{x[key]:>9.2f}" if key in x else f"{'-':>9}"
+            for key in ("p50_ms", "p95_ms", "p99_ms", "max_ms")
+        )
+        print(
+            f"{x['name']:<16} {x['requests']:>9} {x['errors']:>7} "
+            f"{x['throughput']:>9.1f} {latencies}"
+        )
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({"clients": args.clients, "results": summaries}, file, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
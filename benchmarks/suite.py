@@ -0,0 +1,357 @@
+""" Benchmark suite for the hot paths of the todo server
+
+Every benchmark runs in-process, through the ASGI client or by calling the function
+directly, against generated datasets of each size. The results are written as JSON and
+compared with a stored baseline; the exit code is 1 when a benchmark regressed.
+
+    python -m benchmarks.suite --sizes 1000,10000,100000,1000000
+    python -m benchmarks.suite --sizes 1000,10000 --save-baseline
+
+Timings depend on the machine, save the baseline on the machine running the comparison.
+"""
+
+import asyncio
+import gc
+import json
+import platform
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from datetime import datetime
+from statistics import mean, median, quantiles
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from unittest.mock import patch
+from httpx import AsyncClient
+from helpers.authentication import (
+    get_current_user,
+    get_password_hash,
+    token_cache,
+    user_database,
+)
+from helpers.levenshtein import search_by_levenshtein
+from main import init_app
+from mock_data.generate_todos import generate_todos
+from models.todo_models import ToDoModel
+from storage.base import ToDoStorage
+from storage.columnar_repository import ColumnarToDoRepository
+from storage.sqlite_repository import SQLiteToDoRepository
+from storage.todo_repository import ToDoRepository
+
+BASELINE_PATH = "benchmarks/baseline.json"
+
+# Bumped when the layout of the results changes
+RESULTS_FORMAT = 1
+
+# Medians this much (relative) slower than the baseline are regressions, as long as the
+# difference also exceeds the absolute noise floor of sub-millisecond benchmarks
+DEFAULT_TOLERANCE = 0.5
+NOISE_FLOOR_MS = 0.25
+
+USERNAME = "benchmark"
+PASSWORD = "benchmark"
+
+# Datasets only depend on the seed and this start of the due dates
+START = datetime(2030, 1, 1)
+
+SEARCH_QUERY = "magnam porro"
+SORT_FIELDS = [None, "id", "title", "description", "due_date"]
+PAGE_SIZE = 100
+
+NEW_TODO = {
+    "title": "Benchmark todo",
+    "description": "Created by the benchmark suite",
+    "due_date": "2030-01-01T00:00:00Z",
+    "completed": False,
+}
+
+Benchmark = Callable[[int], Awaitable[Any]]
+
+
+def summarize(timings: List[float]) -> Dict[str, float]:
+    """Get the statistics (in milliseconds) of the timings of a benchmark"""
+
+    timings = [x * 1000 for x in timings]
+    return {
+        "iterations": len(timings),
+        "mean_ms": mean(timings),
+        "median_ms": median(timings),
+        "p95_ms": quantiles(timings, n=20)[-1] if len(timings) > 1 else timings[0],
+        "min_ms": min(timings),
+    }
+
+
+async def measure(
+    func: Benchmark,
+    iterations: int,
+    max_seconds: float,
+    before: Optional[Callable[[], None]] = None,
+) -> Dict[str, float]:
+    """Time func(i) for i in range(iterations), after one warmup call
+
+    The run stops early (after at least 3 iterations) once max_seconds passed, which
+    bounds slow benchmarks on large datasets. before() runs untimed before every call,
+    e.g. to clear a cache.
+    """
+
+    gc.collect()
+    if before is not None:
+        before()
+    await func(-1)
+
+    timings = []
+    deadline = time.perf_counter() + max_seconds
+    for i in range(iterations):
+        if before is not None:
+            before()
+        started = time.perf_counter()
+        await func(i)
+        timings.append(time.perf_counter() - started)
+        if len(timings) >= 3 and time.perf_counter() > deadline:
+            break
+    return summarize(timings)
+
+
+def add_benchmark_user():
+    """Add the benchmark user, which only lives in the user database of this process"""
+
+    if not user_database.get_user(USERNAME):
+        user_database.add_user(
+            {
+                "_id": 0,
+                "username": USERNAME,
+                "full_name": USERNAME,
+                "email": f"{USERNAME}@example.com",
+                "hashed_password": get_password_hash(PASSWORD),
+                "disabled": False,
+                "is_admin": False,
+            }
+        )
+
+
+def create_storage(engine: str, todos: list, directory: str) -> ToDoStorage:
+    """Create a storage engine holding the todos"""
+
+    if engine == "memory":
+        return ToDoRepository(todos)
+    if engine == "columnar":
+        return ColumnarToDoRepository(todos)
+    if engine == "sqlite":
+        storage = SQLiteToDoRepository(f"{directory}/todos.sqlite3")
+        storage.bulk_upsert(todos)
+        return storage
+    raise ValueError(f"Unknown todo storage engine: {engine}")
+
+
+def api_benchmarks(
+    client: AsyncClient, storage: ToDoStorage, headers: Dict[str, str], size: int
+) -> List[tuple]:
+    """Get the (name, benchmark, before) tuples of the API and authentication paths"""
+
+    benchmarks = []
+
+    async def call(method: str, url: str, **kwargs):
+        # A failing request would be measured as a (fast) benchmark result
+        response = await client.request(method, url, headers=headers, **kwargs)
+        response.raise_for_status()
+
+    def clear_query_cache():
+        storage.query_cache.clear()
+
+    # Listings and searches are measured uncached, the pages cycle through the first
+    # ten pages (or fewer on small datasets)
+    pages = max(min(size // PAGE_SIZE, 10), 1)
+    for sort_by in SORT_FIELDS:
+        params = {"page_size": PAGE_SIZE}
+        if sort_by is not None:
+            params["sort_by"] = sort_by
+
+        async def get_all(i, params=params):
+            params = {**params, "page": i % pages + 1}
+            await call("GET", "/api/todos", params=params)
+
+        benchmarks.append((f"get_all[sort_by={sort_by}]", get_all, clear_query_cache))
+
+    async def search(i):
+        params = {"page_size": PAGE_SIZE, "page": 1, "title": SEARCH_QUERY}
+        await call("GET", "/api/todos", params=params)
+
+    benchmarks.append(("get_all[title]", search, clear_query_cache))
+
+    # Single item CRUD, every delete removes a todo created (untimed) before it
+    created = []
+
+    def create_todo():
+        created.append(storage.create(ToDoModel(**NEW_TODO)).id)
+
+    async def get_todo(i):
+        await call("GET", f"/api/todos/{i % size}")
+
+    async def post_todo(i):
+        await call("POST", "/api/todos", json=NEW_TODO)
+
+    async def put_todo(i):
+        await call("PUT", f"/api/todos/{i % size}", json=NEW_TODO)
+
+    async def delete_todo(i):
+        await call("DELETE", f"/api/todos/{created.pop()}")
+
+    benchmarks += [
+        ("get_todo", get_todo, None),
+        ("post_todo", post_todo, None),
+        ("put_todo", put_todo, None),
+        ("delete_todo", delete_todo, create_todo),
+    ]
+
+    # Token verification, uncached (decode plus user lookup) and cached
+    token = headers["Authorization"].split()[1]
+
+    async def verify_token(i):
+        await get_current_user(token)
+
+    benchmarks += [
+        ("get_current_user[verify]", verify_token, token_cache.clear),
+        ("get_current_user[cached]", verify_token, None),
+    ]
+
+    async def login(i):
+        form_data = {"username": USERNAME, "password": PASSWORD}
+        await call("POST", "/api/token", data=form_data)
+
+    benchmarks.append(("token", login, None))
+    return benchmarks
+
+
+async def run_size(
+    size: int, engine: str, seed: int, iterations: int, max_seconds: float
+) -> List[Dict[str, Any]]:
+    """Run every benchmark against a dataset of size todos"""
+
+    results = []
+
+    async def bench(name, func, before=None):
+        stats = await measure(func, iterations, max_seconds, before)
+        results.append({"name": name, "size": size, **stats})
+        print(f"{name:<32} {size:>9} {stats['median_ms']:>10.3f} ms", file=sys.stderr)
+
+    todos = generate_todos(size, seed, START)
+
+    async def search(i):
+        search_by_levenshtein(SEARCH_QUERY, todos, "title")
+
+    await bench("search_by_levenshtein", search)
+
+    with tempfile.TemporaryDirectory() as directory:
+        storage = create_storage(engine, todos, directory)
+        try:
+            with patch("routes.todos.todos", storage):
+                async with AsyncClient(
+                    app=init_app(), base_url="http://benchmark"
+                ) as client:
+                    form_data = {"username": USERNAME, "password": PASSWORD}
+                    response = await client.post("/api/token", data=form_data)
+                    token = response.json()["access_token"]
+                    headers = {"Authorization": f"Bearer {token}"}
+
+                    for name, func, before in api_benchmarks(
+                        client, storage, headers, size
+                    ):
+                        await bench(name, func, before)
+        finally:
+            storage.close()
+
+    return results
+
+
+def compare(
+    results: List[Dict[str, Any]],
+    baseline: List[Dict[str, Any]],
+    tolerance: float = DEFAULT_TOLERANCE,
+) -> List[str]:
+    """Get a description of every benchmark whose median regressed beyond tolerance
+
+    Benchmarks (or sizes) missing from the baseline are not compared.
+    """
+
+    baseline_medians = {(x["name"], x["size"]): x["median_ms"] for x in baseline}
+
+    regressions = []
+    for result in results:
+        expected = baseline_medians.get((result["name"], result["size"]))
+        if expected is None:
+            continue
+
+        median_ms = result["median_ms"]
+        limit = max(expected * (1 + tolerance), expected + NOISE_FLOOR_MS)
+        if median_ms > limit:
+            regressions.append(
+                f"{result['name']} ({result['size']} todos): "
+                f"{median_ms:.3f} ms, baseline {expected:.3f} ms"
+            )
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = ArgumentParser(description="Benchmark the hot paths of the todo server")
+    parser.add_argument("--sizes", default="1000,10000,100000,1000000")
+    parser.add_argument(
+        "--storage", default="memory", choices=["memory", "columnar", "sqlite"]
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--max-seconds", type=float, default=2.0)
+    parser.add_argument("--output", help="write the results (JSON) to this file")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="store the results as the baseline instead of comparing with it",
+    )
+    args = parser.parse_args(argv)
+
+    add_benchmark_user()
+    results = []
+    for size in map(int, args.sizes.split(",")):
+        results += asyncio.run(
+            run_size(size, args.storage, args.seed, args.iterations, args.max_seconds)
+        )
+
+    report = {
+        "format": RESULTS_FORMAT,
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "storage": args.storage,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as file:
+            json.dump(report, file, indent=2)
+        return 0
+
+    try:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+    except FileNotFoundError:
+        print(f"No baseline at {args.baseline}, nothing to compare", file=sys.stderr)
+        return 0
+
+    if baseline["meta"]["storage"] != args.storage:
+        print("The baseline was measured on another storage engine", file=sys.stderr)
+        return 0
+
+    regressions = compare(results, baseline["results"], args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
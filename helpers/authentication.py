@@ -1,5 +1,6 @@
 """Password verification helper methods"""
 
+import time
 from datetime import datetime, timedelta
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
@@ -7,43 +8,89 @@ from passlib.context import CryptContext
 from models.user_models import User, NewUser, UserInDB, TokenData
 from fastapi import Depends, HTTPException, status
 from mock_data.mock_user_database import MockUserDatabase
+from helpers.hashing_pool import HashingPool, HashingPoolFull
+from helpers.lru_cache import LRUCache
+from helpers.metrics import metrics
+from settings import USER_DATABASE_PATH
 
 # Authorization settings
 SECRET_KEY = "4a725837375afeab021c937a2ba038e9b68d31fd9ebaaf07833e19ad13026a6b"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 120
 
-# password context
+# Verified bearer tokens and their users, an entry never outlives its token
+TOKEN_CACHE_SIZE = 4096
+TOKEN_CACHE_TTL = 300
+token_cache = LRUCache(maxsize=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_TTL)
+
+# password context, hashing runs in a bounded pool to keep it off the event loop
+PASSWORD_HASHING_WORKERS = 2
+PASSWORD_HASHING_MAX_PENDING = 64
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+password_hashing_pool = HashingPool(
+    max_workers=PASSWORD_HASHING_WORKERS, max_pending=PASSWORD_HASHING_MAX_PENDING
+)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/token")
 
+# Process-wide user database
+user_database = MockUserDatabase(path=USER_DATABASE_PATH)
+
 
 def verify_password(plain_password, hashed_password):
     """Verify password"""
 
-    return pwd_context.verify(plain_password, hashed_password)
+    with metrics.timer("bcrypt_verify"):
+        return pwd_context.verify(plain_password, hashed_password)
 
 
 def get_password_hash(password):
     """Get password hash for plain password"""
 
-    return pwd_context.hash(password)
+    with metrics.timer("bcrypt_hash"):
+        return pwd_context.hash(password)
 
 
 def get_user(username: str) -> UserInDB:
     """get user from database"""
 
-    database = MockUserDatabase()
-    user_data = database.get_user(username)
+    user_data = user_database.get_user(username)
     if user_data:
         return UserInDB(**user_data)
 
 
-def authenticate_user(username: str, password: str) -> UserInDB:
+def invalidate_user_tokens(username: str) -> int:
+    """Drop the cached tokens of a user, e.g. when the user is deleted or disabled"""
+
+    return token_cache.remove_if(lambda token, user: user.username == username)
+
+
+# Tokens of updated (e.g. disabled) or deleted users must not be served from the cache
+user_database.add_listener(invalidate_user_tokens)
+
+
+async def run_password_hashing(func, *args):
+    """Run a password hashing function in the hashing pool
+
+    Raises a 503 when the pool is saturated, so only logins degrade under a login storm
+    """
+
+    try:
+        return await password_hashing_pool.run(func, *args)
+    except HashingPoolFull as exc:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many concurrent password verifications, try again later",
+            headers={"Retry-After": "1"},
+        ) from exc
+
+
+async def authenticate_user(username: str, password: str) -> UserInDB:
     """Authenticate user"""
 
     user = get_user(username)
-    if user and verify_password(password, user.hashed_password):
+    if user and await run_password_hashing(
+        verify_password, password, user.hashed_password
+    ):
         return user
 
 
@@ -63,7 +110,18 @@ def create_access_token(data: dict, expires_delta: timedelta or None = None):
 
 
 async def get_current_user(token: str = Depends(oauth2_scheme)):
-    """Get current user"""
+    """Get current user
+
+    Verified tokens are cached, so repeated requests with the same token skip the
+    decoding and the user lookup.
+    """
+
+    # Users changed by another worker invalidate their cached tokens
+    user_database.refresh()
+
+    user = token_cache.get(token)
+    if user is not None:
+        return user
 
     credential_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -71,7 +129,8 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        with metrics.timer("jwt_decode"):
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
         if username is None:
             raise credential_exception
@@ -84,6 +143,13 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
     if user is None:
         raise credential_exception
 
+    # Cache the user until the token expires (or the cache time to live passes)
+    ttl = TOKEN_CACHE_TTL
+    if payload.get("exp") is not None:
+        ttl = min(ttl, payload["exp"] - time.time())
+    if ttl > 0:
+        token_cache.set(token, user, ttl=ttl)
+
     return user
 
 
@@ -100,11 +166,8 @@ async def get_current_active_user(current_user: UserInDB = Depends(get_current_u
     return current_user
 
 
-def create_user(new_user: NewUser, current_user: User) -> User:
-    """Create new user
-
-    NOTE: Password requirements are checked in the NewUser model
-    """
+def require_admin(current_user: User):
+    """Check the user is an admin"""
 
     if current_user.is_admin is False:
         raise HTTPException(
@@ -113,20 +176,29 @@ def create_user(new_user: NewUser, current_user: User) -> User:
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-    # Setup database
-    database = MockUserDatabase()
 
-    # Check if user already exist
-    existing_user = database.get_user(new_user.username)
-    if existing_user is not None:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Username taken",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
+async def create_user(new_user: NewUser, current_user: User) -> User:
+    """Create new user
+
+    NOTE: Password requirements are checked in the NewUser model
+    """
+
+    require_admin(current_user)
+
+    # Check if user already exist, before spending a password hash on it
+    username_taken = HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail="Username taken",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    existing_user = user_database.get_user(new_user.username)
+    if existing_user:
+        raise username_taken
 
     # hash password
-    hashed_password = get_password_hash(new_user.clear_password)
+    hashed_password = await run_password_hashing(
+        get_password_hash, new_user.clear_password
+    )
 
     # Create new user object
     user_in_db = UserInDB(
@@ -138,11 +210,13 @@ def create_user(new_user: NewUser, current_user: User) -> User:
         disabled=new_user.disabled,
     )
 
-    # Store user in database
-    database.add_user(user_in_db.model_dump())
+    # Store user in database, unless a concurrent request created the user while the
+    # password was hashed
+    if not user_database.add_user(user_in_db.model_dump()):
+        raise username_taken
 
     # Return new user
-    created_user = database.get_user(new_user.username)
+    created_user = user_database.get_user(new_user.username)
     created_user.pop("hashed_password")
 
     return User(**created_user)
@@ -151,15 +225,7 @@ def create_user(new_user: NewUser, current_user: User) -> User:
 def delete_user(username: str, current_user: User) -> bool:
     """Delete user"""
 
-    if current_user.is_admin is False:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Unauthorized to make this request",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-
-    # Setup database
-    database = MockUserDatabase()
+    require_admin(current_user)
 
     # Check if we're not deleting our self
     if current_user.username == username:
@@ -169,8 +235,8 @@ def delete_user(username: str, current_user: User) -> bool:
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-    # Remove user from database
-    result = database.delete_user(username)
+    # Remove user from database, this also invalidates the cached tokens of the user
+    result = user_database.delete_user(username)
 
     # Return result
     return result
@@ -0,0 +1,137 @@
+""" Bounded in-memory log of todo changes, streamed as Server-Sent Events """
+
+import asyncio
+from collections import deque
+from itertools import islice
+from secrets import token_hex
+from typing import AsyncIterator, Deque, Iterable, List, NamedTuple, Optional, Tuple
+
+# Comment frame sent to idle subscribers, keeps proxies from closing the connection
+KEEPALIVE_FRAME = b": keep-alive\n\n"
+
+
+class ChangeEvent(NamedTuple):
+    sequence: int
+    type: str
+    id: int
+
+    # The event as an SSE frame, serialized once for every subscriber
+    frame: bytes
+
+
+def event_frame(event_id: str, event: str, data: bytes) -> bytes:
+    """Get an SSE frame, data must be a single line (e.g. compact JSON)"""
+
+    return b"id: %s\nevent: %s\ndata: %s\n\n" % (
+        event_id.encode(),
+        event.encode(),
+        data,
+    )
+
+
+class ChangeFeed:
+    """Ring buffer of the last `size` create, update and delete events
+
+    Every event has a sequence number, one more than the previous event. The event
+    ids clients resume from combine it with a random token of the feed, so the ids
+    handed out by a previous run (or by another process) are answered with a reset
+    instead of the unrelated events which happen to have the same sequence.
+
+    Subscribers waiting for events share a single future, which a publish resolves.
+    An idle subscriber is a suspended coroutine plus a keep-alive timer, no polling.
+    The log lives in the memory of one process.
+    """
+
+    def __init__(self, size: int, token: Optional[str] = None):
+        self.token = token_hex(8) if token is None else token
+        self.last_sequence = 0
+        self._events: Deque[ChangeEvent] = deque(maxlen=size)
+        self._waiter: Optional[asyncio.Future] = None
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+    def event_id(self, sequence: int) -> str:
+        """Get the id of the event with this sequence"""
+
+        return f"{self.token}-{sequence}"
+
+    def sequence_of(self, event_id: str) -> Optional[int]:
+        """Get the sequence of an event id, None when it's not an id of this feed"""
+
+        token, _, sequence = event_id.rpartition("-")
+        if token != self.token or not sequence.isdigit():
+            return None
+        return int(sequence)
+
+    def publish(self, changes: Iterable[Tuple[str, int, Optional[bytes]]]):
+        """Append (type, id, todo JSON or None) changes and wake the subscribers"""
+
+        for event, _id, todo in changes:
+            self.last_sequence += 1
+            data = b'{"sequence":%d,"type":"%s","id":%d' % (
+                self.last_sequence,
+                event.encode(),
+                _id,
+            )
+            if todo is not None:
+                data += b',"todo":' + todo
+            frame = event_frame(self.event_id(self.last_sequence), event, data + b"}")
+            self._events.append(ChangeEvent(self.last_sequence, event, _id, frame))
+
+        waiter, self._waiter = self._waiter, None
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    def events_after(self, sequence: int) -> Optional[List[ChangeEvent]]:
+        """Get the events following sequence, None when some of them are no longer
+        (or were never) in the log
+
+        The events are taken from the end of the log, so a subscriber that is up to
+        date pays for the new events only.
+        """
+
+        count = self.last_sequence - sequence
+        if count < 0 or count > len(self._events):
+            return None
+        events = list(islice(reversed(self._events), count))
+        events.reverse()
+        return events
+
+    async def wait(self, timeout: float) -> bool:
+        """Wait for the next publish, return False when the timeout passed first"""
+
+        loop = asyncio.get_running_loop()
+        if self._waiter is None or self._waiter.get_loop() is not loop:
+            self._waiter = loop.create_future()
+
+        # asyncio.wait never cancels the shared future, not even when this subscriber
+        # is cancelled (disconnects)
+        done, _ = await asyncio.wait([self._waiter], timeout=timeout)
+        return bool(done)
+
+    async def stream(
+        self, after: Optional[str], keepalive: float
+    ) -> AsyncIterator[bytes]:
+        """Get the SSE frames of the events following the event id after (of new events
+        only when it's None), forever
+
+        When the events to resume from are gone, or after is not an id of this feed, a
+        reset event (holding the current sequence) is sent instead, the client reloads
+        the todos and continues from there.
+        """
+
+        sequence = self.last_sequence if after is None else self.sequence_of(after)
+
+        while True:
+            events = None if sequence is None else self.events_after(sequence)
+            if events is None:
+                sequence = self.last_sequence
+                yield event_frame(
+                    self.event_id(sequence), "reset", b'{"sequence":%d}' % sequence
+                )
+            elif events:
+                sequence = events[-1].sequence
+                yield b"".join(event.frame for event in events)
+            elif not await self.wait(keepalive):
+                yield KEEPALIVE_FRAME
@@ -0,0 +1,41 @@
+""" Opaque cursors for keyset pagination """
+
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from typing import Any, Sequence, Tuple
+
+# Sort keys hold strings and 64 bit integers (ids, sequences, timestamps, ranks), which
+# every storage engine can bind, e.g. as SQLite INTEGER
+KEY_INTEGERS = range(-(2**63), 2**63)
+
+
+def encode_cursor(scope: Sequence[Any], key: Sequence[Any]) -> str:
+    """Encode the sort key of the last seen item into an opaque cursor
+
+    The scope (e.g. the query parameters determining the order) is part of the cursor,
+    so a cursor can not be used to continue a differently ordered listing.
+    """
+
+    payload = json.dumps([list(scope), list(key)], separators=(",", ":"))
+    return urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, scope: Sequence[Any]) -> Tuple[Any, ...]:
+    """Decode a cursor into the sort key it was created for, ValueError if invalid"""
+
+    try:
+        payload = urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_scope, key = json.loads(payload)
+    except (ValueError, TypeError) as exc:
+        raise ValueError("Invalid cursor") from exc
+
+    if cursor_scope != list(scope):
+        raise ValueError("Cursor does not belong to this query")
+
+    if not isinstance(key, list) or not all(
+        type(value) is str or (type(value) is int and value in KEY_INTEGERS)
+        for value in key
+    ):
+        raise ValueError("Invalid cursor")
+
+    return tuple(key)
@@ -0,0 +1,22 @@
+""" Conditional requests with entity tags """
+
+from typing import Optional
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Check whether an If-None-Match header matches the current ETag
+
+    If-None-Match uses the weak comparison, a W/ prefix is ignored. The header can list
+    several ETags.
+    """
+
+    if if_none_match is None:
+        return False
+
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
@@ -0,0 +1,92 @@
+""" Bounded worker pool to keep password hashing off the event loop """
+
+import asyncio
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Lock
+from typing import Any, Callable, Dict, Union
+
+
+class HashingPoolFull(Exception):
+    """Raised when too many hashing jobs are pending already"""
+
+
+class HashingPool:
+    """Thread pool with a bounded queue for CPU heavy password hashing
+
+    bcrypt releases the GIL while hashing, so a (small) thread pool keeps the event loop
+    responsive. At most max_workers hashes run concurrently, at most max_pending jobs
+    (running plus queued) are accepted; beyond that HashingPoolFull is raised so a login
+    storm is shed instead of growing an unbounded backlog. Queueing metrics are kept to
+    size the pool.
+    """
+
+    def __init__(self, max_workers: int = 2, max_pending: int = 64):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="password-hashing"
+        )
+        self._lock = Lock()
+
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.rejected = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.run_seconds = 0.0
+
+    async def run(self, func: Callable, *args) -> Any:
+        """Run func(*args) in the pool and wait for the result"""
+
+        with self._lock:
+            if self.queued + self.running >= self.max_pending:
+                self.rejected += 1
+                raise HashingPoolFull("Too many pending password hashing jobs")
+            self.queued += 1
+
+        submitted = time.perf_counter()
+
+        def job():
+            started = time.perf_counter()
+            with self._lock:
+                self.queued -= 1
+                self.running += 1
+                self.wait_seconds += started - submitted
+                self.max_wait_seconds = max(self.max_wait_seconds, started - submitted)
+
+            try:
+                return func(*args)
+            finally:
+                with self._lock:
+                    self.running -= 1
+                    self.completed += 1
+                    self.run_seconds += time.perf_counter() - started
+
+        def unqueue(future: Future):
+            # A caller cancelled (e.g. a client disconnect) before the job started
+            # cancels the job as well, which then never takes itself off the queue
+            if future.cancelled():
+                with self._lock:
+                    self.queued -= 1
+
+        future = self._executor.submit(job)
+        future.add_done_callback(unqueue)
+        return await asyncio.wrap_future(future)
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        """Get pool size and queueing metrics"""
+
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "max_pending": self.max_pending,
+                "queued": self.queued,
+                "running": self.running,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "wait_seconds": self.wait_seconds,
+                "max_wait_seconds": self.max_wait_seconds,
+                "run_seconds": self.run_seconds,
+            }
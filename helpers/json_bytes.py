@@ -0,0 +1,29 @@
+""" Assemble JSON response bodies from pre-serialized parts """
+
+import json
+from typing import Iterable, Optional
+
+
+def json_page(
+    page: int,
+    page_size: int,
+    pages: int,
+    result: Iterable[bytes],
+    next_cursor: Optional[str] = None,
+) -> bytes:
+    """Get the JSON of a paginated result (ToDoListModelPaginated) from the JSON of its
+    items, next_cursor is left out when it's None
+
+    The items are copied into the body as they are, so assembling a page is a join of
+    byte strings instead of a validation and serialization of every item.
+    """
+
+    body = b'{"page":%d,"page_size":%d,"pages":%d,"result":[%s]' % (
+        page,
+        page_size,
+        pages,
+        b",".join(result),
+    )
+    if next_cursor is not None:
+        body += b',"next_cursor":%s' % json.dumps(next_cursor).encode()
+    return body + b"}"
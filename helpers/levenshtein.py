@@ -1,5 +1,6 @@
 """ Search with a model and field levenshtein distance """
 
+import heapq
 from Levenshtein import distance
 
 
@@ -10,6 +11,87 @@ def has_matching_adjacent_characters(query, field_value, threshold=3):
     return query.lower() in field_value.lower() and len(query) >= threshold
 
 
+def _matches(query, candidates, score_cutoff):
+    """Yield the (item, distance) pairs of the candidates matching the query
+
+    The field values of the (item, field_value) candidates must be lower case already.
+    This allows a caller (e.g. the trigram index) to lowercase its values once instead
+    of on every search.
+    """
+
+    # At least three adjacent characters must match, shorter queries never match
+    if len(query) < 3:
+        return
+    query = query.lower()
+
+    for item, field_value in candidates:
+        # Check the entire query is part of the field value before computing the
+        # (more expensive) word distance
+        if query not in field_value:
+            continue
+
+        # Calculate the word distance on current item, the computation stops as soon
+        # as the distance exceeds the score_cutoff
+        distance_value = distance(query, field_value, score_cutoff=score_cutoff)
+
+        # Augment the item with the distance_value if and only if it's within the
+        # score_cutoff distance
+        if distance_value <= score_cutoff:
+            yield item, distance_value
+
+
+def rank_by_levenshtein(query, candidates, threshold=21):
+    """Rank (item, field_value) pairs by levenshtein distance to the query"""
+
+    # Sort the matches based on the second element (distance_value)
+    sorted_list = sorted(_matches(query, candidates, threshold - 1), key=lambda x: x[1])
+
+    # Return the sorted_list of augmented results
+    return [x[0] for x in sorted_list]
+
+
+def top_k_by_levenshtein(
+    query, candidates, limit, score_cutoff=20, key=None, reverse=False, after=None
+):
+    """Get the number of matches and the `limit` best ranked matches
+
+    Matches are ranked by distance, or by key(item, distance) when a key is given, in
+    descending order if reverse. When after is given only the matches ranked after it
+    are selected (keyset pagination), they are all counted though. Only a heap of
+    `limit` matches is kept while the candidates are scanned, so neither the full match
+    set is materialized nor sorted. Returns a (total, [(item, distance), ...]) tuple.
+    """
+
+    total = 0
+
+    def counted_matches():
+        nonlocal total
+        for match in _matches(query, candidates, score_cutoff):
+            total += 1
+            yield match
+
+    if key is None:
+        sort_key = lambda x: x[1]
+    else:
+        sort_key = lambda x: key(*x)
+
+    matches = counted_matches()
+    selectable = matches
+    if after is not None and reverse:
+        selectable = (x for x in matches if sort_key(x) < after)
+    elif after is not None:
+        selectable = (x for x in matches if sort_key(x) > after)
+
+    select = heapq.nlargest if reverse else heapq.nsmallest
+    best = select(limit, selectable, key=sort_key)
+
+    # heapq returns early for an empty limit, make sure every match has been counted
+    for _ in matches:
+        pass
+
+    return total, best
+
+
 def search_by_levenshtein(query, data=None, field_name=None, threshold=21):
     """Search by levenshtein word distance (case-insensitive)
 
@@ -23,29 +105,13 @@ def search_by_levenshtein(query, data=None, field_name=None, threshold=21):
     if data is None or field_name is None:
         raise ValueError("data and field cannot be None")
 
-    # Create an empty results list
-    results = []
-
-    for item in data:
-        # Check if the field is part of the table
-        if not hasattr(item, field_name):
-            raise AttributeError("No such field in table")
-
-        # Get the value of the field from the item
-        field_value = getattr(item, field_name)
-
-        # Calculate the word distance on current item
-        distance_value = distance(query.lower(), field_value.lower())
+    def candidates():
+        for item in data:
+            # Check if the field is part of the table
+            if not hasattr(item, field_name):
+                raise AttributeError("No such field in table")
 
-        # Augment the item with the distance_value and add to results list if and only if
-        # it's within the threshold distance
-        if distance_value < threshold:
-            # Check if at least three adjacent character match the query before adding to the result
-            if has_matching_adjacent_characters(query, field_value):
-                results.append((item, distance_value))
+            # Get the value of the field from the item
+            yield item, getattr(item, field_name).lower()
 
-    # Sort the list based on the second element (distance_value)
-    sorted_list = sorted(results, key=lambda x: x[1])
-
-    # Return the sorted_list of augmented results
-    return [x[0] for x in sorted_list]
+    return rank_by_levenshtein(query, candidates(), threshold=threshold)
@@ -0,0 +1,247 @@
+""" Request and operation metrics in the Prometheus text format """
+
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from threading import Lock
+from typing import Dict, Iterator, List, Tuple
+from starlette.routing import BaseRoute, Router
+
+# Upper bounds (in seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Label of requests no route matched, keeps the label set bounded (unlike the path)
+UNMATCHED_ROUTE = "unmatched"
+
+# Scope key holding the path template of the route handling the request
+ROUTE_SCOPE_KEY = "metrics.route"
+
+
+def format_labels(labels: Dict[str, str]) -> str:
+    """Format labels as {name="value",...} with the values escaped"""
+
+    pairs = ",".join(
+        '%s="%s"'
+        % (
+            name,
+            str(value).replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\""),
+        )
+        for name, value in labels.items()
+    )
+    return "{%s}" % pairs
+
+
+def format_value(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Cumulative latency histogram
+
+    Observations are a bisect and a few additions under a lock. The lock is only there
+    for the observations made in worker threads (e.g. password hashing).
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = Lock()
+
+    def observe(self, value: float):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def samples(self, name: str, labels: Dict[str, str]) -> Iterator[str]:
+        """Get the bucket, sum and count samples of the histogram"""
+
+        with self._lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += bucket_count
+            le = "+Inf" if bound == float("inf") else format_value(bound)
+            yield f"{name}_bucket{format_labels({**labels, 'le': le})} {cumulative}"
+        yield f"{name}_sum{format_labels(labels)} {format_value(total)}"
+        yield f"{name}_count{format_labels(labels)} {count}"
+
+
+class Metrics:
+    """Request counts, in-flight requests and latencies per route and timers of
+    expensive operations (searches, sorting, token decoding, password hashing)"""
+
+    def __init__(self):
+        self.requests: Dict[Tuple[str, str, int], int] = {}
+        self.in_flight: Dict[Tuple[str, str], int] = {}
+        self.latencies: Dict[Tuple[str, str], Histogram] = {}
+        self.operations: Dict[str, Histogram] = {}
+
+    def clear(self):
+        """Reset every metric"""
+
+        self.__init__()
+
+    def observe(self, operation: str, seconds: float):
+        """Record the duration of an operation"""
+
+        histogram = self.operations.get(operation)
+        if histogram is None:
+            histogram = self.operations.setdefault(operation, Histogram())
+        histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, operation: str):
+        """Record the duration of the with block as an operation"""
+
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(operation, time.perf_counter() - started)
+
+    def route_started(self, method: str, route: str):
+        key = (method, route)
+        self.in_flight[key] = self.in_flight.get(key, 0) + 1
+
+    def route_finished(self, method: str, route: str):
+        self.in_flight[(method, route)] -= 1
+
+    def request_finished(self, method: str, route: str, status: int, seconds: float):
+        key = (method, route)
+        request_key = (method, route, status)
+        self.requests[request_key] = self.requests.get(request_key, 0) + 1
+
+        histogram = self.latencies.get(key)
+        if histogram is None:
+            histogram = self.latencies[key] = Histogram()
+        histogram.observe(seconds)
+
+    def render(self) -> str:
+        """Get the metrics in the Prometheus text exposition format"""
+
+        lines: List[str] = [
+            "# HELP http_requests_total Requests handled per route and status code",
+            "# TYPE http_requests_total counter",
+        ]
+        for (method, route, status), count in sorted(self.requests.items()):
+            labels = {"method": method, "route": route, "status": status}
+            lines.append(f"http_requests_total{format_labels(labels)} {count}")
+
+        lines += [
+            "# HELP http_requests_in_flight Requests being handled per route",
+            "# TYPE http_requests_in_flight gauge",
+        ]
+        for (method, route), count in sorted(self.in_flight.items()):
+            labels = {"method": method, "route": route}
+            lines.append(f"http_requests_in_flight{format_labels(labels)} {count}")
+
+        lines += [
+            "# HELP http_request_duration_seconds Request latency per route",
+            "# TYPE http_request_duration_seconds histogram",
+        ]
+        for (method, route), histogram in sorted(self.latencies.items()):
+            labels = {"method": method, "route": route}
+            lines += histogram.samples("http_request_duration_seconds", labels)
+
+        lines += [
+            "# HELP todo_operation_duration_seconds Duration of expensive operations",
+            "# TYPE todo_operation_duration_seconds histogram",
+        ]
+        for operation, histogram in sorted(self.operations.items()):
+            labels = {"operation": operation}
+            lines += histogram.samples("todo_operation_duration_seconds", labels)
+
+        return "\n".join(lines) + "\n"
+
+
+# Process-wide metrics
+metrics = Metrics()
+
+
+class RouteMetrics:
+    """ASGI app wrapping the app of a route, labels the request with the route's path
+    template (e.g. /api/todos/{_id}) and counts it as in flight while it's handled"""
+
+    def __init__(self, app, route: str, metrics: Metrics = metrics):
+        self.app = app
+        self.route = route
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        scope[ROUTE_SCOPE_KEY] = self.route
+        method = scope.get("method", scope["type"])
+        self.metrics.route_started(method, self.route)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.metrics.route_finished(method, self.route)
+
+
+def instrument_routes(router: Router, metrics: Metrics = metrics):
+    """Wrap the apps of the routes of the router in RouteMetrics
+
+    The router already matched the route when it calls the route's app, so labelling
+    the request there costs nothing, unlike matching the routes once more.
+    """
+
+    for route in router.routes:
+        if isinstance(route, BaseRoute) and hasattr(route, "path"):
+            if not isinstance(route.app, RouteMetrics):
+                route.app = RouteMetrics(route.app, route.path, metrics)
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording the requests in the metrics
+
+    Requests are labelled with the path template the route's RouteMetrics put in the
+    scope (see instrument_routes), requests no route handled are unmatched. A plain
+    ASGI middleware adds a lot less to a request than a BaseHTTPMiddleware, which runs
+    the app in a separate task.
+    """
+
+    def __init__(self, app, metrics: Metrics = metrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            seconds = time.perf_counter() - started
+            route = scope.get(ROUTE_SCOPE_KEY, UNMATCHED_ROUTE)
+            self.metrics.request_finished(scope["method"], route, status, seconds)
@@ -0,0 +1,179 @@
+""" Opt-in profiling of single requests for admins """
+
+import asyncio
+import cProfile
+import io
+import os
+import pstats
+import re
+import time
+from secrets import token_hex
+from typing import Optional
+from urllib.parse import parse_qs
+from fastapi import HTTPException, status
+from fastapi.responses import JSONResponse
+from helpers.authentication import (
+    get_current_active_user,
+    get_current_user,
+    require_admin,
+)
+from settings import PROFILE_LIMIT, PROFILE_PATH
+
+# A request is profiled with an "X-Profile: 1" header or a "profile=1" query parameter
+PROFILE_HEADER = b"x-profile"
+PROFILE_PARAMETER = "profile"
+PROFILE_FLAGS = ("1", "true")
+
+# Response header holding the id of the stored profile
+PROFILE_ID_HEADER = b"x-profile-id"
+
+# Profile ids are generated, anything else (e.g. a path) is never a profile
+PROFILE_ID_PATTERN = re.compile(r"[0-9]+-[0-9a-f]{8}")
+
+# Number of functions listed in the report of a profile
+PROFILE_REPORT_LINES = 50
+
+# Streaming routes, which may respond for minutes (or forever), are never profiled
+UNPROFILED_PATHS = ("/api/todos/changes", "/api/todos/export")
+
+
+def profile_requested(scope) -> bool:
+    """Check whether the request asks to be profiled
+
+    This runs on every request, the query string is only parsed when it contains the
+    parameter name at all.
+    """
+
+    for name, value in scope["headers"]:
+        if name == PROFILE_HEADER:
+            return value.decode("latin-1").lower() in PROFILE_FLAGS
+
+    query_string = scope["query_string"]
+    if PROFILE_PARAMETER.encode() in query_string:
+        values = parse_qs(query_string.decode("latin-1")).get(PROFILE_PARAMETER, [])
+        return any(value.lower() in PROFILE_FLAGS for value in values)
+    return False
+
+
+def profile_file(profile_id: str) -> Optional[str]:
+    """Get the file of a stored profile, None for an invalid or unknown id"""
+
+    if PROFILE_ID_PATTERN.fullmatch(profile_id) is None:
+        return None
+
+    filename = os.path.join(PROFILE_PATH, f"{profile_id}.pstats")
+    return filename if os.path.exists(filename) else None
+
+
+def prune_profiles(limit: int):
+    """Delete the oldest stored profiles, keeping the last limit ones"""
+
+    profile_ids = [
+        filename.removesuffix(".pstats")
+        for filename in os.listdir(PROFILE_PATH)
+        if filename.endswith(".pstats")
+    ]
+    profile_ids = [x for x in profile_ids if PROFILE_ID_PATTERN.fullmatch(x)]
+
+    # Ids start with the time of the request in milliseconds
+    profile_ids.sort(key=lambda x: int(x.partition("-")[0]))
+    for profile_id in profile_ids[: max(len(profile_ids) - limit, 0)]:
+        try:
+            os.remove(os.path.join(PROFILE_PATH, f"{profile_id}.pstats"))
+        except FileNotFoundError:
+            # Deleted by another worker meanwhile
+            pass
+
+
+def profile_report(filename: str, lines: int = PROFILE_REPORT_LINES) -> str:
+    """Get the functions of a profile with the most cumulative time as text"""
+
+    stream = io.StringIO()
+    stats = pstats.Stats(filename, stream=stream)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(lines)
+    return stream.getvalue()
+
+
+class ProfilingMiddleware:
+    """ASGI middleware running cProfile around the requests admins ask to profile
+
+    The profile is stored as a pstats file in PROFILE_PATH, its id is returned in the
+    X-Profile-Id header (see /api/profiles/{profile_id}). Requests that don't ask to be
+    profiled only pay for a scan of the headers.
+
+    cProfile follows the thread of the event loop, so other requests handled while the
+    profiled request awaits end up in the profile, while work in worker threads (e.g.
+    the SQLite storage) does not. Profiled requests run one at a time, a request
+    asking to be profiled while another one is answered with a 409. Streaming routes
+    (UNPROFILED_PATHS) are served without a profile, they would hold the profiler for
+    as long as the client stays connected. Only the last PROFILE_LIMIT profiles are
+    kept.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._lock = asyncio.Lock()
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or not profile_requested(scope)
+            or scope["path"] in UNPROFILED_PATHS
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            await self.authorize(scope)
+            if self._lock.locked():
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT,
+                    detail="Another request is being profiled, try again later",
+                    headers={"Retry-After": "1"},
+                )
+        except HTTPException as exc:
+            response = JSONResponse(
+                {"detail": exc.detail}, status_code=exc.status_code, headers=exc.headers
+            )
+            await response(scope, receive, send)
+            return
+
+        profile_id = f"{time.time_ns() // 1_000_000}-{token_hex(4)}"
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((PROFILE_ID_HEADER, profile_id.encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        async with self._lock:
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                profiler.disable()
+                os.makedirs(PROFILE_PATH, exist_ok=True)
+                profiler.dump_stats(os.path.join(PROFILE_PATH, f"{profile_id}.pstats"))
+                prune_profiles(PROFILE_LIMIT)
+
+    @staticmethod
+    async def authorize(scope):
+        """Check the bearer token of the request belongs to an active admin"""
+
+        authorization = ""
+        for name, value in scope["headers"]:
+            if name == b"authorization":
+                authorization = value.decode("latin-1")
+
+        scheme, _, token = authorization.partition(" ")
+        if scheme.lower() != "bearer" or not token:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Not authenticated",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+
+        user = await get_current_active_user(await get_current_user(token))
+        require_admin(user)
@@ -0,0 +1,96 @@
+""" Counters shared by the processes (workers) using the same file """
+
+import mmap
+import os
+from contextlib import contextmanager
+from secrets import token_bytes
+from threading import Lock
+from typing import Iterable, Iterator
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    # No file locks (Windows), the counters are only safe within one process
+    fcntl = None
+
+COUNTER_SIZE = 8
+TOKEN_SIZE = 8
+
+
+class SharedCounters:
+    """Memory mapped 64 bit counters
+
+    The file holds a random token, written when the file is created, followed by the
+    counters. Reading a counter is a single aligned load from the mapping, so readers
+    never lock. Writers take a lock on the file (and a thread lock, file locks don't
+    exclude the threads of a process). Counters only ever increase, so a value read
+    before a write never equals one read after it, not even across restarts.
+    """
+
+    def __init__(self, path: str, size: int):
+        self.path = path
+        self.size = size
+        self._lock = Lock()
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+
+        length = TOKEN_SIZE + size * COUNTER_SIZE
+        with self._file_lock():
+            # The first process creates the file, others find it ready
+            if os.fstat(self._fd).st_size < length:
+                if os.fstat(self._fd).st_size < TOKEN_SIZE:
+                    os.pwrite(self._fd, token_bytes(TOKEN_SIZE), 0)
+                os.ftruncate(self._fd, length)
+
+        self._mmap = mmap.mmap(self._fd, length)
+        self.token = self._mmap[:TOKEN_SIZE].hex()
+        self._counters = memoryview(self._mmap)[TOKEN_SIZE:].cast("Q")
+
+    def __getitem__(self, index: int) -> int:
+        return self._counters[index]
+
+    def __setitem__(self, index: int, value: int):
+        """Set a counter, only while holding lock()"""
+
+        self._counters[index] = value
+
+    @contextmanager
+    def _file_lock(self) -> Iterator[None]:
+        if fcntl is None:
+            yield
+            return
+
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    @contextmanager
+    def lock(self) -> Iterator[None]:
+        """Exclude the writers of every process sharing the counters"""
+
+        with self._lock, self._file_lock():
+            yield
+
+    def increment(self, index: int) -> int:
+        """Increment a counter, return its new value"""
+
+        with self.lock():
+            value = self._counters[index] + 1
+            self._counters[index] = value
+        return value
+
+    def increment_many(self, indexes: Iterable[int]):
+        """Increment counters under one lock"""
+
+        with self.lock():
+            for index in indexes:
+                self._counters[index] += 1
+
+    def close(self):
+        if self._mmap.closed:
+            return
+
+        self._counters.release()
+        self._mmap.close()
+        os.close(self._fd)
@@ -0,0 +1,273 @@
+""" Incrementally maintained sorted index """
+
+from bisect import bisect_left, bisect_right, insort
+from itertools import chain, islice, takewhile
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Set, Tuple
+
+# Entries are kept in blocks of at most 2 * BLOCK_SIZE, an insert or delete only
+# shifts the entries of one block instead of the entire index
+BLOCK_SIZE = 512
+
+# Batches larger than 1 / REBUILD_RATIO of the index rebuild it in one go
+REBUILD_RATIO = 8
+
+
+class SortedIndex:
+    """Sorted index of (key(item), id) entries
+
+    The entries are stored in a list of sorted blocks (the same layout as a B+tree
+    leaf level), so inserts and deletes are a bisect plus a small memmove and a page of
+    ids is a bisect or a skip over the block lengths plus a slice. The id is part of
+    every entry, which makes the entries unique and the order of equal keys stable.
+
+    A snapshot shares the blocks with the index, copy-on-write: the index copies a
+    shared block before its first write to it.
+    """
+
+    def __init__(self, key: Callable[[Any], Any]):
+        self.key = key
+        self._blocks: List[List[Tuple[Any, int]]] = []
+        self._maxes: List[Tuple[Any, int]] = []
+        self._len = 0
+
+        # Ids of the blocks written since the last snapshot, None when no block is
+        # shared with a snapshot
+        self._owned: Optional[Set[int]] = None
+
+    def __len__(self) -> int:
+        return self._len
+
+    def snapshot(self) -> "SortedIndex":
+        """Get a read-only copy of the index as it is now
+
+        Only the lists of blocks are copied, which is O(n / BLOCK_SIZE). The blocks
+        themselves are shared until the index writes to them.
+        """
+
+        snapshot = SortedIndex(self.key)
+        snapshot._blocks = list(self._blocks)
+        snapshot._maxes = list(self._maxes)
+        snapshot._len = self._len
+        snapshot._owned = set()
+        self._owned = set()
+        return snapshot
+
+    def _own(self, i: int) -> List[Tuple[Any, int]]:
+        """Get block i for writing, a block shared with a snapshot is copied first"""
+
+        block = self._blocks[i]
+        if self._owned is not None and id(block) not in self._owned:
+            block = self._blocks[i] = list(block)
+            self._owned.add(id(block))
+        return block
+
+    def add(self, _id: int, item: Any):
+        """Add item to the index"""
+
+        self._insert((self.key(item), _id))
+
+    def remove(self, _id: int, item: Any):
+        """Remove item from the index, item must be the version that was added"""
+
+        self._delete((self.key(item), _id))
+
+    def add_many(self, items: Iterable[Tuple[int, Any]]):
+        """Add (id, item) pairs to the index
+
+        Large batches are merged with the existing entries and the blocks are rebuilt,
+        which is a (mostly linear) timsort instead of a bisect and memmove per item.
+        """
+
+        entries = [(self.key(item), _id) for _id, item in items]
+        if len(entries) * REBUILD_RATIO < self._len:
+            for entry in entries:
+                self._insert(entry)
+            return
+
+        self._rebuild(sorted(chain(chain.from_iterable(self._blocks), entries)))
+
+    def remove_many(self, items: Iterable[Tuple[int, Any]]):
+        """Remove (id, item) pairs from the index, in one pass for large batches"""
+
+        entries = [(self.key(item), _id) for _id, item in items]
+        if len(entries) * REBUILD_RATIO < self._len:
+            for entry in entries:
+                self._delete(entry)
+            return
+
+        removed = set(entries)
+        remaining = [x for x in chain.from_iterable(self._blocks) if x not in removed]
+        if len(remaining) != self._len - len(removed):
+            raise KeyError("Not all items are in the index")
+
+        self._rebuild(remaining)
+
+    def _rebuild(self, entries: List[Tuple[Any, int]]):
+        """Replace the index by the sorted entries"""
+
+        self._blocks = [
+            entries[i : i + BLOCK_SIZE] for i in range(0, len(entries), BLOCK_SIZE)
+        ]
+        self._maxes = [block[-1] for block in self._blocks]
+        self._len = len(entries)
+        self._owned = None
+
+    def _insert(self, entry: Tuple[Any, int]):
+        """Insert entry into its block"""
+
+        if not self._blocks:
+            self._blocks.append([entry])
+            self._maxes.append(entry)
+            self._len = 1
+            if self._owned is not None:
+                self._owned.add(id(self._blocks[0]))
+            return
+
+        # Find the first block whose largest entry is not smaller than the new entry,
+        # entries larger than everything go into the last block
+        i = bisect_left(self._maxes, entry)
+        if i == len(self._blocks):
+            i -= 1
+
+        block = self._own(i)
+        insort(block, entry)
+        self._maxes[i] = block[-1]
+        self._len += 1
+
+        # Split blocks which became too large
+        if len(block) > 2 * BLOCK_SIZE:
+            halves = [block[:BLOCK_SIZE], block[BLOCK_SIZE:]]
+            self._blocks[i : i + 1] = halves
+            self._maxes[i : i + 1] = [block[BLOCK_SIZE - 1], block[-1]]
+            if self._owned is not None:
+                self._owned.update(map(id, halves))
+
+    def _delete(self, entry: Tuple[Any, int]):
+        """Delete entry from its block"""
+
+        i = bisect_left(self._maxes, entry)
+        if i == len(self._blocks):
+            raise KeyError(entry[1])
+
+        block = self._blocks[i]
+        j = bisect_left(block, entry)
+        if j == len(block) or block[j] != entry:
+            raise KeyError(entry[1])
+
+        block = self._own(i)
+        del block[j]
+        self._len -= 1
+        if block:
+            self._maxes[i] = block[-1]
+        else:
+            del self._blocks[i]
+            del self._maxes[i]
+
+    def _iter_from(self, start: int) -> Iterator[Tuple[Any, int]]:
+        """Iterate the entries in ascending order from position start"""
+
+        for block in self._blocks:
+            if start >= len(block):
+                start -= len(block)
+                continue
+            yield from islice(block, start, None)
+            start = 0
+
+    def _iter_reversed_from(self, start: int) -> Iterator[Tuple[Any, int]]:
+        """Iterate the entries in descending order from (descending) position start"""
+
+        for block in reversed(self._blocks):
+            if start >= len(block):
+                start -= len(block)
+                continue
+            yield from islice(reversed(block), start, None)
+            start = 0
+
+    def ids(self, start: int, stop: int, reverse: bool = False) -> List[int]:
+        """Get the ids at positions start up to stop, in descending order if reverse"""
+
+        start = max(start, 0)
+        if stop <= start:
+            return []
+
+        entries = self._iter_reversed_from(start) if reverse else self._iter_from(start)
+        return [_id for _, _id in islice(entries, stop - start)]
+
+    def _iter_after(self, entry: Tuple[Any, int]) -> Iterator[Tuple[Any, int]]:
+        """Iterate the entries larger than entry in ascending order"""
+
+        i = bisect_right(self._maxes, entry)
+        if i == len(self._blocks):
+            return
+
+        block = self._blocks[i]
+        yield from islice(block, bisect_right(block, entry), None)
+        for block in islice(self._blocks, i + 1, None):
+            yield from block
+
+    def _iter_before(self, entry: Tuple[Any, int]) -> Iterator[Tuple[Any, int]]:
+        """Iterate the entries smaller than entry in descending order"""
+
+        i = bisect_left(self._maxes, entry)
+        if i == len(self._blocks):
+            i -= 1
+            if i < 0:
+                return
+
+        block = self._blocks[i]
+        yield from reversed(block[: bisect_left(block, entry)])
+        for block in reversed(self._blocks[:i]):
+            yield from reversed(block)
+
+    def ids_after(
+        self, entry: Tuple[Any, int], count: int, reverse: bool = False
+    ) -> List[int]:
+        """Get the ids of the count entries following entry (keyset pagination)
+
+        The entry does not have to be in the index (anymore), iteration continues from
+        the position it would have had. In descending order if reverse.
+        """
+
+        entries = self._iter_before(entry) if reverse else self._iter_after(entry)
+        return [_id for _, _id in islice(entries, max(count, 0))]
+
+    def iter_entries(
+        self, after: Optional[Tuple[Any, int]] = None, reverse: bool = False
+    ) -> Iterator[Tuple[Any, int]]:
+        """Lazily iterate the entries (following after, when given), in descending
+        order if reverse"""
+
+        if after is not None:
+            return self._iter_before(after) if reverse else self._iter_after(after)
+        return self._iter_reversed_from(0) if reverse else self._iter_from(0)
+
+    def iter_range(
+        self,
+        low: Optional[Any] = None,
+        high: Optional[Any] = None,
+        reverse: bool = False,
+        after: Optional[Tuple[Any, int]] = None,
+    ) -> Iterator[Tuple[Any, int]]:
+        """Lazily iterate the entries whose key is in [low, high) (None leaves the
+        range open), following after when given and in descending order if reverse
+
+        The iteration seeks to the start of the range, so the cost grows with the
+        number of entries in the range instead of the size of the index.
+        """
+
+        if reverse:
+            start = None if high is None else (high, float("-inf"))
+            if after is not None and (start is None or after < start):
+                start = after
+            entries = self.iter_entries(start, reverse=True)
+            if low is None:
+                return entries
+            return takewhile(lambda entry: entry[0] >= low, entries)
+
+        start = None if low is None else (low, float("-inf"))
+        if after is not None and (start is None or after > start):
+            start = after
+        entries = self.iter_entries(start)
+        if high is None:
+            return entries
+        return takewhile(lambda entry: entry[0] < high, entries)
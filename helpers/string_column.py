@@ -0,0 +1,84 @@
+""" Append-only column of strings packed into a single buffer """
+
+from array import array
+from bisect import bisect_right
+from itertools import accumulate, islice
+from typing import Iterable, Iterator
+
+
+class StringColumn:
+    """Strings stored as UTF-8 in one bytearray, addressed by record number
+
+    A Python string costs 49+ bytes of object overhead, a record costs its encoded
+    length plus an 8 byte offset. Records are immutable, replacing a value means
+    appending a new record (the owner of the column keeps track of the live ones).
+    """
+
+    def __init__(self):
+        self._data = bytearray()
+        self._starts = array("q", [0])
+
+    def __len__(self) -> int:
+        return len(self._starts) - 1
+
+    def __getitem__(self, record: int) -> str:
+        return self._data[self._starts[record] : self._starts[record + 1]].decode()
+
+    @property
+    def nbytes(self) -> int:
+        """Memory used by the buffer and the offsets"""
+
+        return len(self._data) + self._starts.itemsize * len(self._starts)
+
+    def raw(self, record: int) -> bytes:
+        """Get the encoded value of a record"""
+
+        return bytes(self._data[self._starts[record] : self._starts[record + 1]])
+
+    def append(self, value: str) -> int:
+        """Append a value, return its record number"""
+
+        return self.append_raw(value.encode())
+
+    def append_raw(self, value: bytes) -> int:
+        """Append an encoded value, return its record number"""
+
+        self._data += value
+        self._starts.append(len(self._data))
+        return len(self._starts) - 2
+
+    def extend(self, values: Iterable[str]) -> range:
+        """Append values in one go, return their record numbers"""
+
+        first = len(self)
+        encoded = [value.encode() for value in values]
+        ends = accumulate(map(len, encoded), initial=len(self._data))
+        self._starts.extend(islice(ends, 1, None))
+        self._data += b"".join(encoded)
+        return range(first, len(self))
+
+    def find(self, value: str) -> Iterator[int]:
+        """Get the numbers of the records containing value, in record order
+
+        UTF-8 is self-synchronizing, so a substring of the encoded buffer is a
+        substring of the encoded records. The entire buffer is scanned by bytes.find
+        (in C), only the hits are mapped to their record.
+        """
+
+        needle = value.encode()
+        if not needle:
+            yield from range(len(self))
+            return
+
+        position = self._data.find(needle)
+        while position != -1:
+            record = bisect_right(self._starts, position) - 1
+            end = self._starts[record + 1]
+
+            # A hit spanning two records is not a match, the next record can still
+            # contain one though
+            if position + len(needle) <= end:
+                yield record
+                position = self._data.find(needle, end)
+            else:
+                position = self._data.find(needle, position + 1)
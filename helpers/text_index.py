@@ -0,0 +1,160 @@
+""" Inverted word index with BM25 ranking for full-text search """
+
+import re
+from collections import Counter
+from math import log
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple
+
+# Words are runs of letters and digits, like the unicode61 tokenizer of SQLite FTS5
+WORD = re.compile(r"[^\W_]+")
+PHRASE = re.compile(r'"([^"]*)"')
+
+# BM25 parameters, the title weighs twice as much as the description
+K1 = 1.2
+B = 0.75
+TITLE_WEIGHT = 2
+DESCRIPTION_WEIGHT = 1
+
+# Scores are turned into integer ranks (lower is better), which keeps them usable as
+# sort keys in cursors
+SCORE_SCALE = 1_000_000
+
+
+def tokenize(text: str) -> List[str]:
+    """Get the lower case words of a text"""
+
+    return WORD.findall(text.lower())
+
+
+def parse_query(query: str) -> Tuple[List[str], List[List[str]]]:
+    """Get the distinct words and the phrases (quoted words) of a search query
+
+    Every word must be in a matching todo, the words of a phrase must follow each
+    other in the same field.
+    """
+
+    phrases = [tokenize(x) for x in PHRASE.findall(query)]
+    words = list(dict.fromkeys(tokenize(query)))
+    return words, [phrase for phrase in phrases if len(phrase) > 1]
+
+
+def score_rank(score: float) -> int:
+    """Get the rank of a BM25 score, the best scores have the lowest ranks"""
+
+    return -round(score * SCORE_SCALE)
+
+
+def pairs(words: List[str]) -> List[str]:
+    """Get the adjacent word pairs of a field or phrase"""
+
+    return [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+def contains_phrase(words: List[str], phrase: List[str]) -> bool:
+    """Check whether the phrase is a run of the words"""
+
+    return f" {' '.join(phrase)} " in f" {' '.join(words)} "
+
+
+class TextIndex:
+    """Incrementally maintained inverted index over the title and description
+
+    The posting list of a word maps the keys containing it to the weighted number of
+    occurrences, which is all BM25 needs besides the (weighted) field lengths. Adjacent
+    word pairs have posting lists as well, so a phrase query only checks the todos
+    containing every pair of the phrase, instead of every todo containing its words.
+    """
+
+    def __init__(self, weights: Sequence[int] = (TITLE_WEIGHT, DESCRIPTION_WEIGHT)):
+        self.weights = weights
+        self._postings: Dict[str, Dict[int, int]] = {}
+        self._lengths: Dict[int, int] = {}
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return len(self._lengths)
+
+    def _terms(self, fields: Sequence[str]) -> Tuple[Counter, int]:
+        """Get the weighted occurrences of the words and pairs and the length"""
+
+        terms, length = Counter(), 0
+        for weight, field in zip(self.weights, fields):
+            words = tokenize(field)
+            length += weight * len(words)
+            if weight == 1:
+                terms.update(words + pairs(words))
+            else:
+                for term in words + pairs(words):
+                    terms[term] += weight
+        return terms, length
+
+    def add(self, key: int, *fields: str):
+        """Index the fields (title, description) under key, key must not be indexed"""
+
+        terms, length = self._terms(fields)
+        for term, count in terms.items():
+            self._postings.setdefault(term, {})[key] = count
+        self._lengths[key] = length
+        self._total_length += length
+
+    def remove(self, key: int, *fields: str):
+        """Remove key from the index, fields must be the indexed version"""
+
+        terms, _ = self._terms(fields)
+        for term in terms:
+            posting = self._postings[term]
+            del posting[key]
+            if not posting:
+                del self._postings[term]
+        self._total_length -= self._lengths.pop(key)
+
+    def search(
+        self, query: str, fields: Callable[[int], Sequence[str]]
+    ) -> Iterator[Tuple[int, float]]:
+        """Get the (key, BM25 score) pairs of the keys matching the query
+
+        Only the shortest posting list of the query terms is walked, the others are
+        probed. fields(key) gets the indexed fields of a key, it's only called to check
+        the phrases longer than a word pair.
+        """
+
+        words, phrases = parse_query(query)
+        terms = words + [pair for phrase in phrases for pair in pairs(phrase)]
+        if not terms:
+            return
+
+        postings = []
+        for term in dict.fromkeys(terms):
+            posting = self._postings.get(term)
+            if posting is None:
+                return
+            postings.append(posting)
+
+        # Lucene's idf, which stays positive for words in most of the todos. The words
+        # come first in the terms, so their posting lists do as well.
+        count = len(self._lengths)
+        average_length = self._total_length / count
+        weighted = [
+            (posting, log(1 + (count - len(posting) + 0.5) / (len(posting) + 0.5)))
+            for posting in postings[: len(words)]
+        ]
+        long_phrases = [phrase for phrase in phrases if len(phrase) > 2]
+
+        shortest = min(postings, key=len)
+        others = [posting for posting in postings if posting is not shortest]
+        for key in shortest:
+            if not all(key in posting for posting in others):
+                continue
+            if long_phrases:
+                indexed = [tokenize(field) for field in fields(key)]
+                if not all(
+                    any(contains_phrase(x, phrase) for x in indexed)
+                    for phrase in long_phrases
+                ):
+                    continue
+
+            norm = K1 * (1 - B + B * self._lengths[key] / average_length)
+            yield key, sum(
+                idf * posting[key] * (K1 + 1) / (posting[key] + norm)
+                for posting, idf in weighted
+            )
@@ -0,0 +1,82 @@
+""" Character trigram inverted index to find substring candidates fast """
+
+from typing import Dict, Iterator, Set, Tuple
+
+
+def trigrams(value: str) -> Set[str]:
+    """Get the set of character trigrams of a (lower case) string"""
+
+    return {value[i : i + 3] for i in range(len(value) - 2)}
+
+
+class TrigramIndex:
+    """Incrementally maintained trigram posting-list index
+
+    Every indexed value is stored in lower case and every trigram of it points to the
+    keys containing that trigram. A string can only be a substring of a value when all
+    of its trigrams are present in that value, so intersecting the posting lists of the
+    query trigrams yields a (small) superset of the values containing the query.
+    """
+
+    def __init__(self):
+        # Posting lists are dicts used as insertion ordered sets, this keeps the
+        # candidates in a deterministic order
+        self._postings: Dict[str, Dict[int, None]] = {}
+        self._values: Dict[int, str] = {}
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def add(self, key: int, value: str):
+        """Index value under key, replacing the previously indexed value"""
+
+        if key in self._values:
+            self.remove(key)
+
+        value = value.lower()
+        self._values[key] = value
+        for trigram in trigrams(value):
+            self._postings.setdefault(trigram, {})[key] = None
+
+    def remove(self, key: int):
+        """Remove key from the index"""
+
+        value = self._values.pop(key, None)
+        if value is None:
+            return
+
+        for trigram in trigrams(value):
+            posting = self._postings[trigram]
+            del posting[key]
+            if not posting:
+                del self._postings[trigram]
+
+    def search(self, query: str) -> Iterator[Tuple[int, str]]:
+        """Get the (key, lower case value) pairs of all values containing the query"""
+
+        query = query.lower()
+        query_trigrams = trigrams(query)
+
+        # Queries shorter than a trigram cannot use the posting lists
+        if not query_trigrams:
+            candidates = self._values
+        else:
+            postings = []
+            for trigram in query_trigrams:
+                posting = self._postings.get(trigram)
+                if posting is None:
+                    return
+                postings.append(posting)
+
+            # Walk the shortest posting list and probe the others
+            postings.sort(key=len)
+            candidates, others = postings[0], postings[1:]
+            candidates = (
+                key for key in candidates if all(key in other for other in others)
+            )
+
+        # Trigrams do not encode their position, so verify the actual substring
+        for key in candidates:
+            value = self._values[key]
+            if query in value:
+                yield key, value
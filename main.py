@@ -1,13 +1,43 @@
+import logging
+import os
+from argparse import ArgumentParser
+from contextlib import asynccontextmanager
 import uvicorn
 from fastapi import FastAPI
+from helpers.metrics import MetricsMiddleware, instrument_routes
+from helpers.profiling import ProfilingMiddleware
+from settings import SERVER_WORKERS, TODO_STORAGE, USER_DATABASE_PATH
+from storage.factory import seed_todo_storage, seed_stats
 
+logger = logging.getLogger("uvicorn.error")
 
-def init_app():
-    lifespan = None
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Seed the todo storage before serving requests and close it on shutdown
+
+    Seeding is kept out of the imports, so importing the routes (e.g. in the tests)
+    stays fast.
+    """
+
+    import routes.todos
+
+    storage = routes.todos.todos
+    seeded = await storage.run(seed_todo_storage, storage)
+    logger.info("Seeded %d todos in %.2f seconds", seeded, seed_stats["seconds"])
+
+    yield
+
+    storage.close()
+
+
+def init_app():
     app = FastAPI(title="FastAPI TODO server", lifespan=lifespan)
     from routes.authenticate import router as auth_router
+    from routes.metrics import router as metrics_router
+    from routes.profiles import router as profiles_router
     from routes.root import router as root_router
+    from routes.stats import router as stats_router
     from routes.todos import router as todo_router
 
     # Redirect router
@@ -19,9 +49,55 @@ def init_app():
     # routes todos
     app.include_router(todo_router, prefix="/api", tags=["ToDos"])
 
+    # routes statistics
+    app.include_router(stats_router, prefix="/api", tags=["Statistics"])
+
+    # routes profiles
+    app.include_router(profiles_router, prefix="/api", tags=["Profiles"])
+
+    # routes metrics
+    app.include_router(metrics_router)
+
+    # Opt-in profiling of single requests for admins, added first so it runs inside
+    # the metrics middleware and profiled requests are still counted
+    app.add_middleware(ProfilingMiddleware)
+
+    # Per route request metrics, the routes label the requests for the middleware
+    instrument_routes(app.router)
+    app.add_middleware(MetricsMiddleware)
+
     return app
 
 
+def serve(host: str = "127.0.0.1", port: int = 8000, workers: int = SERVER_WORKERS):
+    """Serve the app, in several worker processes when workers > 1
+
+    Every worker holds its own caches, the state shared by the workers lives in the
+    SQLite database and the user database file. Changes by one worker reach the
+    caches of the others through counters shared in memory mapped files.
+    """
+
+    if workers <= 1:
+        uvicorn.run(init_app(), host=host, port=port)
+        return
+
+    if TODO_STORAGE != "sqlite" or USER_DATABASE_PATH is None:
+        raise SystemExit(
+            "Multiple workers need TODO_STORAGE=sqlite and a USER_DATABASE_PATH, "
+            "the other storage engines only live in the memory of one process"
+        )
+
+    # Workers are started from the import string, every worker builds its own app and
+    # reads its settings from the environment
+    os.environ["SERVER_WORKERS"] = str(workers)
+    uvicorn.run("main:init_app", factory=True, host=host, port=port, workers=workers)
+
+
 if __name__ == "__main__":
-    fastapi_app = init_app()
-    uvicorn.run(fastapi_app, host="127.0.0.1", port=8000)
+    parser = ArgumentParser(description="Run the FastAPI TODO server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=SERVER_WORKERS)
+    args = parser.parse_args()
+
+    serve(args.host, args.port, args.workers)
@@ -1,27 +1,44 @@
-import lorem
 import random
-from datetime import datetime, timedelta
+from datetime import date, datetime, time, timedelta
+from typing import List, Optional
+from lorem.data import WORDS
 from models.todo_models import ToDoModel
 
 
-def random_date_within_range():
-    # Get the current date
-    current_date = datetime.now()
-    start_date = current_date + timedelta(days=7)
-    end_date = current_date + timedelta(days=365)
-    random_date = start_date + timedelta(
-        days=random.randint(0, (end_date - start_date).days)
-    )
-    return random_date
-
-
-mock_todos = [
-    ToDoModel(
-        id=x,
-        title=lorem.sentence(),
-        description=lorem.paragraph(),
-        completed=random.choice([True, False]),
-        due_date=random_date_within_range(),
-    )
-    for x in range(1000)
-]
+def random_sentence(rng: random.Random) -> str:
+    """Get a lorem ipsum sentence of 4 up to 8 words (like lorem.sentence)"""
+
+    sentence = " ".join(rng.choices(WORDS, k=rng.randint(4, 8)))
+    return sentence[0].upper() + sentence[1:] + "."
+
+
+def random_paragraph(rng: random.Random) -> str:
+    """Get a lorem ipsum paragraph of 5 up to 10 sentences (like lorem.paragraph)"""
+
+    return " ".join(random_sentence(rng) for _ in range(rng.randint(5, 10)))
+
+
+def generate_todos(
+    count: int = 1000, seed: Optional[int] = None, start: Optional[datetime] = None
+) -> List[ToDoModel]:
+    """Generate count todos with ids 0 up to count
+
+    The todos only depend on the seed and on start (midnight today by default), the
+    due dates are 7 up to 365 days after start. lorem draws from the global random
+    state, so the text is generated from lorem's words with a random.Random of our own.
+    """
+
+    rng = random.Random(seed)
+    if start is None:
+        start = datetime.combine(date.today(), time())
+
+    return [
+        ToDoModel(
+            id=x,
+            title=random_sentence(rng),
+            description=random_paragraph(rng),
+            completed=rng.random() < 0.5,
+            due_date=start + timedelta(days=rng.randint(7, 365)),
+        )
+        for x in range(count)
+    ]
@@ -1,41 +1,181 @@
 """Mock user database"""
 
+import shelve
+from contextlib import contextmanager
+from threading import RLock
+from typing import Callable, Dict, Iterator, List, Optional
+from helpers.shared_counters import SharedCounters
+
+DEFAULT_USERS = [
+    {
+        "_id": 0,
+        "username": "admin",
+        "full_name": "Admin",
+        "email": "admin@example.com",
+        "hashed_password": "$2b$12$B1jLytNj3vUxgrQ4TABeNOdVBxuJmXee0N6Cjf90m47XmB7YHHOHa",
+        "disabled": False,
+        "is_admin": True,
+    }
+]
+
 
 class MockUserDatabase:
-    """Simple mock user database CRUD simulator"""
-
-    def __init__(self):
-        self.user_data = [
-            {
-                "_id": 0,
-                "username": "admin",
-                "full_name": "Admin",
-                "email": "admin@example.com",
-                "hashed_password": "$2b$12$B1jLytNj3vUxgrQ4TABeNOdVBxuJmXee0N6Cjf90m47XmB7YHHOHa",
-                "disabled": False,
-                "is_admin": True,
-            }
-        ]
+    """Simple mock user database CRUD simulator
+
+    Users are indexed by username, so lookups, adds and deletes are O(1). All access is
+    guarded by a lock, which makes a single instance safe to share process-wide. When a
+    path is given the users are also written through to a shelve file on disk and
+    loaded from it on start, otherwise the users only live in memory.
+
+    A shelve file can be shared by several processes (e.g. workers): writes open it
+    under a lock shared by the processes and bump a shared generation counter. A
+    process sees the counter change on its next lookup (or refresh()) and reloads
+    the users.
+
+    Listeners are called with the username whenever a user is updated or deleted, e.g.
+    to invalidate caches holding that user. This includes updates and deletes by other
+    processes.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self._lock = RLock()
+        self._listeners: List[Callable[[str], None]] = []
+        self._path = path
+        self._generation = None
+        self._loaded_generation = 0
+        self.user_data: Dict[str, dict] = {}
+
+        if path is not None:
+            self._generation = SharedCounters(f"{path}.generation", 1)
+            with self._shelf() as shelf:
+                self._load(shelf)
+
+        # Seed an empty database
+        if not self.user_data:
+            for user in DEFAULT_USERS:
+                self.add_user(dict(user))
+
+    @contextmanager
+    def _shelf(self) -> Iterator[shelve.Shelf]:
+        """Open the shelve file, excluding the other processes"""
+
+        with self._lock, self._generation.lock():
+            with shelve.open(self._path) as shelf:
+                yield shelf
+
+    def _load(self, shelf: shelve.Shelf):
+        """Load the users from the (locked) shelve file, notify the changed users"""
+
+        previous, self.user_data = self.user_data, dict(shelf)
+        self._loaded_generation = self._generation[0]
+
+        for username, user in previous.items():
+            if self.user_data.get(username) != user:
+                self._notify(username)
+
+    def _write(self, shelf: shelve.Shelf, username: str, user: Optional[dict]):
+        """Write a user (None deletes it) to the (locked and loaded) shelve file"""
+
+        if user is None:
+            shelf.pop(username, None)
+            self.user_data.pop(username, None)
+        else:
+            shelf[username] = user
+            self.user_data[username] = user
+
+        self._generation[0] += 1
+        self._loaded_generation = self._generation[0]
+
+    def refresh(self):
+        """Reload the users when another process changed them"""
+
+        if self._generation is None:
+            return
+        if self._generation[0] != self._loaded_generation:
+            with self._shelf() as shelf:
+                self._load(shelf)
+
+    def add_listener(self, listener: Callable[[str], None]):
+        """Call listener(username) when a user is updated or deleted"""
+
+        self._listeners.append(listener)
+
+    def _notify(self, username: str):
+        for listener in self._listeners:
+            listener(username)
 
     def get_user(self, username):
         """Get user from database by username"""
 
-        for user in self.user_data:
-            if user["username"] == username:
-                return user
-        return {}
+        self.refresh()
+        user = self.user_data.get(username)
+
+        # Return a copy, callers must not be able to alter the stored user
+        return {} if user is None else dict(user)
 
     def add_user(self, user):
-        """Add user to database"""
+        """Add user to database, return False (keeping the existing user) when the
+        username is taken"""
+
+        username = user["username"]
+        with self._lock:
+            if self._generation is None:
+                if username in self.user_data:
+                    return False
+                self.user_data[username] = user
+                return True
+
+            # Checked on the reloaded users, another process may have added it
+            with self._shelf() as shelf:
+                self._load(shelf)
+                if username in self.user_data:
+                    return False
+                self._write(shelf, username, user)
+        return True
 
-        self.user_data.append(user)
+    def update_user(self, username, changes):
+        """Update fields (e.g. disabled) of a user, return whether the user exists"""
+
+        with self._lock:
+            self.refresh()
+            user = self.user_data.get(username)
+            if user is None:
+                return False
+
+            user = {**user, **changes, "username": username}
+            if self._generation is None:
+                self.user_data[username] = user
+            else:
+                with self._shelf() as shelf:
+                    self._load(shelf)
+                    self._write(shelf, username, user)
+
+        self._notify(username)
+        return True
 
     def delete_user(self, username):
-        """Delete user from database by username"""
+        """Delete user from database by username, return whether the user existed"""
 
-        users = []
-        for user in self.user_data:
-            if user["username"] != username:
-                users.append(user)
-        self.user_data = users
+        with self._lock:
+            if self._generation is None:
+                user = self.user_data.pop(username, None)
+            else:
+                with self._shelf() as shelf:
+                    self._load(shelf)
+                    user = self.user_data.get(username)
+                    if user is not None:
+                        self._write(shelf, username, None)
+
+        if user is None:
+            return False
+
+        self._notify(username)
         return True
+
+    def close(self):
+        """Close the on-disk backing"""
+
+        with self._lock:
+            if self._generation is not None:
+                self._generation.close()
+                self._generation = None
@@ -0,0 +1,66 @@
+""" Binary todo snapshots to seed (large) datasets fast
+
+Create a snapshot with:
+
+    python -m mock_data.snapshot todos.snapshot --count 1000000 --seed 0
+"""
+
+import pickle
+from argparse import ArgumentParser
+from typing import Iterable, List
+from mock_data.generate_todos import generate_todos
+from models.todo_models import ToDoModel
+
+# Bumped when the layout of the snapshot rows changes
+SNAPSHOT_FORMAT = 1
+
+
+def save_snapshot(path: str, todos: Iterable[ToDoModel]):
+    """Save todos as a pickled list of plain row tuples"""
+
+    rows = [
+        (todo.id, todo.title, todo.description, todo.due_date, todo.completed)
+        for todo in todos
+    ]
+    with open(path, "wb") as file:
+        pickle.dump((SNAPSHOT_FORMAT, rows), file, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def load_snapshot(path: str) -> List[ToDoModel]:
+    """Load the todos of a snapshot
+
+    The rows are plain tuples, which unpickle fast (in C). They are turned into models
+    by the pydantic-core validator, which (with pydantic 2.6) is faster than
+    model_construct. Unpickling can run arbitrary code, so only load snapshots from a
+    trusted location.
+    """
+
+    with open(path, "rb") as file:
+        snapshot_format, rows = pickle.load(file)
+
+    if snapshot_format != SNAPSHOT_FORMAT:
+        raise ValueError(f"Unsupported snapshot format: {snapshot_format}")
+
+    validate = ToDoModel.__pydantic_validator__.validate_python
+    return [
+        validate(
+            {
+                "id": _id,
+                "title": title,
+                "description": description,
+                "due_date": due_date,
+                "completed": completed,
+            }
+        )
+        for _id, title, description, due_date, completed in rows
+    ]
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Save a snapshot of generated todos")
+    parser.add_argument("path", help="snapshot file to write")
+    parser.add_argument("--count", type=int, default=1_000_000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    save_snapshot(args.path, generate_todos(args.count, args.seed))
@@ -1,5 +1,6 @@
 from datetime import datetime
 from pydantic import BaseModel
+from enum import Enum
 from typing import Optional, List
 
 
@@ -20,9 +21,35 @@ class ToDoModel(BaseModel):
 
 
 class ToDoListModelPaginated(BaseModel):
-    """Paginated model"""
+    """Paginated model
+
+    next_cursor is only set when more results follow
+    """
 
     page: int
     page_size: int
     pages: int
     result: List[ToDoModel]
+    next_cursor: Optional[str] = None
+
+
+class ToDoBulkStatus(Enum):
+    """Outcome of a single item of a bulk request"""
+
+    created = "created"
+    updated = "updated"
+    deleted = "deleted"
+    not_found = "not_found"
+
+
+class ToDoBulkItemResult(BaseModel):
+    """Bulk request result of a single item"""
+
+    id: int
+    status: ToDoBulkStatus
+
+
+class ToDoBulkResult(BaseModel):
+    """Bulk request result, in the order of the request items"""
+
+    result: List[ToDoBulkItemResult]
@@ -35,7 +35,7 @@ class Authenticate:
 
         headers: {"Authorization": "Bearer token"}
         """
-        user = authenticate_user(form_data.username, form_data.password)
+        user = await authenticate_user(form_data.username, form_data.password)
         if not user:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
@@ -64,7 +64,7 @@ class Authenticate:
         Only admin users are allowed to create new users
         """
 
-        created_user = create_user(new_user, current_user)
+        created_user = await create_user(new_user, current_user)
         return created_user
 
     @staticmethod
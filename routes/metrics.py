@@ -0,0 +1,30 @@
+"""Metrics route"""
+
+from fastapi import APIRouter
+from fastapi.responses import Response
+from helpers.metrics import CONTENT_TYPE, metrics
+
+router = APIRouter()
+
+
+class Metrics:
+    @staticmethod
+    @router.get("/metrics", include_in_schema=False)
+    async def get_metrics():
+        """
+        ## Purpose:
+
+        Get the request and operation metrics in the Prometheus text format
+
+        ## Notes:
+
+         * http_requests_total: requests per method, route and status code
+         * http_requests_in_flight: requests being handled per method and route
+         * http_request_duration_seconds: latency histogram per method and route
+         * todo_operation_duration_seconds: duration histogram of the levenshtein
+           search, sorted listing, token decoding and password hashing operations
+         * Not authenticated, like most scrape targets, the metrics hold no todo or
+           user data
+        """
+
+        return Response(content=metrics.render(), media_type=CONTENT_TYPE)
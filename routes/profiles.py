@@ -0,0 +1,54 @@
+"""Profile routes"""
+
+from enum import Enum
+from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import FileResponse, PlainTextResponse
+from models.user_models import User
+from helpers.authentication import get_current_active_user, require_admin
+from helpers.profiling import profile_file, profile_report
+
+router = APIRouter()
+
+
+class ProfileFormat(str, Enum):
+    text = "text"
+    pstats = "pstats"
+
+
+class Profiles:
+    @staticmethod
+    @router.get("/profiles/{profile_id}", response_class=PlainTextResponse)
+    async def get_profile(
+        profile_id: str,
+        format: ProfileFormat = ProfileFormat.text,
+        current_user: User = Depends(get_current_active_user),
+    ):
+        """
+        ## Purpose:
+
+        Get the profile of a profiled request (admins only)
+
+        ## Notes:
+
+         * Requests of admins are profiled with an "X-Profile: 1" header or a
+           "profile=1" query parameter, the response holds the id of the profile in
+           the X-Profile-Id header
+         * format: text (the functions with the most cumulative time) or pstats (the
+           file, e.g. for snakeviz or python -m pstats)
+        """
+
+        require_admin(current_user)
+
+        filename = profile_file(profile_id)
+        if filename is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail="Profile not found"
+            )
+
+        if format is ProfileFormat.pstats:
+            return FileResponse(
+                filename,
+                media_type="application/octet-stream",
+                filename=f"{profile_id}.pstats",
+            )
+        return PlainTextResponse(profile_report(filename))
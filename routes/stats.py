@@ -0,0 +1,42 @@
+"""Statistics routes"""
+
+from typing import Dict, Union
+from fastapi import APIRouter, Depends
+from models.user_models import User
+from helpers.authentication import (
+    get_current_active_user,
+    password_hashing_pool,
+    token_cache,
+)
+from storage.factory import seed_stats
+import routes.todos
+
+router = APIRouter()
+
+
+class Statistics:
+    @staticmethod
+    @router.get("/stats", response_model=Dict[str, Dict[str, Union[int, float]]])
+    async def get_stats(current_user: User = Depends(get_current_active_user)):
+        """
+        ## Purpose:
+
+        Get runtime statistics to size the caches
+
+        ## Notes:
+
+         * todo_query_cache: size, hits, misses, evictions and expirations of the
+           /api/todos result cache
+         * todo_json_cache: the same for the serialized todo cache
+         * token_cache: the same for the verified bearer token cache
+         * password_hashing: pool size and queueing metrics of the bcrypt worker pool
+         * startup: number of todos seeded at startup and the seconds it took
+        """
+
+        return {
+            "todo_query_cache": routes.todos.todos.query_cache.stats(),
+            "todo_json_cache": routes.todos.todos.json_cache.stats(),
+            "token_cache": token_cache.stats(),
+            "password_hashing": password_hashing_pool.stats(),
+            "startup": seed_stats,
+        }
@@ -1,17 +1,52 @@
+from datetime import datetime
 from enum import Enum
-from fastapi import APIRouter, HTTPException, Depends, status
-from typing import Optional
+from fastapi import APIRouter, Body, HTTPException, Depends, Header, status
+from fastapi.responses import Response, StreamingResponse
+from typing import List, Optional
 from math import ceil
 
-from mock_data.generate_todos import mock_todos
-from models.todo_models import ToDoModel, ToDoListModelPaginated
+from models.todo_models import (
+    ToDoBulkItemResult,
+    ToDoBulkResult,
+    ToDoBulkStatus,
+    ToDoListModelPaginated,
+    ToDoModel,
+)
 from models.user_models import User
 from helpers.authentication import get_current_active_user
-from helpers.levenshtein import search_by_levenshtein
+from helpers.change_feed import ChangeFeed
+from helpers.cursor import decode_cursor, encode_cursor
+from helpers.etag import etag_matches
+from helpers.json_bytes import json_page
+from helpers.metrics import metrics
+from storage.base import ToDoFilter
+from settings import CHANGE_FEED_KEEPALIVE, CHANGE_FEED_SIZE, SERVER_WORKERS
+from storage.factory import create_todo_storage
 
 router = APIRouter()
 
-todos = mock_todos
+# Todo storage engine, seeded by the application lifespan. All calls go through
+# todos.run() which keeps storage engines doing I/O off the event loop.
+todos = create_todo_storage()
+
+# Number of todos fetched from the storage per export batch
+EXPORT_BATCH_SIZE = 500
+
+# Log of the todo changes made by the write handlers, streamed by /todos/changes. It
+# lives in the memory of this process, so it's not served with several workers.
+change_feed = ChangeFeed(CHANGE_FEED_SIZE)
+
+
+def json_response(body: bytes, etag: str) -> Response:
+    """Response with a serialized JSON body and its ETag"""
+
+    return Response(body, media_type="application/json", headers={"ETag": etag})
+
+
+def not_modified(etag: str) -> Response:
+    """Response telling the client its copy (with this ETag) is still current"""
+
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
 
 
 class SortByFields(Enum):
@@ -21,58 +56,359 @@ class SortByFields(Enum):
     due_date = "due_date"
 
 
+class SortOrder(Enum):
+    asc = "asc"
+    desc = "desc"
+
+
 class ToDos:
     @staticmethod
-    @router.get("/todos", response_model=ToDoListModelPaginated)
+    @router.get(
+        "/todos",
+        response_model=ToDoListModelPaginated,
+        response_model_exclude_none=True,
+    )
     async def get_all(
-        page: int,
         page_size: int,
+        page: int = 1,
         title: Optional[str] = None,
+        search: Optional[str] = None,
         sort_by: Optional[SortByFields] = None,
+        order: SortOrder = SortOrder.asc,
+        cursor: Optional[str] = None,
+        completed: Optional[bool] = None,
+        due_after: Optional[datetime] = None,
+        due_before: Optional[datetime] = None,
+        if_none_match: Optional[str] = Header(None),
         current_user: User = Depends(get_current_active_user),
     ):
         """
         ## Get all todos from database, filter and sort results
 
-         * filter on (a part of the) title
+         * filter on (a part of the) title, the closest titles come first and equally
+           close titles are listed by id (not in insertion order)
+         * search: full-text search on the title and description, ranked by BM25
+           relevance. Every word must match, "quoted words" must match as a phrase.
+           Can't be combined with title.
          * sort by: id, title, description or due_date
+         * order: asc (default) or desc
+         * completed: only completed (true) or open (false) todos
+         * due_after, due_before: only todos due at or after due_after and before
+           due_before, datetimes without a timezone are UTC
+         * cursor: continue after the page which returned this next_cursor, instead of
+           skipping to the requested page. A cursor is bound to the title, sort_by,
+           order and filters it was returned for.
+
+        A due date range is read from the due date index, a page costs time in
+        proportion to the number of todos in the range. The completed filter alone is
+        served from the ids of the completed and of the open todos (memory storage), a
+        page costs time in proportion to the number of matches at most. The columnar
+        storage walks the sort order instead, skipping the other todos.
+
+        The ETag changes on every write, a request with a matching If-None-Match is
+        answered with 304 Not Modified.
         """
 
-        # Filter results on title by levenshtein distance
-        _todos = todos.copy()
-        if title is not None:
-            _todos = search_by_levenshtein(title, data=_todos, field_name="title")
+        if title is not None and search is not None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Use either title or search",
+            )
+
+        # Nothing changed since the client's copy, skip the search entirely
+        version = todos.version
+        etag = todos.etag(version)
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+
+        # The title search is case-insensitive
+        title_query = None if title is None else title.lower()
+        sort_field = None if sort_by is None else sort_by.name
+        scope = (title_query, sort_field, order.name)
+        if search is not None:
+            scope += ("search", search)
+
+        # Filters are part of the scope (so of the cursors and cache keys), unfiltered
+        # scopes keep their shape so existing cursors stay valid
+        filters = ToDoFilter(completed, due_after, due_before)
+        if filters.active:
+            scope += (
+                completed,
+                None if due_after is None else due_after.isoformat(),
+                None if due_before is None else due_before.isoformat(),
+            )
 
-        # Sort by field name
-        if sort_by is not None:
-            _todos = sorted(_todos, key=lambda x: getattr(x, sort_by.name))
+        # Serve repeated queries from the cache, the storage version changes on
+        # every write
+        cache_key = (version, scope, page, page_size, cursor)
+        body = todos.query_cache.get(cache_key)
+        if body is not None:
+            return json_response(body, etag)
+
+        # Decode the last seen sort key from the cursor
+        after = None
+        if cursor is not None:
+            try:
+                after = decode_cursor(cursor, scope)
+            except ValueError as exc:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc)
+                ) from exc
 
         # Calculate the offset for pagination
         offset = (page - 1) * page_size
-        pages = ceil(len(_todos) / page_size)
+
+        # Filter results on title by levenshtein distance (or on the words of a search,
+        # ranked by BM25) and sort by field name, only the requested page is ranked.
+        # With a cursor the page is a seek instead.
+        operation = "sorted_listing" if title is None else "levenshtein_search"
+        if search is not None:
+            operation = "bm25_search"
+        elif title is None and filters.active:
+            operation = "filtered_listing"
+        try:
+            with metrics.timer(operation):
+                query_result = await todos.run(
+                    todos.query,
+                    title=title,
+                    sort_by=sort_field,
+                    offset=offset,
+                    limit=page_size,
+                    descending=order is SortOrder.desc,
+                    after=after,
+                    filters=filters,
+                    search=search,
+                )
+        except ValueError as exc:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor"
+            ) from exc
+        pages = ceil(query_result.total / page_size)
 
         # Create paginated result
-        result = ToDoListModelPaginated(
-            page_size=page_size,
+        next_cursor = None
+        if query_result.next_key is not None:
+            next_cursor = encode_cursor(scope, query_result.next_key)
+
+        # Assemble the page from the cached JSON of the todos, returning a Response
+        # skips the validation and serialization against the response_model (which
+        # documents the body)
+        body = json_page(
             page=page,
+            page_size=page_size,
             pages=pages,
-            result=[x for x in _todos[offset : offset + page_size]],
+            result=map(todos.todo_json, query_result.todos),
+            next_cursor=next_cursor,
+        )
+        todos.query_cache.set(cache_key, body)
+        return json_response(body, etag)
+
+    @staticmethod
+    @router.get("/todos/export", response_class=StreamingResponse)
+    async def export(
+        title: Optional[str] = None,
+        search: Optional[str] = None,
+        sort_by: Optional[SortByFields] = None,
+        order: SortOrder = SortOrder.asc,
+        completed: Optional[bool] = None,
+        due_after: Optional[datetime] = None,
+        due_before: Optional[datetime] = None,
+        current_user: User = Depends(get_current_active_user),
+    ):
+        """
+        ## Export all todos as newline delimited JSON
+
+         * filter on (a part of the) title
+         * search: full-text search on the title and description, as on /todos
+         * sort by: id, title, description or due_date
+         * order: asc (default) or desc
+         * completed, due_after, due_before: filters, as on /todos
+
+        The todos are streamed in batches, so an export of the entire database runs in
+        constant memory and writes during the export do not corrupt it.
+        """
+
+        if title is not None and search is not None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Use either title or search",
+            )
+
+        # Bind the storage now, the export keeps reading from it between batches
+        storage = todos
+        batches = storage.iter_batches(
+            title=title,
+            sort_by=None if sort_by is None else sort_by.name,
+            descending=order is SortOrder.desc,
+            batch_size=EXPORT_BATCH_SIZE,
+            filters=ToDoFilter(completed, due_after, due_before),
+            search=search,
+        )
+
+        async def ndjson_lines():
+            while True:
+                batch = await storage.run(next, batches, None)
+                if batch is None:
+                    return
+                yield b"".join(storage.todo_json(todo) + b"\n" for todo in batch)
+
+        return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
+
+    @staticmethod
+    @router.get("/todos/changes", response_class=StreamingResponse)
+    async def changes(
+        after: Optional[str] = None,
+        last_event_id: Optional[str] = Header(None),
+        current_user: User = Depends(get_current_active_user),
+    ):
+        """
+        ## Stream the todo changes as Server-Sent Events
+
+        Every create, update and delete is an event (created, updated or deleted) with
+        a sequence number. The data is the JSON of the change, the todo is included for
+        created and updated todos.
+
+         * after: resume after the event with this id, by default only new changes are
+           streamed. A reconnecting EventSource resumes with its Last-Event-ID header.
+
+        Only the latest changes are kept. When the changes to resume from are gone, or
+        the id is from a previous run of the server, a reset event is sent. The client
+        reloads the todos and continues from the id of the reset.
+
+        The changes are kept by the server process, the feed is not available when
+        serving from several workers (501).
+        """
+
+        if SERVER_WORKERS > 1:
+            raise HTTPException(
+                status_code=status.HTTP_501_NOT_IMPLEMENTED,
+                detail="The change feed is not available with several workers",
+            )
+
+        return StreamingResponse(
+            change_feed.stream(after or last_event_id, CHANGE_FEED_KEEPALIVE),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache"},
+        )
+
+    @staticmethod
+    @router.post("/todos/bulk", response_model=ToDoBulkResult)
+    async def bulk_post(
+        body: List[ToDoModel],
+        current_user: User = Depends(get_current_active_user),
+    ):
+        """
+        ## Create new todos in bulk
+
+        All todos are validated before any is stored and get a new id from a single
+        block of ids. The result lists the id of every todo in request order.
+        """
+
+        new_todos = await todos.run(
+            todos.bulk_create, [ToDoModel(**x.model_dump()) for x in body]
+        )
+        change_feed.publish(
+            ("created", todo.id, todos.todo_json(todo)) for todo in new_todos
+        )
+        return ToDoBulkResult(
+            result=[
+                ToDoBulkItemResult(id=todo.id, status=ToDoBulkStatus.created)
+                for todo in new_todos
+            ]
+        )
+
+    @staticmethod
+    @router.put("/todos/bulk", response_model=ToDoBulkResult)
+    async def bulk_put(
+        body: List[ToDoModel],
+        current_user: User = Depends(get_current_active_user),
+    ):
+        """
+        ## Create or update todos in bulk
+
+         * todos with an existing id are updated
+         * todos with an unknown id are created under that id
+         * todos without an id are created under a new id
+
+        The request is applied atomically, when the ids are not unique nothing is
+        stored. The result lists per todo whether it was created or updated.
+        """
+
+        try:
+            with todos.writing(todo.id for todo in body if todo.id is not None):
+                upserted = await todos.run(todos.bulk_upsert, body)
+        except ValueError as exc:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc)
+            ) from exc
+        change_feed.publish(
+            ("created" if created else "updated", todo.id, todos.todo_json(todo))
+            for todo, created in upserted
+        )
+
+        return ToDoBulkResult(
+            result=[
+                ToDoBulkItemResult(
+                    id=todo.id,
+                    status=(
+                        ToDoBulkStatus.created if created else ToDoBulkStatus.updated
+                    ),
+                )
+                for todo, created in upserted
+            ]
+        )
+
+    @staticmethod
+    @router.delete("/todos/bulk", response_model=ToDoBulkResult)
+    async def bulk_delete(
+        ids: List[int] = Body(),
+        current_user: User = Depends(get_current_active_user),
+    ):
+        """
+        ## Delete todos in bulk
+
+        The result lists per id whether it was deleted or not found
+        """
+
+        with todos.writing(ids):
+            deleted = await todos.run(todos.bulk_delete, ids)
+        change_feed.publish(
+            ("deleted", _id, None) for _id, found in zip(ids, deleted) if found
+        )
+        return ToDoBulkResult(
+            result=[
+                ToDoBulkItemResult(
+                    id=_id,
+                    status=(
+                        ToDoBulkStatus.deleted if found else ToDoBulkStatus.not_found
+                    ),
+                )
+                for _id, found in zip(ids, deleted)
+            ]
         )
-        return result
 
     @staticmethod
     @router.get("/todos/{_id}", response_model=ToDoModel)
     async def get(
         _id: int,
+        if_none_match: Optional[str] = Header(None),
         current_user: User = Depends(get_current_active_user),
     ):
         """
         ## Get todo from database by id
+
+        The ETag changes when the todo is written, a request with a matching
+        If-None-Match is answered with 304 Not Modified.
         """
 
-        for todo in todos:
-            if todo.id == _id:
-                return todo
+        # The todo did not change since the client's copy, skip reading it
+        etag = todos.todo_etag(_id)
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+
+        todo = await todos.run(todos.get, _id)
+        if todo is not None:
+            return json_response(todos.todo_json(todo), etag)
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Todo not found"
         )
@@ -87,23 +423,14 @@ class ToDos:
         ## Create new todo
         """
 
-        global todos
         if not body:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST, detail="Task is required"
             )
 
-        # Find the maximum ID in the list of todos and create a new ID
-        ids = [x.id for x in todos]
-        max_id = max(ids) if ids else 0
-        new_id = max_id + 1
-
-        # Get body data and add new ID
-        body.id = new_id
-        new_todo = ToDoModel(**body.model_dump())
-
-        # Store data
-        todos.append(new_todo)
+        # Store data, the storage hands out the new ID
+        new_todo = await todos.run(todos.create, ToDoModel(**body.model_dump()))
+        change_feed.publish([("created", new_todo.id, todos.todo_json(new_todo))])
         return new_todo
 
     @staticmethod
@@ -117,12 +444,14 @@ class ToDos:
         ## Update todo
         """
 
-        global todos
-        for i, todo in enumerate(todos):
-            if todo.id == _id:
-                body.id = _id
-                todos[i] = body
-                return body
+        with todos.writing([_id]):
+            todo = await todos.run(todos.update, _id, body)
+
+        # Serializing the updated todo replaces its cached JSON
+        if todo is not None:
+            serialized = todos.todo_json(todo)
+            change_feed.publish([("updated", _id, serialized)])
+            return json_response(serialized, todos.todo_etag(_id))
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Todo not found"
         )
@@ -137,6 +466,8 @@ class ToDos:
         ## Delete todo
         """
 
-        global todos
-        todos = [todo for todo in todos if todo.id != _id]
+        with todos.writing([_id]):
+            deleted = await todos.run(todos.delete, _id)
+        if deleted:
+            change_feed.publish([("deleted", _id, None)])
         return {"message": "Todo deleted"}
@@ -0,0 +1,36 @@
+"""Deployment settings, read from the environment"""
+
+import os
+
+# Optional file (a shelve) backing the user database, users are kept in memory only
+# when it's not set
+USER_DATABASE_PATH = os.environ.get("USER_DATABASE_PATH") or None
+
+# Number of server processes (see main.py), more than one worker needs state shared
+# by the workers: the sqlite storage and a USER_DATABASE_PATH
+SERVER_WORKERS = int(os.environ.get("SERVER_WORKERS", "1"))
+
+# Todo storage engine: "memory", "columnar" (compact, for millions of todos) or
+# "sqlite"
+TODO_STORAGE = os.environ.get("TODO_STORAGE", "memory")
+
+# SQLite database file and the number of pooled connections (worker threads)
+TODO_DATABASE_PATH = os.environ.get("TODO_DATABASE_PATH", "todos.sqlite3")
+TODO_DATABASE_POOL_SIZE = int(os.environ.get("TODO_DATABASE_POOL_SIZE", "4"))
+
+# Todos seeded into an empty storage at startup, loaded from a snapshot (see
+# mock_data/snapshot.py) when TODO_SNAPSHOT_PATH is set and generated otherwise
+TODO_SNAPSHOT_PATH = os.environ.get("TODO_SNAPSHOT_PATH") or None
+TODO_SEED_COUNT = int(os.environ.get("TODO_SEED_COUNT", "1000"))
+TODO_SEED_RANDOM_SEED = int(os.environ.get("TODO_SEED_RANDOM_SEED", "0"))
+
+# Directory the profiles of profiled requests (see helpers/profiling.py) are stored in
+PROFILE_PATH = os.environ.get("PROFILE_PATH", "profiles")
+
+# Number of profiles kept in PROFILE_PATH, the oldest ones are deleted beyond it
+PROFILE_LIMIT = int(os.environ.get("PROFILE_LIMIT", "100"))
+
+# Number of todo changes kept for clients resuming the change feed, and the seconds
+# between keep-alive comments sent to idle subscribers
+CHANGE_FEED_SIZE = int(os.environ.get("CHANGE_FEED_SIZE", "10000"))
+CHANGE_FEED_KEEPALIVE = float(os.environ.get("CHANGE_FEED_KEEPALIVE", "15"))
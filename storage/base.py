@@ -0,0 +1,390 @@
+"""Todo storage interface shared by the storage engines"""
+
+import heapq
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from array import array
+from datetime import datetime, timedelta, timezone
+from itertools import count
+from operator import attrgetter
+from secrets import token_hex
+from typing import (
+    Any,
+    Callable,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
+from helpers.lru_cache import LRUCache
+from models.todo_models import ToDoModel
+
+# Query cache settings, the cache is keyed on the storage version so the time to live
+# only bounds how long unused pages linger
+QUERY_CACHE_SIZE = 1024
+QUERY_CACHE_TTL = 60
+
+# Serialized todo cache settings, entries are checked against the todo they are served
+# for, so they never go stale and only need to be bounded
+JSON_CACHE_SIZE = 100_000
+JSON_CACHE_TTL = 3600
+
+# Todo ids are hashed into a fixed number of version slots (ETags), a write to a todo in
+# the same slot only costs a client a 200 instead of a 304
+TODO_VERSION_SLOTS = 65536
+
+# Serializes a todo straight to JSON bytes, the same JSON FastAPI produces for it
+TODO_SERIALIZER = ToDoModel.__pydantic_serializer__
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+NAIVE_EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+
+def datetime_key(value: datetime) -> int:
+    """Get a datetime as epoch microseconds
+
+    Due dates can be naive (generated) or timezone aware (posted), which cannot be
+    compared with each other. Naive datetimes are considered to be UTC.
+    """
+
+    if value.tzinfo is None:
+        return (value - NAIVE_EPOCH) // MICROSECOND
+    return (value - EPOCH) // MICROSECOND
+
+
+def due_date_key(todo: ToDoModel) -> int:
+    """Get the due date as epoch microseconds (see datetime_key)"""
+
+    return datetime_key(todo.due_date)
+
+
+# Sort keys (and their types) of the fields todos can be sorted by
+SORT_KEYS = {
+    "id": attrgetter("id"),
+    "title": attrgetter("title"),
+    "description": attrgetter("description"),
+    "due_date": due_date_key,
+}
+SORT_KEY_TYPES = {"id": int, "title": str, "description": str, "due_date": int}
+
+# Title searches rank matches within this levenshtein distance
+SEARCH_SCORE_CUTOFF = 20
+
+
+class QueryResult(NamedTuple):
+    """Result of a storage query
+
+    next_key is the sort key of the last todo when more todos follow, it can be passed
+    as `after` to query the next page.
+    """
+
+    total: int
+    todos: List[ToDoModel]
+    next_key: Optional[Tuple[Any, ...]] = None
+
+
+class ToDoFilter(NamedTuple):
+    """Filters of a storage query, None leaves a filter out
+
+     * completed: only the completed (True) or open (False) todos
+     * due_after, due_before: only the todos due in [due_after, due_before), naive
+       datetimes are UTC like naive due dates
+    """
+
+    completed: Optional[bool] = None
+    due_after: Optional[datetime] = None
+    due_before: Optional[datetime] = None
+
+    @property
+    def active(self) -> bool:
+        return self != NO_FILTER
+
+    def due_range(self) -> Tuple[Optional[int], Optional[int]]:
+        """Get the due date range as (low, high) epoch microseconds, None if open"""
+
+        return (
+            None if self.due_after is None else datetime_key(self.due_after),
+            None if self.due_before is None else datetime_key(self.due_before),
+        )
+
+    def predicate(self) -> Callable[[ToDoModel], bool]:
+        """Get a function checking whether a todo passes the filters"""
+
+        completed = self.completed
+        low, high = self.due_range()
+
+        def matches(todo: ToDoModel) -> bool:
+            if completed is not None and todo.completed != completed:
+                return False
+            if low is None and high is None:
+                return True
+
+            key = due_date_key(todo)
+            return (low is None or key >= low) and (high is None or key < high)
+
+        return matches
+
+
+NO_FILTER = ToDoFilter()
+
+
+def top_k(
+    items: Iterable[Any],
+    count: int,
+    key: Callable[[Any], Any],
+    reverse: bool = False,
+    after: Optional[Tuple[Any, ...]] = None,
+) -> List[Any]:
+    """Get the count first items in key order (descending if reverse), only the items
+    ranked after the key `after` when given. Only a heap of count items is kept."""
+
+    if after is not None and reverse:
+        items = (x for x in items if key(x) < after)
+    elif after is not None:
+        items = (x for x in items if key(x) > after)
+
+    select = heapq.nlargest if reverse else heapq.nsmallest
+    return select(count, items, key=key)
+
+
+def validate_key(key: Optional[Tuple[Any, ...]], types: Tuple[type, ...]):
+    """Check a key passed as `after` has the shape of the keys of an order"""
+
+    if key is None:
+        return
+
+    if len(key) != len(types) or not all(
+        type(value) is expected for value, expected in zip(key, types)
+    ):
+        raise ValueError("Invalid key for this order")
+
+
+def key_types(title: Optional[str], sort_by: Optional[str]) -> Tuple[type, ...]:
+    """Get the types of the sort keys of an order
+
+     * without title: (field value or insertion sequence, id)
+     * with title: (field value (if sort_by), distance, id)
+
+    Full-text searches have the keys of title searches, with the BM25 rank (see
+    helpers.text_index.score_rank) as the distance.
+    """
+
+    if title is None:
+        return (int if sort_by is None else SORT_KEY_TYPES[sort_by], int)
+    if sort_by is None:
+        return (int, int)
+    return (SORT_KEY_TYPES[sort_by], int, int)
+
+
+def ranked_query(title: Optional[str], search: Optional[str]) -> Optional[str]:
+    """Get the query ranking the results (title or full-text search), if any"""
+
+    if title is not None and search is not None:
+        raise ValueError("A query can't combine a title and a full-text search")
+    return title if search is None else search
+
+
+class ToDoStorage(ABC):
+    """Todo storage engine
+
+    Storage engines order todos the same way, so (cursor) pages are interchangeable:
+
+     * without title: by the sort_by field (insertion order by default), then by id
+     * with title: by the sort_by field (if given), then by distance, then by id
+     * with search: by the sort_by field (if given), then by BM25 rank, then by id.
+       The engines compute the BM25 statistics differently, so ranks (and cursors)
+       are only comparable within an engine.
+
+    The methods are synchronous. Callers on the event loop go through run(), which
+    engines doing I/O override to dispatch the call to their own thread pool.
+    """
+
+    # Bumped on every write so cached query results can never be stale
+    version: int = 0
+
+    def __init__(self):
+        self.query_cache = LRUCache(maxsize=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL)
+        self.json_cache = LRUCache(maxsize=JSON_CACHE_SIZE, ttl=JSON_CACHE_TTL)
+
+        # Version per todo version slot, bumped by the write handlers (see writing()).
+        # Slots of todos not written since the storage was created are at version 0,
+        # versions only increase, so old ETags of a deleted todo never match again.
+        self.todo_versions = array("Q", [0]) * TODO_VERSION_SLOTS
+        self._todo_version_counter = count(1)
+
+        # ETags carry a random token of the storage instance, versions of a previous
+        # run (or another process) can not be mistaken for versions of this one
+        self._etag_token = token_hex(8)
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        """Run a (storage) method from the event loop"""
+
+        return func(*args, **kwargs)
+
+    def close(self):
+        """Release the resources held by the storage"""
+
+    def etag(self, version: int, _id: Optional[int] = None) -> str:
+        """Get the (strong) ETag of a storage version, or of a version of todo _id"""
+
+        if _id is None:
+            return f'"{self._etag_token}-{version}"'
+        return f'"{self._etag_token}-{_id}-{version}"'
+
+    def todo_etag(self, _id: int) -> str:
+        """Get the ETag of the current version of a todo
+
+        Todos share the version slots, the id is part of the ETag so it never matches
+        another todo (e.g. a missing one) in the same slot.
+        """
+
+        return self.etag(self.todo_versions[_id % TODO_VERSION_SLOTS], _id)
+
+    def touch(self, ids: Iterable[int]):
+        """Give the todos a new version, their previous ETags no longer match"""
+
+        for _id in ids:
+            self.todo_versions[_id % TODO_VERSION_SLOTS] = next(
+                self._todo_version_counter
+            )
+
+    @contextmanager
+    def writing(self, ids: Iterable[int]):
+        """Touch the todos before and after writing them
+
+        Engines running writes in a thread pool can serve reads while a write is in
+        progress, touching again afterwards makes sure the ETags handed out during the
+        write don't match the written todos.
+        """
+
+        ids = list(ids)
+        self.touch(ids)
+        try:
+            yield
+        finally:
+            # A failed write may have changed some of the todos as well
+            self.touch(ids)
+
+    def todo_json(self, todo: ToDoModel) -> bytes:
+        """Get the JSON of a todo, serialized once per version of the todo
+
+        A cached entry holds the field values it was serialized from and is only used
+        for a todo with the same values. A todo that changed (e.g. by a PUT) is
+        serialized again, which replaces the entry. Comparing the values is a few
+        pointer and memcmp compares, far cheaper than walking the model.
+
+        Datetimes in different time zones are equal when they are the same instant,
+        but serialize differently, so the UTC offset of the due date is compared too.
+        """
+
+        offset = todo.due_date.utcoffset()
+        entry = self.json_cache.get(todo.id)
+        if entry is not None and entry[0] == todo.__dict__ and entry[1] == offset:
+            return entry[2]
+
+        json = TODO_SERIALIZER.to_json(todo)
+        self.json_cache.set(todo.id, (dict(todo.__dict__), offset, json))
+        return json
+
+    @abstractmethod
+    def __len__(self) -> int:
+        """Number of todos"""
+
+    @abstractmethod
+    def get(self, _id: int) -> Optional[ToDoModel]:
+        """Get todo by id, None if there is no such todo"""
+
+    @abstractmethod
+    def update(self, _id: int, todo: ToDoModel) -> Optional[ToDoModel]:
+        """Replace an existing todo, None if there is no such todo"""
+
+    @abstractmethod
+    def bulk_create(self, todos: List[ToDoModel]) -> List[ToDoModel]:
+        """Store new todos under a freshly allocated block of ids"""
+
+    @abstractmethod
+    def bulk_upsert(self, todos: List[ToDoModel]) -> List[Tuple[ToDoModel, bool]]:
+        """Update the todos whose id exists and create the others
+
+        Todos without an id get a new id, todos with an unknown id are created under
+        that id. Nothing is stored when the ids are not unique (ValueError). Returns a
+        list of (todo, created) tuples.
+        """
+
+    @abstractmethod
+    def bulk_delete(self, ids: List[int]) -> List[bool]:
+        """Delete todos by id, return per id whether it existed"""
+
+    @abstractmethod
+    def query(
+        self,
+        title: Optional[str] = None,
+        sort_by: Optional[str] = None,
+        offset: int = 0,
+        limit: Optional[int] = None,
+        descending: bool = False,
+        after: Optional[Tuple[Any, ...]] = None,
+        filters: ToDoFilter = NO_FILTER,
+        search: Optional[str] = None,
+    ) -> QueryResult:
+        """Get the total number of matching todos and the requested slice of them
+
+         * title: levenshtein search on the title, ranked by distance
+         * search: full-text search on the title and description, ranked by BM25.
+           Every word must match, quoted phrases must match as a phrase. Can't be
+           combined with title (ValueError).
+         * sort_by: field name to order the results by
+         * descending: reverse the order
+         * after: continue after this sort key (as returned in next_key) instead of
+           skipping offset todos, ValueError when it doesn't fit the order
+         * filters: completed and due date filters. The cost of a due date range
+           grows with the number of todos in the range. The cost of the completed
+           filter alone depends on the engine: the memory engine ranks the matching
+           ids, the columnar engine walks the order (skipped todos included).
+        """
+
+    def create(self, todo: ToDoModel) -> ToDoModel:
+        """Store a new todo under the next free id"""
+
+        return self.bulk_create([todo])[0]
+
+    def delete(self, _id: int) -> bool:
+        """Delete todo by id, return whether it existed"""
+
+        return self.bulk_delete([_id])[0]
+
+    def iter_batches(
+        self,
+        title: Optional[str] = None,
+        sort_by: Optional[str] = None,
+        descending: bool = False,
+        batch_size: int = 500,
+        filters: ToDoFilter = NO_FILTER,
+        search: Optional[str] = None,
+    ) -> Iterator[List[ToDoModel]]:
+        """Iterate all matching todos in batches (e.g. to export them)
+
+        Every batch is a keyset query continuing after the previous one, so memory
+        stays bounded by the batch size and writes in between batches neither cause
+        duplicates nor shift unchanged todos out of the export.
+        """
+
+        after = None
+        while True:
+            result = self.query(
+                title=title,
+                sort_by=sort_by,
+                limit=batch_size,
+                descending=descending,
+                after=after,
+                filters=filters,
+                search=search,
+            )
+            if result.todos:
+                yield result.todos
+            if result.next_key is None:
+                return
+            after = result.next_key
@@ -0,0 +1,579 @@
+"""Columnar in-memory todo storage engine"""
+
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import timedelta, timezone
+from itertools import chain, islice
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from helpers.levenshtein import top_k_by_levenshtein
+from helpers.sorted_index import REBUILD_RATIO
+from helpers.string_column import StringColumn
+from helpers.text_index import TextIndex, score_rank
+from models.todo_models import ToDoModel
+from storage.base import (
+    EPOCH,
+    NO_FILTER,
+    SEARCH_SCORE_CUTOFF,
+    SORT_KEYS,
+    QueryResult,
+    ToDoFilter,
+    ToDoStorage,
+    due_date_key,
+    key_types,
+    ranked_query,
+    top_k,
+    validate_key,
+)
+
+# UTC offset stored for naive due dates
+NAIVE = -(2**31)
+
+# Fields whose order changes when a todo is updated (the id and sequence never change)
+UPDATED_ORDERS = ("title", "description", "due_date")
+
+
+def utc_offset(todo: ToDoModel) -> int:
+    """Get the UTC offset of the due date in seconds, NAIVE for naive due dates"""
+
+    offset = todo.due_date.utcoffset()
+    return NAIVE if offset is None else offset // timedelta(seconds=1)
+
+
+class ColumnarToDoRepository(ToDoStorage):
+    """Memory efficient todo storage for (very) large datasets
+
+    Every todo is a row slot in a set of columns: arrays of machine integers for the id,
+    insertion sequence, due date (epoch microseconds plus UTC offset) and completed
+    flag, and string columns for the title, the lower case title and the description.
+    The orders are arrays of slots sorted by (field, id), maintained with bisect and
+    memmove. ToDoModel objects are only created for the todos a query returns. The
+    completed column (one byte per slot) is the bitmap of the completed filter and the
+    due date order doubles as the index of the due date range filters.
+
+    Updates append new string records and deletes leave an empty slot, both are
+    reclaimed once there is more garbage than live data.
+    """
+
+    def __init__(self, todos: Iterable[ToDoModel] = ()):
+        super().__init__()
+        self._clear()
+
+        # Full-text index keyed on id (slots move on compaction), built by the first
+        # full-text search, so storages never searched don't pay for its memory
+        self._text_index: Optional[TextIndex] = None
+
+        # Monotonic id counter, ids are never reused; not even after a delete
+        self._next_id = 1
+        self._next_sequence = 0
+
+        # Sort keys of the slots, per order (None is insertion order)
+        self._keys: Dict[Optional[str], Callable[[int], Tuple[Any, int]]] = {
+            None: lambda slot: (self._sequences[slot], self._ids[slot]),
+            "id": lambda slot: (self._ids[slot], self._ids[slot]),
+            "title": lambda slot: (self._titles[self._records[slot]], self._ids[slot]),
+            "description": lambda slot: (
+                self._descriptions[self._records[slot]],
+                self._ids[slot],
+            ),
+            "due_date": lambda slot: (self._due_dates[slot], self._ids[slot]),
+        }
+
+        self._store_many(list(todos))
+
+    def _clear(self):
+        """Create empty columns"""
+
+        # Fixed width columns, indexed by slot
+        self._ids = array("q")
+        self._sequences = array("q")
+        self._due_dates = array("q")
+        self._utc_offsets = array("i")
+        self._completed = bytearray()
+
+        # String record of every slot (-1 for deleted slots) and the slot of every
+        # record. The string columns are appended to in lockstep, so a record number
+        # addresses the title, lower case title and description of the same write.
+        self._records = array("i")
+        self._record_slots = array("i")
+        self._titles = StringColumn()
+        self._titles_lower = StringColumn()
+        self._descriptions = StringColumn()
+
+        # Slots sorted by (field, id) per order, None is insertion order
+        self._orders: Dict[Optional[str], array] = {
+            field: array("i") for field in chain([None], SORT_KEYS)
+        }
+
+        self._count = 0
+        self._completed_count = 0
+        self._garbage = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    @property
+    def nbytes(self) -> int:
+        """Memory used by the columns and orders"""
+
+        arrays = [self._ids, self._sequences, self._due_dates, self._utc_offsets]
+        arrays += [self._records, self._record_slots, *self._orders.values()]
+        strings = [self._titles, self._titles_lower, self._descriptions]
+        return (
+            sum(x.itemsize * len(x) for x in arrays)
+            + len(self._completed)
+            + sum(x.nbytes for x in strings)
+        )
+
+    def _slot(self, _id: int) -> Optional[int]:
+        """Get the slot of a todo by id (a bisect in the id order)"""
+
+        order = self._orders["id"]
+        i = bisect_left(order, (_id, _id), key=self._keys["id"])
+        if i < len(order) and self._ids[order[i]] == _id:
+            return order[i]
+        return None
+
+    def _todo(self, slot: int) -> ToDoModel:
+        """Materialize the todo in a slot, the values were validated on write"""
+
+        due_date = EPOCH + timedelta(microseconds=self._due_dates[slot])
+        offset = self._utc_offsets[slot]
+        if offset == NAIVE:
+            due_date = due_date.replace(tzinfo=None)
+        elif offset:
+            due_date = due_date.astimezone(timezone(timedelta(seconds=offset)))
+
+        record = self._records[slot]
+        return ToDoModel.model_construct(
+            id=self._ids[slot],
+            title=self._titles[record],
+            description=self._descriptions[record],
+            due_date=due_date,
+            completed=bool(self._completed[slot]),
+        )
+
+    def _text_fields(self, slot: int) -> Tuple[str, str]:
+        """Get the fields of the todo in a slot indexed for full-text search"""
+
+        record = self._records[slot]
+        return self._titles[record], self._descriptions[record]
+
+    def _text(self) -> TextIndex:
+        """Get the full-text index, built on first use"""
+
+        if self._text_index is None:
+            text_index = TextIndex()
+            for slot in self._orders[None]:
+                text_index.add(self._ids[slot], *self._text_fields(slot))
+            self._text_index = text_index
+        return self._text_index
+
+    def _write(self, slot: int, todo: ToDoModel):
+        """Overwrite the values in the slot of an existing todo"""
+
+        self._garbage += 1
+        self._due_dates[slot] = due_date_key(todo)
+        self._utc_offsets[slot] = utc_offset(todo)
+        self._completed_count += todo.completed - self._completed[slot]
+        self._completed[slot] = todo.completed
+
+        self._records[slot] = self._titles.append(todo.title)
+        self._titles_lower.append(todo.title.lower())
+        self._descriptions.append(todo.description)
+        self._record_slots.append(slot)
+
+    def _append(self, todos: List[ToDoModel]) -> List[int]:
+        """Write new todos into new slots, column by column, return the slots"""
+
+        slots = range(len(self._ids), len(self._ids) + len(todos))
+        sequences = range(self._next_sequence, self._next_sequence + len(todos))
+        self._next_sequence += len(todos)
+
+        self._ids.extend(todo.id for todo in todos)
+        self._sequences.extend(sequences)
+        self._due_dates.extend(map(due_date_key, todos))
+        self._utc_offsets.extend(map(utc_offset, todos))
+        self._completed.extend(todo.completed for todo in todos)
+        self._completed_count += sum(todo.completed for todo in todos)
+
+        self._records.extend(self._titles.extend(todo.title for todo in todos))
+        self._titles_lower.extend(todo.title.lower() for todo in todos)
+        self._descriptions.extend(todo.description for todo in todos)
+        self._record_slots.extend(slots)
+        return list(slots)
+
+    def _index(self, field: Optional[str], slots: List[int]):
+        """Add slots to an order, in one merge for large batches"""
+
+        order, key = self._orders[field], self._keys[field]
+        if len(slots) * REBUILD_RATIO < len(order):
+            for slot in slots:
+                order.insert(bisect_left(order, key(slot), key=key), slot)
+            return
+
+        self._orders[field] = array("i", sorted(chain(order, slots), key=key))
+
+    def _unindex(self, field: Optional[str], slots: List[int]):
+        """Remove slots from an order, their values must not have changed yet"""
+
+        order, key = self._orders[field], self._keys[field]
+        if len(slots) * REBUILD_RATIO < len(order):
+            for slot in slots:
+                del order[bisect_left(order, key(slot), key=key)]
+            return
+
+        removed = set(slots)
+        self._orders[field] = array("i", (x for x in order if x not in removed))
+
+    def _compact(self):
+        """Move the live rows into new columns, dropping deleted slots and records"""
+
+        old = self.__dict__.copy()
+        live = old["_orders"][None]
+        self._clear()
+
+        new_slots = array("i", [-1]) * len(old["_ids"])
+        for slot in live:
+            new_slots[slot] = len(self._ids)
+            record = old["_records"][slot]
+            self._ids.append(old["_ids"][slot])
+            self._sequences.append(old["_sequences"][slot])
+            self._due_dates.append(old["_due_dates"][slot])
+            self._utc_offsets.append(old["_utc_offsets"][slot])
+            self._completed.append(old["_completed"][slot])
+            self._records.append(self._titles.append_raw(old["_titles"].raw(record)))
+            self._titles_lower.append_raw(old["_titles_lower"].raw(record))
+            self._descriptions.append_raw(old["_descriptions"].raw(record))
+            self._record_slots.append(new_slots[slot])
+
+        # The orders keep their order, only the slot numbers change
+        for field, order in old["_orders"].items():
+            self._orders[field] = array("i", (new_slots[slot] for slot in order))
+        self._count = len(live)
+        self._completed_count = sum(self._completed)
+
+    def _store_many(self, todos: List[ToDoModel]):
+        """Store todos which have an id, replacing the todos with the same id
+
+        The orders are updated once for the entire batch.
+        """
+
+        ids = {todo.id for todo in todos}
+        if None in ids:
+            raise ValueError("todo id cannot be None")
+        if len(ids) != len(todos):
+            raise ValueError("todo ids must be unique")
+
+        updated, created = [], []
+        for todo in todos:
+            slot = self._slot(todo.id)
+            if slot is None:
+                created.append(todo)
+            else:
+                updated.append((slot, todo))
+
+        updated_slots = [slot for slot, _ in updated]
+        for field in UPDATED_ORDERS:
+            self._unindex(field, updated_slots)
+        for slot, todo in updated:
+            if self._text_index is not None:
+                self._text_index.remove(todo.id, *self._text_fields(slot))
+            self._write(slot, todo)
+
+        created_slots = self._append(created)
+        self._count += len(created)
+        if self._text_index is not None:
+            for todo in chain((todo for _, todo in updated), created):
+                self._text_index.add(todo.id, todo.title, todo.description)
+
+        for field in self._orders:
+            if field in UPDATED_ORDERS:
+                self._index(field, updated_slots + created_slots)
+            else:
+                self._index(field, created_slots)
+
+        if todos:
+            self._next_id = max(self._next_id, max(ids) + 1)
+            self.version += 1
+        if self._garbage > self._count:
+            self._compact()
+
+    def _allocate_ids(self, count: int) -> range:
+        """Allocate a block of new ids"""
+
+        ids = range(self._next_id, self._next_id + count)
+        self._next_id += count
+        return ids
+
+    def get(self, _id: int) -> Optional[ToDoModel]:
+        slot = self._slot(_id)
+        return None if slot is None else self._todo(slot)
+
+    def update(self, _id: int, todo: ToDoModel) -> Optional[ToDoModel]:
+        if self._slot(_id) is None:
+            return None
+
+        todo.id = _id
+        self._store_many([todo])
+        return todo
+
+    def bulk_create(self, todos: List[ToDoModel]) -> List[ToDoModel]:
+        for _id, todo in zip(self._allocate_ids(len(todos)), todos):
+            todo.id = _id
+        self._store_many(todos)
+        return todos
+
+    def bulk_upsert(self, todos: List[ToDoModel]) -> List[Tuple[ToDoModel, bool]]:
+        given_ids = [todo.id for todo in todos if todo.id is not None]
+        if len(set(given_ids)) != len(given_ids):
+            raise ValueError("todo ids must be unique")
+
+        created = [todo.id is None or self._slot(todo.id) is None for todo in todos]
+
+        # Allocate the new ids after the given ids, so they can not collide
+        if given_ids:
+            self._next_id = max(self._next_id, max(given_ids) + 1)
+        new_ids = iter(self._allocate_ids(sum(todo.id is None for todo in todos)))
+        for todo in todos:
+            if todo.id is None:
+                todo.id = next(new_ids)
+
+        self._store_many(todos)
+        return list(zip(todos, created))
+
+    def bulk_delete(self, ids: List[int]) -> List[bool]:
+        slots = {}
+        for _id in ids:
+            slot = self._slot(_id)
+            if slot is not None:
+                slots[_id] = slot
+        if not slots:
+            return [False] * len(ids)
+
+        deleted = list(slots.values())
+        for field in self._orders:
+            self._unindex(field, deleted)
+        for slot in deleted:
+            if self._text_index is not None:
+                self._text_index.remove(self._ids[slot], *self._text_fields(slot))
+            self._records[slot] = -1
+            self._completed_count -= self._completed[slot]
+        self._count -= len(deleted)
+        self._garbage += len(deleted)
+        self.version += 1
+        if self._garbage > self._count:
+            self._compact()
+
+        # An id that is listed twice only existed the first time
+        result = []
+        for _id in ids:
+            result.append(slots.pop(_id, None) is not None)
+        return result
+
+    def _title_candidates(self, title: str) -> Iterable[Tuple[int, str]]:
+        """Get the (slot, lower case title) pairs of the live titles containing title"""
+
+        for record in self._titles_lower.find(title.lower()):
+            slot = self._record_slots[record]
+            if self._records[slot] == record:
+                yield slot, self._titles_lower[record]
+
+    def query(
+        self,
+        title: Optional[str] = None,
+        sort_by: Optional[str] = None,
+        offset: int = 0,
+        limit: Optional[int] = None,
+        descending: bool = False,
+        after: Optional[Tuple[Any, ...]] = None,
+        filters: ToDoFilter = NO_FILTER,
+        search: Optional[str] = None,
+    ) -> QueryResult:
+        """Get the total number of matching todos and the requested slice of them
+
+        Title searches scan the lower case title buffer for the query and only rank
+        the hits. Without a title a page is a slice (or a bisect plus a slice) of the
+        order, only the todos on the page are materialized.
+        """
+
+        if limit is None:
+            limit = self._count
+        if after is not None:
+            offset = 0
+        offset = max(offset, 0)
+        limit = max(limit, 0)
+
+        # Fetch one extra todo to know whether a next page exists
+        stop = offset + limit + 1
+        validate_key(after, key_types(ranked_query(title, search), sort_by))
+        sort_key = self._keys[sort_by]
+
+        # Rank by the field (when given), then by the distance (or BM25 rank) and then
+        # by the id
+        if sort_by is None:
+            rank_key = lambda slot, distance: (distance, self._ids[slot])
+        else:
+            rank_key = lambda slot, distance: (
+                sort_key(slot)[0],
+                distance,
+                self._ids[slot],
+            )
+
+        if search is not None:
+            # Only the todos containing every word of the search are scored
+            fields = lambda _id: self._text_fields(self._slot(_id))
+            candidates = [
+                (self._slot(_id), score_rank(score))
+                for _id, score in self._text().search(search, fields)
+            ]
+            if filters.active:
+                matches = self._slot_filter(filters)
+                candidates = [x for x in candidates if matches(x[0])]
+
+            ranked = top_k(candidates, stop, lambda x: rank_key(*x), descending, after)
+            ranked = ranked[offset:]
+            todos = [self._todo(slot) for slot, _ in ranked[:limit]]
+            next_key = None
+            if len(ranked) > limit and todos:
+                next_key = rank_key(*ranked[limit - 1])
+            return QueryResult(len(candidates), todos, next_key)
+
+        if title is not None:
+            candidates = self._title_candidates(title)
+            if filters.active:
+                matches = self._slot_filter(filters)
+                candidates = (x for x in candidates if matches(x[0]))
+
+            total, matches = top_k_by_levenshtein(
+                title,
+                candidates,
+                stop,
+                score_cutoff=SEARCH_SCORE_CUTOFF,
+                key=rank_key,
+                reverse=descending,
+                after=after,
+            )
+            matches = matches[offset:]
+            todos = [self._todo(slot) for slot, _ in matches[:limit]]
+            next_key = None
+            if len(matches) > limit and todos:
+                next_key = rank_key(*matches[limit - 1])
+            return QueryResult(total, todos, next_key)
+
+        total = self._count
+        order = self._orders[sort_by]
+        if filters.active:
+            total, slots = self._filter_slots(
+                order, sort_by, offset, stop, descending, after, filters
+            )
+        else:
+            slots = self._page(order, sort_key, offset, stop, descending, after)
+
+        todos = [self._todo(slot) for slot in slots[:limit]]
+        next_key = None
+        if len(slots) > limit and todos:
+            next_key = sort_key(slots[limit - 1])
+        return QueryResult(total, todos, next_key)
+
+    @staticmethod
+    def _page(
+        order: array,
+        sort_key: Callable[[int], Tuple[Any, int]],
+        offset: int,
+        stop: int,
+        descending: bool,
+        after: Optional[Tuple[Any, ...]],
+    ) -> array:
+        """Get the slots of a page of an order (or of a list of slots in order)"""
+
+        if after is None and descending:
+            start = max(len(order) - stop, 0)
+            return order[start : max(len(order) - offset, 0)][::-1]
+        if after is None:
+            return order[offset:stop]
+        if descending:
+            end = bisect_left(order, after, key=sort_key)
+            return order[max(end - stop, 0) : end][::-1]
+
+        start = bisect_right(order, after, key=sort_key)
+        return order[start : start + stop]
+
+    @staticmethod
+    def _iter_order(
+        order: array,
+        sort_key: Callable[[int], Tuple[Any, int]],
+        descending: bool,
+        after: Optional[Tuple[Any, ...]],
+    ) -> Iterator[int]:
+        """Lazily iterate the slots of an order following after, when given"""
+
+        if descending:
+            end = len(order)
+            if after is not None:
+                end = bisect_left(order, after, key=sort_key)
+            return (order[i] for i in range(end - 1, -1, -1))
+
+        start = 0 if after is None else bisect_right(order, after, key=sort_key)
+        return (order[i] for i in range(start, len(order)))
+
+    def _slot_filter(self, filters: ToDoFilter) -> Callable[[int], bool]:
+        """Get a function checking whether the todo in a slot passes the filters"""
+
+        completed = filters.completed
+        low, high = filters.due_range()
+        completed_column, due_dates = self._completed, self._due_dates
+
+        def matches(slot: int) -> bool:
+            if completed is not None and completed_column[slot] != completed:
+                return False
+            due_date = due_dates[slot]
+            if low is not None and due_date < low:
+                return False
+            return high is None or due_date < high
+
+        return matches
+
+    def _filter_slots(
+        self,
+        order: array,
+        sort_by: Optional[str],
+        offset: int,
+        stop: int,
+        descending: bool,
+        after: Optional[Tuple[Any, ...]],
+        filters: ToDoFilter,
+    ) -> Tuple[int, List[int]]:
+        """Get the number of todos passing the filters and the slots of the page
+
+        A due date range is a bisect into the due date order, only the slots in the
+        range are checked. The completed filter alone walks the order, skipping the
+        other slots, and takes the total from the completed counter.
+        """
+
+        matches = self._slot_filter(filters)
+        sort_key = self._keys[sort_by]
+        low, high = filters.due_range()
+
+        if low is None and high is None:
+            total = self._completed_count
+            if not filters.completed:
+                total = self._count - total
+
+            slots = self._iter_order(order, sort_key, descending, after)
+            return total, list(islice(filter(matches, slots), offset, stop))
+
+        due_order, due_key = self._orders["due_date"], self._keys["due_date"]
+        start, end = 0, len(due_order)
+        if low is not None:
+            start = bisect_left(due_order, (low, float("-inf")), key=due_key)
+        if high is not None:
+            end = bisect_left(due_order, (high, float("-inf")), key=due_key)
+        in_range = [slot for slot in due_order[start:end] if matches(slot)]
+
+        if sort_by == "due_date":
+            # The range is a run of the order, the page is read off the range
+            return len(in_range), self._page(
+                in_range, sort_key, offset, stop, descending, after
+            )
+        page = top_k(in_range, stop, sort_key, descending, after)
+        return len(in_range), page[offset:]
@@ -0,0 +1,76 @@
+"""Todo storage engine selection and seeding"""
+
+import gc
+from time import perf_counter
+from typing import Dict, Iterable, List, Union
+from mock_data.generate_todos import generate_todos
+from mock_data.snapshot import load_snapshot
+from models.todo_models import ToDoModel
+from settings import (
+    TODO_DATABASE_PATH,
+    TODO_DATABASE_POOL_SIZE,
+    TODO_SEED_COUNT,
+    TODO_SEED_RANDOM_SEED,
+    TODO_SNAPSHOT_PATH,
+    TODO_STORAGE,
+)
+from storage.base import ToDoStorage
+from storage.columnar_repository import ColumnarToDoRepository
+from storage.sqlite_repository import SQLiteToDoRepository
+from storage.todo_repository import ToDoRepository
+
+
+def create_todo_storage(todos: Iterable[ToDoModel] = ()) -> ToDoStorage:
+    """Create the configured storage engine (TODO_STORAGE) and store todos in it"""
+
+    if TODO_STORAGE == "memory":
+        return ToDoRepository(todos)
+
+    if TODO_STORAGE == "columnar":
+        return ColumnarToDoRepository(todos)
+
+    if TODO_STORAGE == "sqlite":
+        storage = SQLiteToDoRepository(
+            TODO_DATABASE_PATH, pool_size=TODO_DATABASE_POOL_SIZE
+        )
+        storage.bulk_upsert(list(todos))
+        return storage
+
+    raise ValueError(f"Unknown todo storage engine: {TODO_STORAGE}")
+
+
+# Outcome of the startup seeding, to measure cold starts
+seed_stats: Dict[str, Union[int, float]] = {"todos": 0, "seconds": 0.0}
+
+
+def load_seed_todos() -> List[ToDoModel]:
+    """Load the snapshot (TODO_SNAPSHOT_PATH) or generate the todos to seed"""
+
+    if TODO_SNAPSHOT_PATH is not None:
+        return load_snapshot(TODO_SNAPSHOT_PATH)
+    return generate_todos(TODO_SEED_COUNT, TODO_SEED_RANDOM_SEED)
+
+
+def seed_todo_storage(storage: ToDoStorage) -> int:
+    """Seed an empty storage, return the number of seeded todos
+
+    A storage which already holds todos (e.g. a SQLite database from a previous run)
+    is left alone.
+    """
+
+    started = perf_counter()
+    if len(storage) == 0:
+        # Seeding allocates millions of objects, none of them garbage, which would
+        # trigger full collections over and over. The seeded todos are frozen
+        # afterwards, so later collections don't walk them either.
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            storage.bulk_upsert(load_seed_todos())
+        finally:
+            if enabled:
+                gc.enable()
+        gc.freeze()
+        seed_stats["todos"] = len(storage)
+    seed_stats["seconds"] = perf_counter() - started
+    return seed_stats["todos"]
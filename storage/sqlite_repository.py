@@ -0,0 +1,684 @@
+"""SQLite todo storage engine"""
+
+import asyncio
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from functools import partial
+from threading import Lock, local
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from Levenshtein import distance
+from helpers.shared_counters import SharedCounters
+from helpers.text_index import (
+    DESCRIPTION_WEIGHT,
+    SCORE_SCALE,
+    TITLE_WEIGHT,
+    parse_query,
+)
+from models.todo_models import ToDoModel
+from storage.base import (
+    NO_FILTER,
+    SEARCH_SCORE_CUTOFF,
+    TODO_VERSION_SLOTS,
+    QueryResult,
+    ToDoFilter,
+    ToDoStorage,
+    due_date_key,
+    key_types,
+    ranked_query,
+    validate_key,
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS todos (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    sequence INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    title_lower TEXT NOT NULL,
+    description TEXT NOT NULL,
+    due_date TEXT NOT NULL,
+    due_date_key INTEGER NOT NULL,
+    completed INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS todos_sequence ON todos (sequence, id);
+CREATE INDEX IF NOT EXISTS todos_title ON todos (title, id);
+CREATE INDEX IF NOT EXISTS todos_due_date ON todos (due_date_key, id);
+CREATE INDEX IF NOT EXISTS todos_completed ON todos (completed, id);
+CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+INSERT OR IGNORE INTO meta (name, value)
+VALUES ('version', 0), ('count', 0), ('next_sequence', 0);
+"""
+
+# Trigram full-text index on the titles (SQLite 3.34+), kept in sync by triggers
+TRIGRAM_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS todos_title_trigrams USING fts5(
+    title_lower, content='todos', content_rowid='id', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS todos_title_trigrams_insert AFTER INSERT ON todos BEGIN
+    INSERT INTO todos_title_trigrams (rowid, title_lower)
+    VALUES (new.id, new.title_lower);
+END;
+CREATE TRIGGER IF NOT EXISTS todos_title_trigrams_delete AFTER DELETE ON todos BEGIN
+    INSERT INTO todos_title_trigrams (todos_title_trigrams, rowid, title_lower)
+    VALUES ('delete', old.id, old.title_lower);
+END;
+CREATE TRIGGER IF NOT EXISTS todos_title_trigrams_update
+AFTER UPDATE OF title_lower ON todos BEGIN
+    INSERT INTO todos_title_trigrams (todos_title_trigrams, rowid, title_lower)
+    VALUES ('delete', old.id, old.title_lower);
+    INSERT INTO todos_title_trigrams (rowid, title_lower)
+    VALUES (new.id, new.title_lower);
+END;
+"""
+
+# Full-text index on the titles and descriptions, kept in sync by triggers. The
+# unicode61 tokenizer splits words like helpers.text_index.tokenize.
+TEXT_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS todos_text USING fts5(
+    title, description, content='todos', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 0'
+);
+CREATE TRIGGER IF NOT EXISTS todos_text_insert AFTER INSERT ON todos BEGIN
+    INSERT INTO todos_text (rowid, title, description)
+    VALUES (new.id, new.title, new.description);
+END;
+CREATE TRIGGER IF NOT EXISTS todos_text_delete AFTER DELETE ON todos BEGIN
+    INSERT INTO todos_text (todos_text, rowid, title, description)
+    VALUES ('delete', old.id, old.title, old.description);
+END;
+CREATE TRIGGER IF NOT EXISTS todos_text_update
+AFTER UPDATE OF title, description ON todos BEGIN
+    INSERT INTO todos_text (todos_text, rowid, title, description)
+    VALUES ('delete', old.id, old.title, old.description);
+    INSERT INTO todos_text (rowid, title, description)
+    VALUES (new.id, new.title, new.description);
+END;
+"""
+
+# Columns (in ToDoModel field order) and the sort column per sortable field. These are
+# fixed strings, user input never ends up in the SQL text.
+COLUMNS = "id, title, description, due_date, completed"
+SORT_COLUMNS = {
+    None: "sequence",
+    "id": "id",
+    "title": "title",
+    "description": "description",
+    "due_date": "due_date_key",
+}
+
+# Statements are constant strings with parameters, so the sqlite3 module compiles each
+# of them once per connection and reuses the prepared statement afterwards
+SELECT_TODO = f"SELECT {COLUMNS} FROM todos WHERE id = ?"
+SELECT_META = "SELECT value FROM meta WHERE name = ?"
+UPDATE_META = "UPDATE meta SET value = value + ? WHERE name = ?"
+SELECT_LAST_ID = "SELECT seq FROM sqlite_sequence WHERE name = 'todos'"
+SELECT_EXISTS = "SELECT 1 FROM todos WHERE id = ?"
+INSERT_TODO = """
+INSERT INTO todos (
+    id, sequence, title, title_lower, description, due_date, due_date_key, completed
+) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+UPDATE_TODO = """
+UPDATE todos SET
+    title = ?, title_lower = ?, description = ?, due_date = ?, due_date_key = ?,
+    completed = ?
+WHERE id = ?
+"""
+DELETE_TODO = "DELETE FROM todos WHERE id = ?"
+
+
+# Values of the INTEGER columns, ids outside of it can't be bound (OverflowError) nor
+# be stored, so no todo has them
+SQLITE_INTEGERS = range(-(2**63), 2**63)
+
+# Shared counters: the storage version, followed by the todo version slots (ETags)
+STORAGE_VERSION = 0
+
+
+def levenshtein(value: str, query: str, score_cutoff: int) -> int:
+    """SQL function computing the (early exit) levenshtein distance"""
+
+    return distance(query, value, score_cutoff=score_cutoff)
+
+
+def match_expression(search: str) -> Optional[str]:
+    """Get the FTS5 query of a full-text search, None when it has no words
+
+    The query is built from the (quoted) words of the search only, so user input
+    never ends up as FTS5 syntax. Every word and every phrase must match, like in
+    helpers.text_index.TextIndex.search.
+    """
+
+    words, phrases = parse_query(search)
+    if not words:
+        return None
+
+    terms = [[word] for word in words] + phrases
+    return " AND ".join(f'"{" ".join(term)}"' for term in terms)
+
+
+def filter_conditions(filters: ToDoFilter) -> Tuple[List[str], Dict[str, Any]]:
+    """Get the WHERE conditions and their named parameters of the filters
+
+    The conditions are on the indexed completed and due_date_key columns, the query
+    planner picks whichever index is the most selective.
+    """
+
+    conditions, parameters = [], {}
+    if filters.completed is not None:
+        conditions.append("completed = :completed")
+        parameters["completed"] = int(filters.completed)
+
+    low, high = filters.due_range()
+    if low is not None:
+        conditions.append("due_date_key >= :due_after")
+        parameters["due_after"] = low
+    if high is not None:
+        conditions.append("due_date_key < :due_before")
+        parameters["due_before"] = high
+    return conditions, parameters
+
+
+def to_row(todo: ToDoModel) -> Tuple[Any, ...]:
+    """Get the column values of a todo (without id and sequence)"""
+
+    return (
+        todo.title,
+        todo.title.lower(),
+        todo.description,
+        todo.due_date.isoformat(),
+        due_date_key(todo),
+        int(todo.completed),
+    )
+
+
+def from_row(row: Tuple[Any, ...]) -> ToDoModel:
+    """Create a todo from its stored columns, the values were validated on write"""
+
+    return ToDoModel.model_construct(
+        id=row[0],
+        title=row[1],
+        description=row[2],
+        due_date=datetime.fromisoformat(row[3]),
+        completed=bool(row[4]),
+    )
+
+
+class SQLiteToDoRepository(ToDoStorage):
+    """Todo storage in a SQLite database in WAL mode
+
+    Every thread of the storage's own thread pool holds a connection, so the pool is
+    the connection pool and run() keeps all database I/O off the event loop. WAL mode
+    lets the readers run concurrently with the (single) writer, writes are serialized
+    by a lock within the process and by BEGIN IMMEDIATE across processes.
+
+    Todos are ordered exactly like the in-memory repository orders them, pages are
+    LIMIT/OFFSET or keyset ((sort column, id) > cursor) queries on indexed columns.
+
+    The storage version and the todo versions live in counters shared by all processes
+    using the database (see SharedCounters), so the caches and ETags of every worker
+    follow the writes of the others.
+    """
+
+    def __init__(self, path: str, pool_size: int = 4):
+        super().__init__()
+        self.path = path
+        self._versions = SharedCounters(f"{path}-versions", 1 + TODO_VERSION_SLOTS)
+        self._etag_token = self._versions.token
+        self._executor = ThreadPoolExecutor(
+            max_workers=pool_size, thread_name_prefix="sqlite-storage"
+        )
+        self._local = local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = Lock()
+        self._write_lock = Lock()
+
+        connection = self._connection()
+        connection.executescript(SCHEMA)
+
+        # Index the todos of databases created before the full-text index
+        created = connection.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'todos_text'"
+        ).fetchone()
+        connection.executescript(TEXT_SCHEMA)
+        if created is None:
+            connection.execute("INSERT INTO todos_text (todos_text) VALUES ('rebuild')")
+        try:
+            connection.executescript(TRIGRAM_SCHEMA)
+            self.trigram_index = True
+        except sqlite3.OperationalError:
+            # The trigram tokenizer is missing, title searches scan the titles
+            self.trigram_index = False
+
+    @property
+    def version(self) -> int:
+        return self._versions[STORAGE_VERSION]
+
+    def todo_etag(self, _id: int) -> str:
+        return self.etag(self._versions[1 + _id % TODO_VERSION_SLOTS], _id)
+
+    def touch(self, ids: Iterable[int]):
+        self._versions.increment_many(1 + _id % TODO_VERSION_SLOTS for _id in ids)
+
+    def _connection(self) -> sqlite3.Connection:
+        """Get the connection of the current thread"""
+
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(
+                self.path,
+                isolation_level=None,
+                check_same_thread=False,
+                cached_statements=256,
+            )
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("PRAGMA synchronous = NORMAL")
+            connection.execute("PRAGMA busy_timeout = 5000")
+            connection.create_function("levenshtein", 3, levenshtein, deterministic=True)
+
+            self._local.connection = connection
+            with self._connections_lock:
+                self._connections.append(connection)
+        return connection
+
+    @contextmanager
+    def _transaction(self, write: bool = False) -> Iterator[sqlite3.Connection]:
+        """Run statements in a (read snapshot or write) transaction
+
+        Writes are expected to bump the version (see _bump) when they change anything.
+        """
+
+        connection = self._connection()
+        lock = self._write_lock if write else None
+        if lock is not None:
+            lock.acquire()
+        try:
+            self._local.changed = False
+            connection.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+            try:
+                yield connection
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+
+            # Publish the new version only once the write is visible to readers
+            if self._local.changed:
+                self._versions.increment(STORAGE_VERSION)
+        finally:
+            if lock is not None:
+                lock.release()
+
+    @staticmethod
+    def _meta(connection: sqlite3.Connection, name: str) -> int:
+        return connection.execute(SELECT_META, (name,)).fetchone()[0]
+
+    def _bump(self, connection: sqlite3.Connection, created: int = 0, deleted: int = 0):
+        """Update the counters at the end of a write transaction"""
+
+        connection.execute(UPDATE_META, (1, "version"))
+        connection.execute(UPDATE_META, (created - deleted, "count"))
+        self._local.changed = True
+
+    def _insert(self, connection: sqlite3.Connection, todos: List[ToDoModel]):
+        """Insert todos, which have an id, at the end of the insertion order"""
+
+        sequence = self._meta(connection, "next_sequence")
+        connection.executemany(
+            INSERT_TODO,
+            (
+                (todo.id, sequence + i, *to_row(todo))
+                for i, todo in enumerate(todos)
+            ),
+        )
+        connection.execute(UPDATE_META, (len(todos), "next_sequence"))
+
+    @staticmethod
+    def _next_id(connection: sqlite3.Connection) -> int:
+        row = connection.execute(SELECT_LAST_ID).fetchone()
+        return 1 if row is None else row[0] + 1
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        """Run a storage method in the storage thread pool"""
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, partial(func, *args, **kwargs)
+        )
+
+    def close(self):
+        """Close the thread pool and all connections"""
+
+        self._executor.shutdown(wait=True)
+        with self._connections_lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections.clear()
+        self._local = local()
+        self._versions.close()
+
+    def __len__(self) -> int:
+        return self._meta(self._connection(), "count")
+
+    def get(self, _id: int) -> Optional[ToDoModel]:
+        if _id not in SQLITE_INTEGERS:
+            return None
+        row = self._connection().execute(SELECT_TODO, (_id,)).fetchone()
+        return None if row is None else from_row(row)
+
+    def update(self, _id: int, todo: ToDoModel) -> Optional[ToDoModel]:
+        if _id not in SQLITE_INTEGERS:
+            return None
+        with self._transaction(write=True) as connection:
+            cursor = connection.execute(UPDATE_TODO, (*to_row(todo), _id))
+            if cursor.rowcount == 0:
+                return None
+            self._bump(connection)
+
+        todo.id = _id
+        return todo
+
+    def bulk_create(self, todos: List[ToDoModel]) -> List[ToDoModel]:
+        if not todos:
+            return todos
+
+        with self._transaction(write=True) as connection:
+            # Allocate one block of ids, AUTOINCREMENT never hands them out again
+            next_id = self._next_id(connection)
+            for i, todo in enumerate(todos):
+                todo.id = next_id + i
+
+            self._insert(connection, todos)
+            self._bump(connection, created=len(todos))
+        return todos
+
+    def bulk_upsert(self, todos: List[ToDoModel]) -> List[Tuple[ToDoModel, bool]]:
+        given_ids = [todo.id for todo in todos if todo.id is not None]
+        if len(set(given_ids)) != len(given_ids):
+            raise ValueError("todo ids must be unique")
+        if not all(x in SQLITE_INTEGERS for x in given_ids):
+            raise ValueError("todo ids must be 64 bit integers")
+        if not todos:
+            return []
+
+        with self._transaction(write=True) as connection:
+            # Allocate the new ids after the given ids, so they can not collide
+            next_id = max([self._next_id(connection), *(x + 1 for x in given_ids)])
+            created = []
+            for todo in todos:
+                if todo.id is None:
+                    todo.id = next_id
+                    next_id += 1
+                    created.append(True)
+                else:
+                    exists = connection.execute(SELECT_EXISTS, (todo.id,)).fetchone()
+                    created.append(exists is None)
+
+            connection.executemany(
+                UPDATE_TODO,
+                (
+                    (*to_row(todo), todo.id)
+                    for todo, new in zip(todos, created)
+                    if not new
+                ),
+            )
+            self._insert(connection, [x for x, new in zip(todos, created) if new])
+            self._bump(connection, created=sum(created))
+        return list(zip(todos, created))
+
+    def bulk_delete(self, ids: List[int]) -> List[bool]:
+        with self._transaction(write=True) as connection:
+            deleted = [
+                _id in SQLITE_INTEGERS
+                and connection.execute(DELETE_TODO, (_id,)).rowcount > 0
+                for _id in ids
+            ]
+            if any(deleted):
+                self._bump(connection, deleted=sum(deleted))
+        return deleted
+
+    def query(
+        self,
+        title: Optional[str] = None,
+        sort_by: Optional[str] = None,
+        offset: int = 0,
+        limit: Optional[int] = None,
+        descending: bool = False,
+        after: Optional[Tuple[Any, ...]] = None,
+        filters: ToDoFilter = NO_FILTER,
+        search: Optional[str] = None,
+    ) -> QueryResult:
+        validate_key(after, key_types(ranked_query(title, search), sort_by))
+        if after is not None:
+            offset = 0
+
+        # At least three adjacent characters must match, shorter queries never match
+        if title is not None and len(title) < 3:
+            return QueryResult(0, [], None)
+
+        match = None
+        if search is not None:
+            match = match_expression(search)
+            if match is None:
+                return QueryResult(0, [], None)
+
+        with self._transaction() as connection:
+            if limit is None:
+                limit = self._meta(connection, "count")
+            if match is not None:
+                return self._query_search(
+                    connection,
+                    match,
+                    sort_by,
+                    max(offset, 0),
+                    limit,
+                    descending,
+                    after,
+                    filters,
+                )
+            if title is None:
+                return self._query_all(
+                    connection,
+                    sort_by,
+                    max(offset, 0),
+                    limit,
+                    descending,
+                    after,
+                    filters,
+                )
+            return self._query_title(
+                connection,
+                title,
+                sort_by,
+                max(offset, 0),
+                limit,
+                descending,
+                after,
+                filters,
+            )
+
+    def _page(
+        self,
+        connection: sqlite3.Connection,
+        sql: str,
+        parameters: Dict[str, Any],
+        key_width: int,
+        limit: int,
+    ) -> Tuple[List[ToDoModel], Optional[Tuple[Any, ...]]]:
+        """Run a page query whose rows are the todo columns followed by the sort key
+
+        One row more than the limit is fetched to know whether a next page exists.
+        """
+
+        rows = connection.execute(sql, parameters).fetchall()
+        todos = [from_row(row) for row in rows[:limit]]
+
+        next_key = None
+        if len(rows) > limit and todos:
+            next_key = tuple(rows[limit - 1][-key_width:])
+        return todos, next_key
+
+    def _query_all(
+        self, connection, sort_by, offset, limit, descending, after, filters
+    ):
+        """Page through all todos on an indexed sort column"""
+
+        column = SORT_COLUMNS[sort_by]
+        direction, seek = ("DESC", "<") if descending else ("ASC", ">")
+
+        # Filtered totals are counted on the filter columns' indexes
+        conditions, parameters = filter_conditions(filters)
+        if conditions:
+            total = connection.execute(
+                f"SELECT count(*) FROM todos WHERE {' AND '.join(conditions)}",
+                parameters,
+            ).fetchone()[0]
+        else:
+            total = self._meta(connection, "count")
+
+        sql = f"SELECT {COLUMNS}, {column}, id FROM todos"
+        if after is not None:
+            conditions = conditions + [f"({column}, id) {seek} (:after0, :after1)"]
+            parameters.update(after0=after[0], after1=after[1])
+        if conditions:
+            sql += f" WHERE {' AND '.join(conditions)}"
+        sql += f" ORDER BY {column} {direction}, id {direction}"
+        sql += " LIMIT :limit OFFSET :offset"
+        parameters.update(limit=max(limit, 0) + 1, offset=offset)
+
+        todos, next_key = self._page(connection, sql, parameters, 2, limit)
+        return QueryResult(total, todos, next_key)
+
+    def _query_title(
+        self, connection, title, sort_by, offset, limit, descending, after, filters
+    ):
+        """Rank the todos whose title contains the query by levenshtein distance"""
+
+        direction, seek = ("DESC", "<") if descending else ("ASC", ">")
+        query = title.lower()
+
+        # Only rows containing every trigram of the query are checked (and ranked)
+        candidates = "instr(title_lower, :query) > 0"
+        if self.trigram_index:
+            candidates += (
+                " AND id IN (SELECT rowid FROM todos_title_trigrams"
+                " WHERE todos_title_trigrams MATCH :phrase)"
+            )
+        conditions, filter_parameters = filter_conditions(filters)
+        for condition in conditions:
+            candidates += f" AND {condition}"
+
+        # Rank by the field (when given), then by the distance and then by the id
+        keys = ["distance", "id"]
+        if sort_by is not None:
+            keys.insert(0, SORT_COLUMNS[sort_by])
+        parameters = {
+            "query": query,
+            "phrase": '"' + query.replace('"', '""') + '"',
+            "cutoff": SEARCH_SCORE_CUTOFF,
+            "limit": max(limit, 0) + 1,
+            "offset": offset,
+            **filter_parameters,
+        }
+
+        seek_filter = ""
+        if after is not None:
+            placeholders = ", ".join(f":after{i}" for i in range(len(keys)))
+            seek_filter = f"AND ({', '.join(keys)}) {seek} ({placeholders})"
+            parameters.update({f"after{i}": value for i, value in enumerate(after)})
+
+        # The matches are used twice (count and page), so SQLite materializes them
+        # and computes every distance once
+        rows = connection.execute(
+            f"""
+            WITH matches AS (
+                SELECT {COLUMNS}, due_date_key,
+                    levenshtein(title_lower, :query, :cutoff) AS distance
+                FROM todos WHERE {candidates}
+            )
+            SELECT {COLUMNS},
+                (SELECT count(*) FROM matches WHERE distance <= :cutoff),
+                {", ".join(keys)}
+            FROM matches WHERE distance <= :cutoff {seek_filter}
+            ORDER BY {", ".join(f"{key} {direction}" for key in keys)}
+            LIMIT :limit OFFSET :offset
+            """,
+            parameters,
+        ).fetchall()
+
+        if rows:
+            total = rows[0][5]
+        else:
+            total = connection.execute(
+                f"""
+                SELECT count(*) FROM todos WHERE {candidates}
+                AND levenshtein(title_lower, :query, :cutoff) <= :cutoff
+                """,
+                parameters,
+            ).fetchone()[0]
+
+        todos = [from_row(row) for row in rows[:limit]]
+        next_key = None
+        if len(rows) > limit and todos:
+            next_key = tuple(rows[limit - 1][-len(keys) :])
+        return QueryResult(total, todos, next_key)
+
+    def _query_search(
+        self, connection, match, sort_by, offset, limit, descending, after, filters
+    ):
+        """Rank the todos matching a full-text search by BM25 (see TEXT_SCHEMA)"""
+
+        direction, seek = ("DESC", "<") if descending else ("ASC", ">")
+
+        # Rank by the field (when given), then by the BM25 rank and then by the id
+        keys = ["distance", "id"]
+        if sort_by is not None:
+            keys.insert(0, SORT_COLUMNS[sort_by])
+
+        conditions, parameters = filter_conditions(filters)
+        candidates = " AND ".join(["todos_text MATCH :match"] + conditions)
+        parameters.update(
+            match=match, limit=max(limit, 0) + 1, offset=offset, scale=SCORE_SCALE
+        )
+
+        seek_filter = ""
+        if after is not None:
+            placeholders = ", ".join(f":after{i}" for i in range(len(keys)))
+            seek_filter = f"WHERE ({', '.join(keys)}) {seek} ({placeholders})"
+            parameters.update({f"after{i}": value for i, value in enumerate(after)})
+
+        # bm25() is the negated score, so the best matches have the lowest ranks
+        columns = ", ".join(f"todos.{x} AS {x}" for x in COLUMNS.split(", "))
+        rows = connection.execute(
+            f"""
+            WITH matches AS (
+                SELECT {columns}, todos.due_date_key AS due_date_key,
+                    CAST(round(
+                        bm25(todos_text, {TITLE_WEIGHT}, {DESCRIPTION_WEIGHT}) * :scale
+                    ) AS INTEGER) AS distance
+                FROM todos_text JOIN todos ON todos.id = todos_text.rowid
+                WHERE {candidates}
+            )
+            SELECT {COLUMNS}, (SELECT count(*) FROM matches), {", ".join(keys)}
+            FROM matches {seek_filter}
+            ORDER BY {", ".join(f"{key} {direction}" for key in keys)}
+            LIMIT :limit OFFSET :offset
+            """,
+            parameters,
+        ).fetchall()
+
+        if rows:
+            total = rows[0][5]
+        else:
+            total = connection.execute(
+                "SELECT count(*) FROM todos_text JOIN todos"
+                f" ON todos.id = todos_text.rowid WHERE {candidates}",
+                parameters,
+            ).fetchone()[0]
+
+        todos = [from_row(row) for row in rows[:limit]]
+        next_key = None
+        if len(rows) > limit and todos:
+            next_key = tuple(rows[limit - 1][-len(keys) :])
+        return QueryResult(total, todos, next_key)
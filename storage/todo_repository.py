@@ -0,0 +1,498 @@
+"""In-memory todo repository indexed by id"""
+
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from weakref import WeakSet
+from helpers.levenshtein import top_k_by_levenshtein
+from helpers.sorted_index import SortedIndex
+from helpers.text_index import TextIndex, score_rank
+from helpers.trigram_index import TrigramIndex
+from models.todo_models import ToDoModel
+from storage.base import (
+    NO_FILTER,
+    SEARCH_SCORE_CUTOFF,
+    SORT_KEYS,
+    QueryResult,
+    ToDoFilter,
+    ToDoStorage,
+    key_types,
+    ranked_query,
+    top_k,
+    validate_key,
+)
+
+
+class ToDoSnapshot:
+    """Read-only view of the todos as they were at one version of a repository
+
+    The order is a copy-on-write snapshot of a sorted index. The todos are read from
+    the repository, except for the todos written since the snapshot was taken: the
+    repository hands their previous version (None when they didn't exist) to every
+    live snapshot before writing them.
+    """
+
+    def __init__(self, todos: Dict[int, ToDoModel], index: SortedIndex):
+        self.index = index
+        self.replaced: Dict[int, Optional[ToDoModel]] = {}
+        self._todos = todos
+
+    def get(self, _id: int) -> Optional[ToDoModel]:
+        if _id in self.replaced:
+            return self.replaced[_id]
+        return self._todos.get(_id)
+
+
+class ToDoRepository(ToDoStorage):
+    """Todo repository backed by a dict keyed on id
+
+    Python dicts preserve insertion order, so iterating the repository yields the
+    todos in the order they were added (updates keep their position), just like the
+    plain list this repository replaces. Lookups, updates and deletes are O(1).
+    """
+
+    def __init__(self, todos: Iterable[ToDoModel] = ()):
+        super().__init__()
+        self._todos: Dict[int, ToDoModel] = {}
+
+        # Secondary index on the titles to prefilter the levenshtein search, built by
+        # the first title search and maintained from then on. Indexing every title is
+        # most of the time it takes to seed millions of todos.
+        self._title_index: Optional[TrigramIndex] = None
+
+        # Secondary sorted index per sortable field
+        self._sorted_indexes = {
+            field: SortedIndex(key) for field, key in SORT_KEYS.items()
+        }
+
+        # Insertion order as a sorted index of sequence numbers, which allows seeking
+        # into the default order as well
+        self._sequences: Dict[int, int] = {}
+        self._next_sequence = 0
+        self._insertion_index = SortedIndex(key=lambda sequence: sequence)
+
+        # Ids of the completed and of the open todos, a query filtering on completed
+        # only ranks the matching todos instead of walking the entire order
+        self._ids_by_completed: Dict[bool, Set[int]] = {True: set(), False: set()}
+
+        # Monotonic id counter, ids are never reused; not even after a delete
+        self._next_id = 1
+
+        # Full-text index on the titles and descriptions, built by the first full-text
+        # search (which most deployments never run) and maintained from then on
+        self._text_index: Optional[TextIndex] = None
+
+        # Snapshots of running iterations (see iter_batches), a snapshot is dropped
+        # as soon as its iteration is
+        self._snapshots: WeakSet = WeakSet()
+
+        self._store_many(list(todos))
+
+    def __len__(self) -> int:
+        return len(self._todos)
+
+    def __iter__(self) -> Iterator[ToDoModel]:
+        return iter(self._todos.values())
+
+    def __contains__(self, _id: int) -> bool:
+        return _id in self._todos
+
+    def all(self) -> List[ToDoModel]:
+        """Get all todos in insertion order"""
+
+        return list(self._todos.values())
+
+    def _index_many(self, todos: List[ToDoModel]):
+        """Add todos to the secondary indexes"""
+
+        if self._title_index is not None:
+            for todo in todos:
+                self._title_index.add(todo.id, todo.title)
+        if self._text_index is not None:
+            for todo in todos:
+                self._text_index.add(todo.id, todo.title, todo.description)
+        for todo in todos:
+            self._ids_by_completed[todo.completed].add(todo.id)
+        for index in self._sorted_indexes.values():
+            index.add_many((todo.id, todo) for todo in todos)
+
+        # Updates keep their position in the insertion order
+        sequences = []
+        for todo in todos:
+            if todo.id not in self._sequences:
+                self._sequences[todo.id] = self._next_sequence
+                sequences.append((todo.id, self._next_sequence))
+                self._next_sequence += 1
+        self._insertion_index.add_many(sequences)
+
+    def _unindex_many(self, todos: List[ToDoModel]):
+        """Remove todos from the secondary indexes"""
+
+        if self._title_index is not None:
+            for todo in todos:
+                self._title_index.remove(todo.id)
+        if self._text_index is not None:
+            for todo in todos:
+                self._text_index.remove(todo.id, todo.title, todo.description)
+        for todo in todos:
+            self._ids_by_completed[todo.completed].discard(todo.id)
+        for index in self._sorted_indexes.values():
+            index.remove_many((todo.id, todo) for todo in todos)
+
+    def _preserve(self, ids: Iterable[int]):
+        """Hand the current version of todos about to be written to the snapshots"""
+
+        for snapshot in self._snapshots:
+            for _id in ids:
+                if _id not in snapshot.replaced:
+                    snapshot.replaced[_id] = self._todos.get(_id)
+
+    def _store_many(self, todos: List[ToDoModel]):
+        """Store todos which have an id, replacing the todos with the same id
+
+        The secondary indexes are updated once for the entire batch.
+        """
+
+        ids = {todo.id for todo in todos}
+        if None in ids:
+            raise ValueError("todo id cannot be None")
+        if len(ids) != len(todos):
+            raise ValueError("todo ids must be unique")
+
+        self._preserve(ids)
+        self._unindex_many([self._todos[_id] for _id in ids if _id in self._todos])
+        for todo in todos:
+            self._todos[todo.id] = todo
+        self._index_many(todos)
+
+        if todos:
+            self._next_id = max(self._next_id, max(ids) + 1)
+            self.version += 1
+
+    def _allocate_ids(self, count: int) -> range:
+        """Allocate a block of new ids"""
+
+        ids = range(self._next_id, self._next_id + count)
+        self._next_id += count
+        return ids
+
+    def get(self, _id: int) -> Optional[ToDoModel]:
+        return self._todos.get(_id)
+
+    def add(self, todo: ToDoModel) -> ToDoModel:
+        """Add a todo which already has an id (e.g. when seeding the repository)"""
+
+        self._store_many([todo])
+        return todo
+
+    def update(self, _id: int, todo: ToDoModel) -> Optional[ToDoModel]:
+        """Replace an existing todo, None if there is no such todo"""
+
+        if _id not in self._todos:
+            return None
+
+        todo.id = _id
+        self._store_many([todo])
+        return todo
+
+    def bulk_create(self, todos: List[ToDoModel]) -> List[ToDoModel]:
+        """Store new todos under a freshly allocated block of ids"""
+
+        for _id, todo in zip(self._allocate_ids(len(todos)), todos):
+            todo.id = _id
+        self._store_many(todos)
+        return todos
+
+    def bulk_upsert(self, todos: List[ToDoModel]) -> List[Tuple[ToDoModel, bool]]:
+        """Update the todos whose id exists and create the others
+
+        Todos without an id get a new id, todos with an unknown id are created under
+        that id. Nothing is stored when the ids are not unique. Returns a list of
+        (todo, created) tuples.
+        """
+
+        given_ids = [todo.id for todo in todos if todo.id is not None]
+        if len(set(given_ids)) != len(given_ids):
+            raise ValueError("todo ids must be unique")
+
+        created = [todo.id is None or todo.id not in self._todos for todo in todos]
+
+        # Allocate the new ids after the given ids, so they can not collide
+        if given_ids:
+            self._next_id = max(self._next_id, max(given_ids) + 1)
+        new_ids = iter(self._allocate_ids(sum(todo.id is None for todo in todos)))
+        for todo in todos:
+            if todo.id is None:
+                todo.id = next(new_ids)
+
+        self._store_many(todos)
+        return list(zip(todos, created))
+
+    def bulk_delete(self, ids: List[int]) -> List[bool]:
+        """Delete todos by id, return per id whether it existed"""
+
+        self._preserve(ids)
+        deleted = []
+        for _id in ids:
+            todo = self._todos.pop(_id, None)
+            if todo is not None:
+                deleted.append(todo)
+        if not deleted:
+            return [False] * len(ids)
+
+        self._unindex_many(deleted)
+        self._insertion_index.remove_many(
+            (todo.id, self._sequences.pop(todo.id)) for todo in deleted
+        )
+        self.version += 1
+
+        # An id that is listed twice only existed the first time
+        deleted_ids = {todo.id for todo in deleted}
+        result = []
+        for _id in ids:
+            result.append(_id in deleted_ids)
+            deleted_ids.discard(_id)
+        return result
+
+    def _sort_key(self, sort_by: Optional[str]):
+        """Get the (unique) sort key function for an order, None is insertion order"""
+
+        if sort_by is None:
+            return lambda todo: (self._sequences[todo.id], todo.id)
+
+        key = SORT_KEYS[sort_by]
+        return lambda todo: (key(todo), todo.id)
+
+    def _titles(self) -> TrigramIndex:
+        """Get the title trigram index, built on first use"""
+
+        if self._title_index is None:
+            title_index = TrigramIndex()
+            for todo in self._todos.values():
+                title_index.add(todo.id, todo.title)
+            self._title_index = title_index
+        return self._title_index
+
+    def _text(self) -> TextIndex:
+        """Get the full-text index, built on first use"""
+
+        if self._text_index is None:
+            text_index = TextIndex()
+            for todo in self._todos.values():
+                text_index.add(todo.id, todo.title, todo.description)
+            self._text_index = text_index
+        return self._text_index
+
+    def _order_index(self, sort_by: Optional[str]) -> SortedIndex:
+        """Get the sorted index of an order, None is insertion order"""
+
+        if sort_by is None:
+            return self._insertion_index
+        return self._sorted_indexes[sort_by]
+
+    def query(
+        self,
+        title: Optional[str] = None,
+        sort_by: Optional[str] = None,
+        offset: int = 0,
+        limit: Optional[int] = None,
+        descending: bool = False,
+        after: Optional[Tuple[Any, ...]] = None,
+        filters: ToDoFilter = NO_FILTER,
+        search: Optional[str] = None,
+    ) -> QueryResult:
+        """Get the total number of matching todos and the requested slice of them
+
+        Only the todos up to the requested slice are ranked (with a bounded heap), the
+        remaining matches are counted but never sorted. Without a title the sorted
+        indexes are used, which makes a page a seek plus a slice.
+        """
+
+        validate_key(after, key_types(ranked_query(title, search), sort_by))
+        if limit is None:
+            limit = len(self._todos)
+        if after is not None:
+            offset = 0
+        offset = max(offset, 0)
+
+        # Fetch one extra todo to know whether a next page exists
+        stop = offset + max(limit, 0) + 1
+
+        # Rank by the field (when given), then by the distance (or BM25 rank) and then
+        # by the id
+        if sort_by is None:
+            rank_key = lambda todo, distance: (distance, todo.id)
+        else:
+            sort_key = SORT_KEYS[sort_by]
+            rank_key = lambda todo, distance: (sort_key(todo), distance, todo.id)
+
+        if search is not None:
+            # Only the todos containing every word of the search are scored
+            fields = lambda _id: (self._todos[_id].title, self._todos[_id].description)
+            candidates = [
+                (self._todos[_id], score_rank(score))
+                for _id, score in self._text().search(search, fields)
+            ]
+            if filters.active:
+                matches = filters.predicate()
+                candidates = [x for x in candidates if matches(x[0])]
+
+            ranked = top_k(candidates, stop, lambda x: rank_key(*x), descending, after)
+            ranked = ranked[offset:]
+            todos = [todo for todo, _ in ranked[:limit]]
+            next_key = None
+            if len(ranked) > limit and todos:
+                next_key = rank_key(*ranked[limit - 1])
+            return QueryResult(len(candidates), todos, next_key)
+
+        if title is not None:
+            # Only the todos whose title contains the query (found through the trigram
+            # index) are ranked, so the cost grows with the number of matches instead
+            # of the number of todos
+            candidates = (
+                (self._todos[_id], value) for _id, value in self._titles().search(title)
+            )
+            if filters.active:
+                matches = filters.predicate()
+                candidates = (x for x in candidates if matches(x[0]))
+
+            total, matches = top_k_by_levenshtein(
+                title,
+                candidates,
+                stop,
+                score_cutoff=SEARCH_SCORE_CUTOFF,
+                key=rank_key,
+                reverse=descending,
+                after=after,
+            )
+            matches = matches[offset:]
+            todos = [todo for todo, _ in matches[:limit]]
+            next_key = None
+            if len(matches) > limit and todos:
+                next_key = rank_key(*matches[limit - 1])
+            return QueryResult(total, todos, next_key)
+
+        if filters.active:
+            return self._query_filtered(
+                sort_by, offset, limit, descending, after, filters
+            )
+
+        total = len(self._todos)
+        index = self._order_index(sort_by)
+        if after is None:
+            ids = index.ids(offset, stop, reverse=descending)
+        else:
+            ids = index.ids_after(after, stop, reverse=descending)
+
+        todos = [self._todos[_id] for _id in ids[:limit]]
+        next_key = None
+        if len(ids) > limit and todos:
+            next_key = self._sort_key(sort_by)(todos[-1])
+        return QueryResult(total, todos, next_key)
+
+    def _query_filtered(
+        self,
+        sort_by: Optional[str],
+        offset: int,
+        limit: int,
+        descending: bool,
+        after: Optional[Tuple[Any, ...]],
+        filters: ToDoFilter,
+    ) -> QueryResult:
+        """Query without a title, only the todos passing the filters
+
+        A due date range is a seek into the due date index, only the todos in the
+        range are checked. The completed filter alone ranks the ids with the requested
+        value, unless they are common enough that walking the order finds the page
+        sooner.
+        """
+
+        matches = filters.predicate()
+        sort_key = self._sort_key(sort_by)
+        stop = offset + max(limit, 0) + 1
+        low, high = filters.due_range()
+
+        if low is None and high is None:
+            ids = self._ids_by_completed[filters.completed]
+            total = len(ids)
+
+            # A walk finds the page after about stop * len / total todos, ranking
+            # costs one key per match
+            if stop * len(self._todos) <= total * total:
+                entries = self._order_index(sort_by).iter_entries(after, descending)
+                todos = (self._todos[_id] for _, _id in entries)
+                page = list(islice(filter(matches, todos), offset, stop))
+            else:
+                todos = (self._todos[_id] for _id in ids)
+                page = top_k(todos, stop, sort_key, descending, after)[offset:]
+
+        elif sort_by == "due_date":
+            # The range is a run of the order, the page is read off the range
+            due_index = self._sorted_indexes["due_date"]
+            in_range = (self._todos[_id] for _, _id in due_index.iter_range(low, high))
+            total = sum(map(matches, in_range))
+
+            entries = due_index.iter_range(low, high, descending, after)
+            todos = (self._todos[_id] for _, _id in entries)
+            page = list(islice(filter(matches, todos), offset, stop))
+
+        else:
+            due_index = self._sorted_indexes["due_date"]
+            in_range = (self._todos[_id] for _, _id in due_index.iter_range(low, high))
+            candidates = list(filter(matches, in_range))
+            total = len(candidates)
+            page = top_k(candidates, stop, sort_key, descending, after)[offset:]
+
+        todos = page[:limit]
+        next_key = None
+        if len(page) > limit and todos:
+            next_key = sort_key(todos[-1])
+        return QueryResult(total, todos, next_key)
+
+    def iter_batches(
+        self,
+        title: Optional[str] = None,
+        sort_by: Optional[str] = None,
+        descending: bool = False,
+        batch_size: int = 500,
+        filters: ToDoFilter = NO_FILTER,
+        search: Optional[str] = None,
+    ) -> Iterator[List[ToDoModel]]:
+        """Iterate all matching todos in batches, as they were when the iteration
+        started
+
+        The first batch takes a copy-on-write snapshot of the order, which is
+        O(n / BLOCK_SIZE) instead of a copy of every todo, so a long iteration (e.g. an
+        export) sees one consistent version of the todos whatever is written in
+        between batches. Filtered batches hold the todos of the batch passing the
+        filters.
+
+        With a title (or search) every batch is a keyset query instead (see
+        ToDoStorage.iter_batches), which keeps the memory bounded by the batch size
+        rather than by the number of matches, at the price of ranking the matches
+        again for every batch.
+        """
+
+        if title is not None or search is not None:
+            yield from super().iter_batches(
+                title=title,
+                sort_by=sort_by,
+                descending=descending,
+                batch_size=batch_size,
+                filters=filters,
+                search=search,
+            )
+            return
+
+        matches = filters.predicate() if filters.active else None
+        snapshot = ToDoSnapshot(self._todos, self._order_index(sort_by).snapshot())
+        self._snapshots.add(snapshot)
+        try:
+            for start in range(0, len(snapshot.index), batch_size):
+                ids = snapshot.index.ids(start, start + batch_size, reverse=descending)
+                todos = [snapshot.get(_id) for _id in ids]
+                if matches is not None:
+                    todos = list(filter(matches, todos))
+                if todos:
+                    yield todos
+        finally:
+            self._snapshots.discard(snapshot)
@@ -2,6 +2,7 @@ from passlib.context import CryptContext
 from httpx import AsyncClient, Response
 from unittest.mock import patch
 from models.todo_models import ToDoModel
+from storage.todo_repository import ToDoRepository
 from datetime import datetime, timezone
 from copy import deepcopy
 
@@ -24,7 +25,7 @@ def get_user(*arg, **kwargs):
 
 
 @patch("mock_data.mock_user_database.MockUserDatabase.get_user", side_effect=get_user)
-async def get_bearer_token(async_client: AsyncClient):
+async def get_bearer_token(async_client: AsyncClient, mock_get_user=None):
     # Get authorization header
     form_data = {
         "username": "mock",
@@ -61,6 +62,6 @@ todos = [
 ]
 
 
-# Ensure a fresh copy on each unittest
+# Ensure a fresh repository on each unittest
 def mock_todos():
-    return deepcopy(todos)
+    return ToDoRepository(deepcopy(todos))
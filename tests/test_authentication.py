@@ -0,0 +1,212 @@
+import asyncio
+import threading
+from httpx import AsyncClient, Response
+from fastapi import status
+from unittest.mock import patch
+from helpers.authentication import (
+    create_user,
+    invalidate_user_tokens,
+    user_database,
+    verify_password,
+)
+from helpers.hashing_pool import HashingPool
+from helpers.lru_cache import LRUCache
+from mock_data.mock_user_database import MockUserDatabase
+from models.user_models import NewUser, User
+from tests.mock_functions import get_bearer_token, get_user, mock_todos
+
+
+def test_user_database_is_shared_by_processes(tmp_path):
+    # Two databases on one file, like two workers
+    path = str(tmp_path / "users")
+    user = {**get_user(), "username": "shared"}
+    first = MockUserDatabase(path=path)
+    second = MockUserDatabase(path=path)
+    changed = []
+    second.add_listener(changed.append)
+
+    assert first.add_user(user) is True
+    assert second.get_user("shared") == user
+
+    # A taken username is never overwritten, not even from another process
+    assert second.add_user({**user, "hashed_password": "other"}) is False
+    assert first.get_user("shared") == user
+    assert second.get_user("admin")["is_admin"] is True
+
+    # Updates and deletes reach the listeners of the other database
+    first.update_user("shared", {"disabled": True})
+    assert second.get_user("shared")["disabled"] is True
+    second.add_user({**user, "username": "other"})
+    assert first.delete_user("shared") is True
+    second.refresh()
+    assert changed == ["shared", "shared"]
+    assert sorted(second.user_data) == ["admin", "other"]
+    assert sorted(first.user_data) == ["admin", "other"]
+
+    first.close()
+    second.close()
+
+
+@patch("routes.todos.todos", mock_todos())
+@patch("helpers.authentication.token_cache", LRUCache())
+@patch("mock_data.mock_user_database.MockUserDatabase.get_user", side_effect=get_user)
+async def test_verified_tokens_are_cached(mock_get_user, async_client: AsyncClient):
+    data = await get_bearer_token(async_client)
+    headers = {"Authorization": f"Bearer {data['access_token']}"}
+
+    # Only the first request looks up the user of the token
+    for _ in range(3):
+        response: Response = await async_client.get("/api/todos/1", headers=headers)
+        assert response.status_code == status.HTTP_200_OK
+    assert mock_get_user.call_count == 1
+
+    # Invalidated tokens are verified again
+    assert invalidate_user_tokens("mock") == 1
+    response: Response = await async_client.get("/api/todos/1", headers=headers)
+    assert response.status_code == status.HTTP_200_OK
+    assert mock_get_user.call_count == 2
+
+
+async def test_invalid_tokens_are_rejected(async_client: AsyncClient):
+    headers = {"Authorization": "Bearer invalid"}
+    response: Response = await async_client.get("/api/todos/1", headers=headers)
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+@patch("routes.todos.todos", mock_todos())
+@patch("mock_data.mock_user_database.MockUserDatabase.get_user", side_effect=get_user)
+async def test_login_does_not_block_other_requests(
+    mock_get_user, async_client: AsyncClient
+):
+    data = await get_bearer_token(async_client)
+    headers = {"Authorization": f"Bearer {data['access_token']}"}
+    form_data = {"username": "mock", "password": "mock", "grant_type": "password"}
+
+    # Hold the password verification in the hashing pool until the todo is served
+    started, released = threading.Event(), threading.Event()
+
+    def blocked_verify(*args):
+        started.set()
+        assert released.wait(5)
+        return verify_password(*args)
+
+    with patch("helpers.authentication.verify_password", blocked_verify):
+        login = asyncio.create_task(async_client.post("/api/token", data=form_data))
+        loop = asyncio.get_running_loop()
+        assert await loop.run_in_executor(None, started.wait, 5)
+
+        response: Response = await async_client.get("/api/todos/1", headers=headers)
+        assert response.status_code == status.HTTP_200_OK
+        assert not login.done()
+
+        released.set()
+        response = await login
+    assert response.status_code == status.HTTP_200_OK
+
+
+async def test_cancelled_hashing_jobs_leave_the_queue():
+    pool = HashingPool(max_workers=1, max_pending=2)
+    started, released = threading.Event(), threading.Event()
+
+    def blocked():
+        started.set()
+        assert released.wait(5)
+
+    # The second job waits for the only worker, its caller gives up meanwhile
+    running = asyncio.create_task(pool.run(blocked))
+    loop = asyncio.get_running_loop()
+    assert await loop.run_in_executor(None, started.wait, 5)
+    queued = asyncio.create_task(pool.run(lambda: None))
+    await asyncio.sleep(0)
+    assert pool.stats()["queued"] == 1
+    queued.cancel()
+    await asyncio.gather(queued, return_exceptions=True)
+
+    released.set()
+    await running
+    assert pool.stats()["queued"] == 0
+    assert await pool.run(lambda: 42) == 42
+
+
+@patch("helpers.authentication.password_hashing_pool", HashingPool(max_pending=0))
+@patch("mock_data.mock_user_database.MockUserDatabase.get_user", side_effect=get_user)
+async def test_login_storm_is_shed(mock_get_user, async_client: AsyncClient):
+    form_data = {"username": "mock", "password": "mock", "grant_type": "password"}
+
+    response: Response = await async_client.post("/api/token", data=form_data)
+    assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+    assert response.headers["retry-after"] == "1"
+
+
+def test_user_database_is_persisted(tmp_path):
+    path = str(tmp_path / "users")
+    user = {**get_user(), "username": "persisted"}
+
+    database = MockUserDatabase(path=path)
+    database.add_user(user)
+    database.close()
+
+    # Users survive a restart, returned users are copies
+    database = MockUserDatabase(path=path)
+    assert database.get_user("persisted") == user
+    database.get_user("persisted").pop("hashed_password")
+    assert database.get_user("persisted") == user
+
+    changed = []
+    database.add_listener(changed.append)
+    assert database.update_user("persisted", {"disabled": True}) is True
+    assert database.delete_user("persisted") is True
+    assert database.delete_user("persisted") is False
+    assert changed == ["persisted", "persisted"]
+    database.close()
+
+    assert MockUserDatabase(path=path).get_user("persisted") == {}
+
+
+@patch("routes.todos.todos", mock_todos())
+@patch("helpers.authentication.token_cache", LRUCache())
+@patch("mock_data.mock_user_database.MockUserDatabase.get_user", side_effect=get_user)
+async def test_disabled_user_tokens_are_invalidated(
+    mock_get_user, async_client: AsyncClient
+):
+    data = await get_bearer_token(async_client)
+    headers = {"Authorization": f"Bearer {data['access_token']}"}
+
+    response: Response = await async_client.get("/api/todos/1", headers=headers)
+    assert response.status_code == status.HTTP_200_OK
+
+    # Disabling the user drops the cached token, so the new state is seen at once
+    mock_get_user.side_effect = lambda username: {**get_user(), "disabled": True}
+    user_database.add_user(get_user())
+    user_database.update_user("mock", {"disabled": True})
+
+    response: Response = await async_client.get("/api/todos/1", headers=headers)
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    user_database.delete_user("mock")
+
+
+async def test_concurrent_creates_of_a_user():
+    database = MockUserDatabase()
+    admin = User(username="admin", is_admin=True)
+    new_users = [
+        NewUser(
+            username="racer",
+            email="racer@example.com",
+            full_name=name,
+            clear_password="Secret#123",
+        )
+        for name in ("First", "Second")
+    ]
+
+    # Both creates pass the first check while their passwords are hashed, only one
+    # of them stores the user
+    with patch("helpers.authentication.user_database", database):
+        results = await asyncio.gather(
+            *(create_user(x, admin) for x in new_users), return_exceptions=True
+        )
+
+    created = [x for x in results if isinstance(x, User)]
+    rejected = [x for x in results if not isinstance(x, User)]
+    assert len(created) == 1
+    assert [x.detail for x in rejected] == ["Username taken"]
+    assert database.get_user("racer")["full_name"] == created[0].full_name
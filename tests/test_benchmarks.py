@@ -0,0 +1,56 @@
+import pytest
+from benchmarks.load import parse_mix, percentile
+from benchmarks.suite import compare, summarize
+
+
+def test_summarize_timings():
+    stats = summarize([0.001, 0.003, 0.002])
+
+    assert stats["iterations"] == 3
+    assert stats["median_ms"] == 2
+    assert stats["min_ms"] == 1
+
+
+def test_compare_with_baseline():
+    baseline = [
+        {"name": "get_todo", "size": 1000, "median_ms": 1.0},
+        {"name": "get_todo", "size": 10000, "median_ms": 1.0},
+        {"name": "token", "size": 1000, "median_ms": 100.0},
+    ]
+    results = [
+        # Within the tolerance
+        {"name": "get_todo", "size": 1000, "median_ms": 1.2},
+        # Regressed
+        {"name": "get_todo", "size": 10000, "median_ms": 2.0},
+        {"name": "token", "size": 1000, "median_ms": 151.0},
+        # Not in the baseline
+        {"name": "get_all[title]", "size": 1000, "median_ms": 99.0},
+    ]
+
+    regressions = compare(results, baseline, tolerance=0.5)
+    assert [x.split(":")[0] for x in regressions] == [
+        "get_todo (10000 todos)",
+        "token (1000 todos)",
+    ]
+
+    # Sub-millisecond noise is not reported
+    fast = [{"name": "get_todo", "size": 1000, "median_ms": 0.01}]
+    assert compare([{**fast[0], "median_ms": 0.1}], fast) == []
+
+
+def test_parse_load_mix():
+    assert parse_mix("get=10, list=5,login") == {"get": 10, "list": 5, "login": 1}
+
+    with pytest.raises(ValueError):
+        parse_mix("get=1,fetch=2")
+    with pytest.raises(ValueError):
+        parse_mix("get=0")
+
+
+def test_percentile():
+    timings = list(range(1, 101))
+
+    assert percentile(timings, 50) == 50
+    assert percentile(timings, 99) == 99
+    assert percentile(timings, 100) == 100
+    assert percentile([7], 95) == 7
@@ -0,0 +1,63 @@
+import asyncio
+from helpers.change_feed import KEEPALIVE_FRAME, ChangeFeed
+
+
+def test_change_feed_resumes_from_sequence():
+    feed = ChangeFeed(size=3, token="feed")
+    feed.publish([("created", 1, b'{"id":1}'), ("updated", 1, b'{"id":1}')])
+    feed.publish([("deleted", 1, None)])
+
+    assert [x.sequence for x in feed.events_after(0)] == [1, 2, 3]
+    assert [x.type for x in feed.events_after(1)] == ["updated", "deleted"]
+    assert feed.events_after(3) == []
+    assert feed.events_after(2)[0].frame == (
+        b'id: feed-3\nevent: deleted\ndata: {"sequence":3,"type":"deleted","id":1}\n\n'
+    )
+
+    # Only the last three events are kept, older and unknown sequences are lost
+    feed.publish([("created", 2, b'{"id":2}')])
+    assert [x.sequence for x in feed.events_after(1)] == [2, 3, 4]
+    assert feed.events_after(0) is None
+    assert feed.events_after(5) is None
+
+
+def test_change_feed_ids_belong_to_one_feed():
+    feed = ChangeFeed(size=3)
+
+    # Ids of another feed (e.g. before a restart) never resume this one
+    assert feed.sequence_of(feed.event_id(7)) == 7
+    assert feed.sequence_of(ChangeFeed(size=3).event_id(7)) is None
+    assert feed.sequence_of("7") is None
+    assert feed.sequence_of(f"{feed.token}--7") is None
+
+
+async def test_change_feed_streams_to_subscribers():
+    feed = ChangeFeed(size=10, token="feed")
+    feed.publish([("created", 1, b'{"id":1}')])
+
+    resumed = feed.stream(after="feed-0", keepalive=60)
+    new_only = feed.stream(after=None, keepalive=60)
+    lost = feed.stream(after="other-0", keepalive=60)
+
+    assert (await anext(resumed)).startswith(b"id: feed-1\nevent: created\n")
+    assert await anext(lost) == b'id: feed-1\nevent: reset\ndata: {"sequence":1}\n\n'
+
+    # Waiting subscribers are woken by the next publish
+    waiting = [asyncio.ensure_future(anext(x)) for x in (resumed, new_only, lost)]
+    await asyncio.sleep(0)
+    assert not any(x.done() for x in waiting)
+    feed.publish([("deleted", 1, None)])
+    for frame in await asyncio.gather(*waiting):
+        assert frame.startswith(b"id: feed-2\nevent: deleted\n")
+
+    # A subscriber going away doesn't affect the others waiting
+    gone, staying = (asyncio.ensure_future(anext(x)) for x in (resumed, new_only))
+    await asyncio.sleep(0)
+    gone.cancel()
+    await asyncio.sleep(0)
+    feed.publish([("created", 2, b'{"id":2}')])
+    assert (await staying).startswith(b"id: feed-3\nevent: created\n")
+
+    # Idle subscribers get keep-alive comments
+    idle = feed.stream(after=None, keepalive=0.01)
+    assert await anext(idle) == KEEPALIVE_FRAME
@@ -0,0 +1,184 @@
+from copy import deepcopy
+from datetime import datetime, timedelta, timezone
+import pytest
+from helpers.string_column import StringColumn
+from models.todo_models import ToDoModel
+from storage.base import ToDoFilter
+from storage.columnar_repository import ColumnarToDoRepository
+from storage.todo_repository import ToDoRepository
+from tests.mock_functions import todos as mock_data
+
+
+def new_todo(title="New Todo", days=0, tzinfo=timezone.utc):
+    return ToDoModel(
+        title=title,
+        description=f"Description {days}",
+        due_date=datetime(1970, 1, 1, tzinfo=tzinfo) + timedelta(days=days),
+        completed=days % 2 == 0,
+    )
+
+
+@pytest.fixture
+def storages():
+    """The in-memory and the columnar storage filled with the same todos"""
+
+    columnar = ColumnarToDoRepository(deepcopy(mock_data))
+    memory = ToDoRepository(deepcopy(mock_data))
+    for days, title in enumerate(("Title 4", "Another title", "Tilte 6", "Mock 7")):
+        columnar.create(new_todo(title, days))
+        memory.create(new_todo(title, days))
+
+    return memory, columnar
+
+
+def test_string_column_find():
+    column = StringColumn()
+    for value in ("abc", "cde", "xcdx", "ümlaut"):
+        column.append(value)
+
+    assert column[3] == "ümlaut"
+    assert list(column.find("cd")) == [1, 2]
+    # "abc" + "cde" contains "bcc" but no record does
+    assert list(column.find("bcc")) == []
+    assert list(column.find("mla")) == [3]
+
+
+def test_columnar_repository_round_trips_todos():
+    storage = ColumnarToDoRepository()
+    todos = [
+        new_todo("Naive", tzinfo=None),
+        new_todo("UTC", days=3),
+        new_todo("Offset", tzinfo=timezone(timedelta(hours=-5, minutes=-30))),
+    ]
+
+    for todo in storage.bulk_create(deepcopy(todos)):
+        assert storage.get(todo.id) == todo
+        assert storage.get(todo.id).due_date.utcoffset() == todo.due_date.utcoffset()
+    assert storage.get(42) is None
+
+
+def test_columnar_repository_orders_like_memory(storages):
+    memory, columnar = storages
+
+    for kwargs in (
+        {},
+        {"sort_by": "id", "offset": 2, "limit": 3},
+        {"sort_by": "title", "descending": True},
+        {"sort_by": "due_date", "offset": 1, "descending": True},
+        {"title": "title"},
+        {"title": "TITLE", "sort_by": "description", "descending": True, "limit": 2},
+        {"title": "ti"},
+    ):
+        assert columnar.query(**kwargs) == memory.query(**kwargs)
+
+
+def test_columnar_repository_keyset_pagination(storages):
+    memory, columnar = storages
+
+    for kwargs in (
+        {},
+        {"sort_by": "title"},
+        {"sort_by": "due_date", "descending": True},
+        {"title": "title", "sort_by": "id"},
+    ):
+        expected = memory.query(**kwargs).todos
+
+        # Walk the listing two todos at a time
+        walked, after = [], None
+        while True:
+            result = columnar.query(limit=2, after=after, **kwargs)
+            walked.extend(result.todos)
+            after = result.next_key
+            if after is None:
+                break
+
+        assert walked == expected
+
+
+def test_columnar_repository_writes_and_compaction(storages):
+    memory, columnar = storages
+    renamed = ToDoModel(**{**new_todo("Renamed").model_dump(), "id": 2})
+    upsert = [new_todo("Upserted"), renamed]
+
+    upserted = columnar.bulk_upsert(deepcopy(upsert))
+    assert upserted == memory.bulk_upsert(deepcopy(upsert))
+    assert columnar.bulk_delete([1, 42, 1]) == memory.bulk_delete([1, 42, 1])
+    updated = columnar.update(3, new_todo("Title 3"))
+    assert updated == memory.update(3, new_todo("Title 3"))
+    assert columnar.query(title="title") == memory.query(title="title")
+
+    # Rewriting every todo leaves more garbage than live data, which is compacted
+    ids = [todo.id for todo in memory.all()]
+    for _id in ids:
+        columnar.update(_id, new_todo(f"Again {_id}"))
+        memory.update(_id, new_todo(f"Again {_id}"))
+    assert columnar._garbage <= len(columnar)
+    assert len(columnar._titles) < 2 * len(ids)
+
+    for sort_by in (None, "id", "title", "due_date"):
+        assert columnar.query(sort_by=sort_by) == memory.query(sort_by=sort_by)
+    assert columnar.query(title="again") == memory.query(title="again")
+    assert columnar.create(new_todo()).id == memory.create(new_todo()).id
+
+
+def test_columnar_repository_is_compact():
+    storage = ColumnarToDoRepository()
+    storage.bulk_create([new_todo(f"Todo number {i}", i) for i in range(1000)])
+
+    # Columns, orders and packed strings stay well below 200 bytes per todo
+    assert storage.nbytes < 200 * len(storage)
+
+
+def test_columnar_repository_filters_like_memory(storages):
+    memory, columnar = storages
+    utc_start = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+    for filters in (
+        ToDoFilter(completed=True),
+        ToDoFilter(completed=False),
+        ToDoFilter(due_after=datetime(1970, 1, 2)),
+        ToDoFilter(False, utc_start, datetime(1970, 1, 3)),
+    ):
+        for kwargs in (
+            {},
+            {"sort_by": "title"},
+            {"sort_by": "due_date", "descending": True},
+            {"title": "title", "sort_by": "id"},
+        ):
+            expected = memory.query(filters=filters, **kwargs)
+            assert columnar.query(filters=filters, **kwargs) == expected
+            page = {"offset": 1, "limit": 2, "filters": filters, **kwargs}
+            assert columnar.query(**page) == memory.query(**page)
+
+            # Walk the filtered listing one todo at a time
+            walked, after = [], None
+            while True:
+                result = columnar.query(limit=1, after=after, filters=filters, **kwargs)
+                walked.extend(result.todos)
+                after = result.next_key
+                if after is None:
+                    break
+            assert walked == expected.todos
+
+
+def test_columnar_repository_searches_like_memory(storages):
+    memory, columnar = storages
+
+    def check():
+        for kwargs in (
+            {"search": "title"},
+            {"search": "description 2", "sort_by": "due_date", "descending": True},
+            {"search": '"another title"'},
+            {"search": "title", "filters": ToDoFilter(completed=True)},
+        ):
+            assert columnar.query(**kwargs) == memory.query(**kwargs)
+
+    check()
+
+    # The full-text index follows the writes once it's built
+    renamed = ToDoModel(**{**new_todo("Another title", 5).model_dump(), "id": 2})
+    columnar.bulk_upsert([deepcopy(renamed)])
+    memory.bulk_upsert([deepcopy(renamed)])
+    columnar.delete(1)
+    memory.delete(1)
+    check()
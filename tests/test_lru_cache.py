@@ -0,0 +1,30 @@
+from helpers.lru_cache import LRUCache
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+
+    # Touch "a" so "b" becomes the least recently used entry
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+    assert cache.stats() == {
+        "size": 2,
+        "maxsize": 2,
+        "hits": 2,
+        "misses": 1,
+        "evictions": 1,
+        "expirations": 0,
+    }
+
+
+def test_lru_cache_expires_entries():
+    cache = LRUCache(maxsize=2, ttl=60)
+    cache.set("a", 1, ttl=0)
+
+    assert cache.get("a", "expired") == "expired"
+    assert cache.stats()["expirations"] == 1
@@ -0,0 +1,63 @@
+from httpx import AsyncClient, Response
+from unittest.mock import patch
+from helpers.authentication import token_cache
+from helpers.metrics import Histogram, Metrics, metrics
+from tests.mock_functions import get_bearer_token, get_user, mock_todos
+
+
+def test_histogram_samples():
+    histogram = Histogram(buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(value)
+
+    assert list(histogram.samples("latency", {"route": "/a"})) == [
+        'latency_bucket{route="/a",le="0.1"} 2',
+        'latency_bucket{route="/a",le="1.0"} 3',
+        'latency_bucket{route="/a",le="+Inf"} 4',
+        'latency_sum{route="/a"} 2.65',
+        'latency_count{route="/a"} 4',
+    ]
+
+
+def test_render_escapes_labels():
+    registry = Metrics()
+    registry.request_finished("GET", 'a"b\\c', 200, 0.01)
+
+    assert 'route="a\\"b\\\\c",status="200"} 1' in registry.render()
+
+
+@patch("routes.todos.todos", mock_todos())
+@patch("mock_data.mock_user_database.MockUserDatabase.get_user", side_effect=get_user)
+async def test_metrics_endpoint(mock_get_user, async_client: AsyncClient):
+    metrics.clear()
+    token_cache.clear()
+    token = (await get_bearer_token(async_client))["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    await async_client.get("/api/todos?page_size=2&title=Title", headers=headers)
+    await async_client.get("/api/todos/1", headers=headers)
+    await async_client.get("/api/todos/42", headers=headers)
+    await async_client.get("/no/such/path")
+
+    response: Response = await async_client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+
+    lines = response.text.splitlines()
+    for line in (
+        'http_requests_total{method="GET",route="/api/todos",status="200"} 1',
+        'http_requests_total{method="GET",route="/api/todos/{_id}",status="200"} 1',
+        'http_requests_total{method="GET",route="/api/todos/{_id}",status="404"} 1',
+        'http_requests_total{method="GET",route="unmatched",status="404"} 1',
+        'http_requests_total{method="POST",route="/api/token",status="200"} 1',
+        'http_requests_in_flight{method="GET",route="/api/todos"} 0',
+        # The metrics request itself is in flight
+        'http_requests_in_flight{method="GET",route="/metrics"} 1',
+        'http_request_duration_seconds_count{method="GET",route="/api/todos"} 1',
+        'todo_operation_duration_seconds_count{operation="levenshtein_search"} 1',
+        'todo_operation_duration_seconds_count{operation="bcrypt_verify"} 1',
+    ):
+        assert line in lines
+
+    operations = [x for x in lines if x.startswith("todo_operation_duration_seconds")]
+    assert any('operation="jwt_decode"' in x for x in operations)
@@ -0,0 +1,150 @@
+import os
+from httpx import AsyncClient, Response
+from fastapi import status
+from unittest.mock import AsyncMock, patch
+from helpers.authentication import token_cache
+from helpers.profiling import ProfilingMiddleware, profile_requested, prune_profiles
+from tests.mock_functions import get_bearer_token, get_user, mock_todos
+
+
+def get_admin(*args, **kwargs):
+    return {**get_user(), "is_admin": True}
+
+
+async def get_headers(async_client: AsyncClient):
+    token_cache.clear()
+    token = (await get_bearer_token(async_client))["access_token"]
+    return {"Authorization": f"Bearer {token}"}
+
+
+def test_profile_requested():
+    def scope(headers=(), query_string=b""):
+        return {"headers": list(headers), "query_string": query_string}
+
+    assert profile_requested(scope([(b"x-profile", b"1")]))
+    assert profile_requested(scope(query_string=b"page_size=2&profile=true"))
+    assert not profile_requested(scope([(b"x-profile", b"0")], b"profile=1"))
+    assert not profile_requested(scope(query_string=b"title=profile"))
+    assert not profile_requested(scope([(b"accept", b"*/*")]))
+
+
+@patch("routes.todos.todos", mock_todos())
+@patch("mock_data.mock_user_database.MockUserDatabase.get_user", side_effect=get_user)
+async def test_profiling_is_admin_only(
+    mock_get_user, async_client: AsyncClient, tmp_path
+):
+    with patch("helpers.profiling.PROFILE_PATH", str(tmp_path)):
+        headers = await get_headers(async_client)
+
+        response: Response = await async_client.get(
+            "/api/todos?page_size=2", headers={**headers, "X-Profile": "1"}
+        )
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+        response: Response = await async_client.get("/api/todos?page_size=2&profile=1")
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+        # Requests not asking for a profile are not profiled
+        response: Response = await async_client.get(
+            "/api/todos?page_size=2", headers=headers
+        )
+        assert response.status_code == status.HTTP_200_OK
+        assert "x-profile-id" not in response.headers
+        assert os.listdir(tmp_path) == []
+
+
+@patch("routes.todos.todos", mock_todos())
+@patch("mock_data.mock_user_database.MockUserDatabase.get_user", side_effect=get_admin)
+async def test_profile_request(mock_get_user, async_client: AsyncClient, tmp_path):
+    with patch("helpers.profiling.PROFILE_PATH", str(tmp_path)):
+        headers = await get_headers(async_client)
+
+        response: Response = await async_client.get(
+            "/api/todos?page_size=2&title=Title&sort_by=id&profile=1", headers=headers
+        )
+        assert response.status_code == status.HTTP_200_OK
+        assert len(response.json()["result"]) == 2
+
+        profile_id = response.headers["x-profile-id"]
+        assert os.listdir(tmp_path) == [f"{profile_id}.pstats"]
+
+        response = await async_client.get(
+            f"/api/profiles/{profile_id}", headers=headers
+        )
+        assert response.status_code == status.HTTP_200_OK
+        assert "function calls" in response.text
+        assert "get_all" in response.text
+
+        response = await async_client.get(
+            f"/api/profiles/{profile_id}?format=pstats", headers=headers
+        )
+        assert response.status_code == status.HTTP_200_OK
+        assert response.content == (tmp_path / f"{profile_id}.pstats").read_bytes()
+
+        for profile_id in ("0-00000000", "..%2Fsettings"):
+            response = await async_client.get(
+                f"/api/profiles/{profile_id}", headers=headers
+            )
+            assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+@patch("routes.todos.todos", mock_todos())
+@patch("mock_data.mock_user_database.MockUserDatabase.get_user", side_effect=get_admin)
+async def test_streaming_routes_are_not_profiled(
+    mock_get_user, async_client: AsyncClient, tmp_path
+):
+    with patch("helpers.profiling.PROFILE_PATH", str(tmp_path)):
+        headers = await get_headers(async_client)
+
+        response: Response = await async_client.get(
+            "/api/todos/export?profile=1", headers=headers
+        )
+        assert response.status_code == status.HTTP_200_OK
+        assert "x-profile-id" not in response.headers
+        assert os.listdir(tmp_path) == []
+
+
+async def test_profiled_requests_run_one_at_a_time(tmp_path):
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"{}"})
+
+    async def call(middleware):
+        messages = []
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {
+            "type": "http",
+            "path": "/api/todos",
+            "headers": [(b"x-profile", b"1")],
+            "query_string": b"",
+        }
+        await middleware(scope, None, send)
+        return messages[0]
+
+    middleware = ProfilingMiddleware(app)
+    with patch("helpers.profiling.PROFILE_PATH", str(tmp_path)), patch.object(
+        ProfilingMiddleware, "authorize", AsyncMock()
+    ):
+        # A request asking for a profile while another one is profiled is turned down
+        async with middleware._lock:
+            response_start = await call(middleware)
+        assert response_start["status"] == status.HTTP_409_CONFLICT
+        assert os.listdir(tmp_path) == []
+
+        response_start = await call(middleware)
+        assert response_start["status"] == status.HTTP_200_OK
+        assert len(os.listdir(tmp_path)) == 1
+
+
+def test_prune_profiles(tmp_path):
+    names = ["900-0000000a.pstats", "1000-0000000b.pstats", "1100-0000000c.pstats"]
+    for name in names + ["notes.txt"]:
+        (tmp_path / name).write_bytes(b"")
+
+    # The oldest profiles go, by time rather than by name, other files are kept
+    with patch("helpers.profiling.PROFILE_PATH", str(tmp_path)):
+        prune_profiles(2)
+    assert sorted(os.listdir(tmp_path)) == sorted(names[1:] + ["notes.txt"])
@@ -0,0 +1,40 @@
+from datetime import datetime
+from unittest.mock import patch
+from mock_data.generate_todos import generate_todos
+from mock_data.snapshot import load_snapshot, save_snapshot
+from main import init_app
+from storage.factory import seed_stats
+from storage.todo_repository import ToDoRepository
+
+
+def test_generate_todos_is_deterministic():
+    start = datetime(2024, 1, 1)
+    todos = generate_todos(50, seed=1, start=start)
+
+    assert [todo.id for todo in todos] == list(range(50))
+    assert todos == generate_todos(50, seed=1, start=start)
+    assert todos != generate_todos(50, seed=2, start=start)
+    assert all(7 <= (todo.due_date - start).days <= 365 for todo in todos)
+
+
+def test_snapshot_round_trip(tmp_path):
+    path = str(tmp_path / "todos.snapshot")
+    todos = generate_todos(50, seed=1)
+
+    save_snapshot(path, todos)
+    assert load_snapshot(path) == todos
+
+
+async def test_lifespan_seeds_an_empty_storage():
+    app = init_app()
+    storage = ToDoRepository()
+
+    with patch("routes.todos.todos", storage):
+        async with app.router.lifespan_context(app):
+            assert len(storage) == 1000
+            assert seed_stats["todos"] == 1000
+
+        # A storage holding todos is not seeded again
+        storage.delete(0)
+        async with app.router.lifespan_context(app):
+            assert len(storage) == 999
@@ -0,0 +1,59 @@
+import pytest
+import random
+from helpers.sorted_index import SortedIndex
+
+
+def test_sorted_index_matches_sorted():
+    random.seed(5)
+    index = SortedIndex(key=lambda value: value)
+    values = {}
+
+    # Enough entries to split blocks, with plenty of duplicate keys
+    for _id in range(5000):
+        values[_id] = random.randint(0, 100)
+        index.add(_id, values[_id])
+    for _id in random.sample(range(5000), 2500):
+        index.remove(_id, values.pop(_id))
+
+    expected = [_id for _, _id in sorted((v, k) for k, v in values.items())]
+    assert len(index) == 2500
+    assert index.ids(0, 2500) == expected
+    assert index.ids(1000, 1010) == expected[1000:1010]
+    assert index.ids(5, 15, reverse=True) == expected[::-1][5:15]
+    assert index.ids(2490, 3000) == expected[2490:]
+
+
+def test_sorted_index_remove_unknown_entry():
+    index = SortedIndex(key=lambda value: value)
+    index.add(1, "a")
+
+    with pytest.raises(KeyError):
+        index.remove(1, "b")
+
+
+def test_sorted_index_snapshot_is_copy_on_write():
+    random.seed(7)
+    index = SortedIndex(key=lambda value: value)
+    for _id in range(3000):
+        index.add(_id, _id % 100)
+
+    expected = index.ids(0, 3000)
+    snapshot = index.snapshot()
+
+    # Writes after the snapshot (including block splits and removals) leave it as it is
+    for _id in range(3000, 4000):
+        index.add(_id, _id % 100)
+    for _id in random.sample(range(3000), 1000):
+        index.remove(_id, _id % 100)
+
+    assert snapshot.ids(0, 3000) == expected
+    assert len(index) == 3000
+    assert index.ids(0, 3000) == sorted(index.ids(0, 3000), key=lambda x: (x % 100, x))
+
+    # Blocks nobody wrote to stay shared
+    untouched = SortedIndex(key=lambda value: value)
+    untouched.add_many((_id, _id) for _id in range(2000))
+    copy = untouched.snapshot()
+    untouched.add(2000, 2000)
+    assert untouched._blocks[0] is copy._blocks[0]
+    assert untouched._blocks[-1] is not copy._blocks[-1]
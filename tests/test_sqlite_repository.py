@@ -0,0 +1,205 @@
+from copy import deepcopy
+from datetime import datetime, timedelta, timezone
+import pytest
+from models.todo_models import ToDoModel
+from storage.base import ToDoFilter
+from storage.sqlite_repository import SQLiteToDoRepository
+from storage.todo_repository import ToDoRepository
+from tests.mock_functions import todos as mock_data
+
+
+def new_todo(title="New Todo", days=0):
+    return ToDoModel(
+        title=title,
+        description=f"Description {days}",
+        due_date=datetime(1970, 1, 1, tzinfo=timezone.utc) + timedelta(days=days),
+        completed=False,
+    )
+
+
+@pytest.fixture
+def storages(tmp_path):
+    """The in-memory and the SQLite storage filled with the same todos"""
+
+    sqlite = SQLiteToDoRepository(str(tmp_path / "todos.sqlite3"), pool_size=1)
+    sqlite.bulk_upsert(deepcopy(mock_data))
+    memory = ToDoRepository(deepcopy(mock_data))
+    for days, title in enumerate(("Title 4", "Another title", "Tilte 6", "Mock 7")):
+        sqlite.create(new_todo(title, days))
+        memory.create(new_todo(title, days))
+
+    yield memory, sqlite
+    sqlite.close()
+
+
+def test_sqlite_repository_crud(tmp_path):
+    storage = SQLiteToDoRepository(str(tmp_path / "todos.sqlite3"), pool_size=1)
+    version = storage.version
+
+    todo = storage.create(new_todo())
+    assert storage.get(todo.id) == todo
+    assert len(storage) == 1
+    assert storage.version > version
+
+    assert storage.update(todo.id, new_todo("Updated")).title == "Updated"
+    assert storage.update(42, new_todo()) is None
+    assert storage.delete(todo.id) is True
+    assert storage.delete(todo.id) is False
+
+    # Deleted ids are not handed out again
+    assert storage.create(new_todo()).id == todo.id + 1
+
+    # Ids beyond SQLite INTEGER can't exist
+    assert storage.get(2**63) is None
+    assert storage.update(2**63, new_todo()) is None
+    assert storage.bulk_delete([2**63, todo.id + 1]) == [False, True]
+    with pytest.raises(ValueError):
+        storage.bulk_upsert([new_todo().model_copy(update={"id": 2**64})])
+    storage.close()
+
+
+def test_sqlite_repository_persists(tmp_path):
+    path = str(tmp_path / "todos.sqlite3")
+    storage = SQLiteToDoRepository(path, pool_size=1)
+    todo = storage.create(new_todo())
+    storage.close()
+
+    storage = SQLiteToDoRepository(path, pool_size=1)
+    assert storage.get(todo.id) == todo
+    storage.close()
+
+
+def test_sqlite_repository_versions_are_shared(tmp_path):
+    # Two storages on one database, like two workers
+    path = str(tmp_path / "todos.sqlite3")
+    first = SQLiteToDoRepository(path, pool_size=1)
+    second = SQLiteToDoRepository(path, pool_size=1)
+
+    todo = first.create(new_todo())
+    assert second.version == first.version
+    assert second.todo_etag(todo.id) == first.todo_etag(todo.id)
+
+    version, etag = first.version, first.todo_etag(todo.id)
+    with second.writing([todo.id]):
+        second.update(todo.id, new_todo("Updated"))
+    assert first.version > version
+    assert first.todo_etag(todo.id) != etag
+    assert first.get(todo.id).title == "Updated"
+
+    # Writes which change nothing keep the version
+    version = first.version
+    assert second.update(42, new_todo()) is None
+    assert first.version == version
+
+    first.close()
+    second.close()
+
+
+def test_sqlite_repository_orders_like_memory(storages):
+    memory, sqlite = storages
+
+    for kwargs in (
+        {},
+        {"sort_by": "id", "offset": 2, "limit": 3},
+        {"sort_by": "title", "descending": True},
+        {"sort_by": "due_date"},
+        {"title": "title"},
+        {"title": "TITLE", "sort_by": "description", "descending": True, "limit": 2},
+        {"title": "ti"},
+    ):
+        assert sqlite.query(**kwargs) == memory.query(**kwargs)
+
+
+def test_sqlite_repository_keyset_pagination(storages):
+    memory, sqlite = storages
+
+    for kwargs in ({}, {"sort_by": "title"}, {"title": "title", "sort_by": "id"}):
+        expected = memory.query(**kwargs).todos
+
+        # Walk the listing two todos at a time
+        walked, after = [], None
+        while True:
+            result = sqlite.query(limit=2, after=after, **kwargs)
+            walked.extend(result.todos)
+            after = result.next_key
+            if after is None:
+                break
+
+        assert walked == expected
+
+
+def test_sqlite_repository_bulk_operations(storages):
+    memory, sqlite = storages
+    upsert = [new_todo("Upserted"), ToDoModel(**{**new_todo().model_dump(), "id": 2})]
+
+    assert sqlite.bulk_upsert(deepcopy(upsert)) == memory.bulk_upsert(deepcopy(upsert))
+    assert sqlite.bulk_delete([1, 42]) == memory.bulk_delete([1, 42]) == [True, False]
+    assert sqlite.query() == memory.query()
+
+    duplicates = [ToDoModel(**{**new_todo().model_dump(), "id": 3})] * 2
+    with pytest.raises(ValueError):
+        sqlite.bulk_upsert(duplicates)
+
+
+def test_sqlite_repository_filters_like_memory(storages):
+    memory, sqlite = storages
+    utc_start = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+    for filters in (
+        ToDoFilter(completed=True),
+        ToDoFilter(completed=False),
+        ToDoFilter(due_after=datetime(1970, 1, 2)),
+        ToDoFilter(False, utc_start, datetime(1970, 1, 3)),
+    ):
+        for kwargs in (
+            {},
+            {"sort_by": "title"},
+            {"sort_by": "due_date", "descending": True},
+            {"title": "title", "sort_by": "id"},
+        ):
+            expected = memory.query(filters=filters, **kwargs)
+            assert sqlite.query(filters=filters, **kwargs) == expected
+            page = {"offset": 1, "limit": 2, "filters": filters, **kwargs}
+            assert sqlite.query(**page) == memory.query(**page)
+
+            # Walk the filtered listing one todo at a time
+            walked, after = [], None
+            while True:
+                result = sqlite.query(limit=1, after=after, filters=filters, **kwargs)
+                walked.extend(result.todos)
+                after = result.next_key
+                if after is None:
+                    break
+            assert walked == expected.todos
+
+
+def test_sqlite_repository_full_text_search(storages):
+    memory, sqlite = storages
+
+    for kwargs in (
+        {"search": "title"},
+        {"search": "description 2", "sort_by": "due_date"},
+        {"search": '"another title"'},
+        {"search": '"title another"'},
+        {"search": "title", "filters": ToDoFilter(completed=True)},
+    ):
+        expected = memory.query(**kwargs)
+        result = sqlite.query(**kwargs)
+        assert result.total == expected.total
+        assert {x.id for x in result.todos} == {x.id for x in expected.todos}
+
+        # Walk the ranked matches one todo at a time
+        walked, after = [], None
+        while True:
+            page = sqlite.query(limit=1, after=after, **kwargs)
+            walked.extend(page.todos)
+            after = page.next_key
+            if after is None:
+                break
+        assert walked == result.todos
+
+    # The full-text index follows the writes
+    sqlite.update(2, new_todo("Renamed todo"))
+    assert [x.id for x in sqlite.query(search="renamed").todos] == [2]
+    sqlite.delete(2)
+    assert sqlite.query(search="renamed").total == 0
@@ -0,0 +1,54 @@
+from helpers.text_index import TextIndex, parse_query, tokenize
+
+
+def test_tokenize_and_parse_query():
+    assert tokenize("Buy milk, eggs & self_raising flour!") == [
+        "buy",
+        "milk",
+        "eggs",
+        "self",
+        "raising",
+        "flour",
+    ]
+    assert parse_query('Milk "fresh  EGGS" milk "flour"') == (
+        ["milk", "fresh", "eggs", "flour"],
+        [["fresh", "eggs"]],
+    )
+
+
+def test_text_index_ranks_by_bm25():
+    fields = {
+        1: ("Groceries", "Buy milk and eggs"),
+        2: ("Milk", "Buy milk"),
+        3: ("Garden", "Water the plants, then buy seeds"),
+        4: ("Eggs", "Eggs for the cake and more eggs, no milk"),
+    }
+    index = TextIndex()
+    for key, values in fields.items():
+        index.add(key, *values)
+
+    def search(query):
+        scores = dict(index.search(query, fields.__getitem__))
+        return sorted(scores, key=lambda key: (-scores[key], key))
+
+    # Matches in the (heavier) title and repeated words rank first
+    assert search("milk") == [2, 1, 4]
+    assert search("eggs") == [4, 1]
+    assert search("buy milk") == [2, 1]
+    assert search("bread") == []
+
+    # Phrases must be runs of words within one field
+    assert search('"buy milk"') == [2, 1]
+    assert search('"and eggs"') == [1]
+    assert search('"milk and eggs"') == [1]
+    assert search('"eggs buy"') == []
+    assert search('"then buy seeds"') == [3]
+
+    # Rewrites replace the indexed words
+    index.remove(2, *fields[2])
+    fields[2] = ("Bakery", "Buy bread")
+    index.add(2, *fields[2])
+    index.remove(1, *fields.pop(1))
+    assert search("milk") == [4]
+    assert search('"buy bread"') == [2]
+    assert len(index) == 3
@@ -1,7 +1,12 @@
+import asyncio
+import json
 from httpx import AsyncClient, Response
 from fastapi import status
 from unittest.mock import patch
-from tests.mock_functions import get_user, mock_todos
+from helpers.change_feed import ChangeFeed
+from helpers.cursor import encode_cursor
+from tests.conftest import app
+from tests.mock_functions import get_bearer_token, get_user, mock_todos
 
 
 async def test_authorization(async_client: AsyncClient) -> None:
@@ -236,3 +241,452 @@ async def test_delete_single_todo(mock_get_user, async_client: AsyncClient):
 
     assert response.status_code == status.HTTP_200_OK
     assert data == expected_result
+
+
+@patch("routes.todos.todos", mock_todos())
+@patch("mock_data.mock_user_database.MockUserDatabase.get_user", side_effect=get_user)
+async def test_get_all_todos_cache(mock_get_user, async_client: AsyncClient):
+    data = await get_bearer_token(async_client)
+    headers = {"Authorization": f"Bearer {data['access_token']}"}
+
+    # The second identical query is served from the cache
+    url = "/api/todos?page=1&page_size=10&title=title"
+    first: Response = await async_client.get(url, headers=headers)
+    second: Response = await async_client.get(url.lower(), headers=headers)
+    assert first.json() == second.json()
+
+    response: Response = await async_client.get("/api/stats", headers=headers)
+    stats = response.json()["todo_query_cache"]
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+
+    # A write must invalidate the cached result
+    payload = {
+        "title": "New title",
+        "description": "New Description",
+        "due_date": "1970-01-01T00:00:00Z",
+        "completed": False,
+    }
+    await async_client.post("/api/todos", json=payload, headers=headers)
+
+    # Equally close titles are listed by id
+    response: Response = await async_client.get(url, headers=headers)
+    assert [x["id"] for x in response.json()["result"]] == [1, 2, 4]
+
+
+@patch("routes.todos.todos", mock_todos())
+@patch("mock_data.mock_user_database.MockUserDatabase.get_user", side_effect=get_user)
+async def test_get_all_todos_descending(mock_get_user, async_client: AsyncClient):
+    data = await get_bearer_token(async_client)
+    headers = {"Authorization": f"Bearer {data['access_token']}"}
+
+    # Call API
+    response: Response = await async_client.get(
+        "/api/todos?page=1&page_size=2&sort_by=title&order=desc", headers=headers
+    )
+    data = response.json()
+
+    # Assert results
+    assert response.status_code == status.HTTP_200_OK
+    assert data["pages"] == 2
+    assert [x["title"] for x in data["result"]] == ["Title 2", "Title 1"]
+
+
+@patch("routes.todos.todos", mock_todos())
+@patch("mock_data.mock_user_database.MockUserDatabase.get_user", side_effect=get_user)
+async def test_get_all_todos_cursor(mock_get_user, async_client: AsyncClient):
+    data = await get_bearer_token(async_client)
+    headers = {"Authorization": f"Bearer {data['access_token']}"}
+
+    # The first page returns a cursor to the next page
+    response: Response = await async_client.get(
+        "/api/todos?page_size=2&sort_by=id", headers=headers
+    )
+    data = response.json()
+    assert [x["id"] for x in data["result"]] == [1, 2]
+
+    # Continue with the cursor
+    response: Response = await async_client.get(
+        f"/api/todos?page_size=2&sort_by=id&cursor={data['next_cursor']}",
+        headers=headers,
+    )
+    data = response.json()
+    assert [x["id"] for x in data["result"]] == [3]
+    assert "next_cursor" not in data
+
+    # A cursor can't continue a differently sorted listing
+    response: Response = await async_client.get(
+        "/api/todos?page_size=2&sort_by=title&cursor=WyJ4Il0", headers=headers
+    )
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    # Keys hold 64 bit integers, which every storage engine can bind
+    cursor = encode_cursor((None, "id", "asc"), [2**63, 2**63])
+    response: Response = await async_client.get(
+        f"/api/todos?page_size=2&sort_by=id&cursor={cursor}", headers=headers
+    )
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@patch("routes.todos.todos", mock_todos())
+@patch("mock_data.mock_user_database.MockUserDatabase.get_user", side_effect=get_user)
+async def test_get_all_todos_filtered(mock_get_user, async_client: AsyncClient):
+    data = await get_bearer_token(async_client)
+    headers = {"Authorization": f"Bearer {data['access_token']}"}
+
+    # Open todos, continued with the cursor of the filtered listing
+    response: Response = await async_client.get(
+        "/api/todos?page_size=1&sort_by=id&completed=false", headers=headers
+    )
+    data = response.json()
+    assert data["pages"] == 2
+    assert [x["id"] for x in data["result"]] == [1]
+
+    response: Response = await async_client.get(
+        f"/api/todos?page_size=1&sort_by=id&completed=false"
+        f"&cursor={data['next_cursor']}",
+        headers=headers,
+    )
+    assert [x["id"] for x in response.json()["result"]] == [3]
+
+    # The cursor is bound to the filters
+    response: Response = await async_client.get(
+        f"/api/todos?page_size=1&sort_by=id&cursor={data['next_cursor']}",
+        headers=headers,
+    )
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    # Every mock todo is due at the epoch, the due date range is half-open
+    response: Response = await async_client.get(
+        "/api/todos?page_size=10&due_after=1970-01-01T00:00:00Z"
+        "&due_before=1970-01-01T00:00:01Z&completed=true",
+        headers=headers,
+    )
+    assert [x["id"] for x in response.json()["result"]] == [2]
+
+    response: Response = await async_client.get(
+        "/api/todos?page_size=10&due_before=1970-01-01T00:00:00Z", headers=headers
+    )
+    assert response.json()["result"] == []
+
+    response: Response = await async_client.get(
+        "/api/todos/export?completed=false&order=desc", headers=headers
+    )
+    assert [json.loads(line)["id"] for line in response.text.splitlines()] == [1, 3]
+
+
+@patch("routes.todos.todos", mock_todos())
+@patch("mock_data.mock_user_database.MockUserDatabase.get_user", side_effect=get_user)
+async def test_get_all_todos_search(mock_get_user, async_client: AsyncClient):
+    data = await get_bearer_token(async_client)
+    headers = {"Authorization": f"Bearer {data['access_token']}"}
+
+    # Full-text search on the title and description
+    response: Response = await async_client.get(
+        "/api/todos?page_size=1&search=description", headers=headers
+    )
+    data = response.json()
+    assert response.status_code == status.HTTP_200_OK
+    assert data["pages"] == 3
+
+    response: Response = await async_client.get(
+        f"/api/todos?page_size=1&search=description&cursor={data['next_cursor']}",
+        headers=headers,
+    )
+    assert len(response.json()["result"]) == 1
+
+    response: Response = await async_client.get(
+        '/api/todos?page_size=10&search="mock 3"', headers=headers
+    )
+    assert [x["id"] for x in response.json()["result"]] == [3]
+
+    # A title and a full-text search can't be combined
+    response: Response = await async_client.get(
+        "/api/todos?page_size=10&search=mock&title=mock", headers=headers
+    )
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@patch("routes.todos.EXPORT_BATCH_SIZE", 2)
+@patch("routes.todos.todos", mock_todos())
+@patch("mock_data.mock_user_database.MockUserDatabase.get_user", side_effect=get_user)
+async def test_export_todos(mock_get_user, async_client: AsyncClient):
+    data = await get_bearer_token(async_client)
+    headers = {"Authorization": f"Bearer {data['access_token']}"}
+
+    # Call API
+    response: Response = await async_client.get(
+        "/api/todos/export?sort_by=id&order=desc", headers=headers
+    )
+
+    # Assert results
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [x["id"] for x in lines] == [3, 2, 1]
+    assert lines[0] == {
+        "id": 3,
+        "title": "Mock 3",
+        "description": "Description 3",
+        "due_date": "1970-01-01T00:00:00Z",
+        "completed": False,
+    }
+
+
+@patch("routes.todos.todos", mock_todos())
+@patch("mock_data.mock_user_database.MockUserDatabase.get_user", side_effect=get_user)
+async def test_bulk_todos(mock_get_user, async_client: AsyncClient):
+    data = await get_bearer_token(async_client)
+    headers = {"Authorization": f"Bearer {data['access_token']}"}
+
+    # New todo payload
+    payload = {
+        "title": "New Todo",
+        "description": "New Description",
+        "due_date": "1970-01-01T00:00:00Z",
+        "completed": False,
+    }
+
+    # Create
+    response: Response = await async_client.post(
+        "/api/todos/bulk", json=[payload, payload], headers=headers
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == {
+        "result": [{"id": 4, "status": "created"}, {"id": 5, "status": "created"}]
+    }
+
+    # Upsert, duplicate ids are rejected as a whole
+    response: Response = await async_client.put(
+        "/api/todos/bulk",
+        json=[{**payload, "id": 1}, {**payload, "id": 1}],
+        headers=headers,
+    )
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    response: Response = await async_client.put(
+        "/api/todos/bulk",
+        json=[{**payload, "id": 1}, {**payload, "id": 10}, payload],
+        headers=headers,
+    )
+    assert response.json() == {
+        "result": [
+            {"id": 1, "status": "updated"},
+            {"id": 10, "status": "created"},
+            {"id": 11, "status": "created"},
+        ]
+    }
+
+    # Delete
+    response: Response = await async_client.request(
+        "DELETE", "/api/todos/bulk", json=[2, 42], headers=headers
+    )
+    assert response.json() == {
+        "result": [{"id": 2, "status": "deleted"}, {"id": 42, "status": "not_found"}]
+    }
+
+    response: Response = await async_client.get(
+        "/api/todos?page=1&page_size=10&sort_by=id", headers=headers
+    )
+    assert [x["id"] for x in response.json()["result"]] == [1, 3, 4, 5, 10, 11]
+
+
+@patch("routes.todos.todos", mock_todos())
+@patch("mock_data.mock_user_database.MockUserDatabase.get_user", side_effect=get_user)
+async def test_serialized_todos_follow_updates(mock_get_user, async_client: AsyncClient):
+    data = await get_bearer_token(async_client)
+    headers = {"Authorization": f"Bearer {data['access_token']}"}
+
+    # Serve the todo twice, the second time from the JSON cache
+    for _ in range(2):
+        response: Response = await async_client.get("/api/todos/1", headers=headers)
+        assert response.headers["content-type"] == "application/json"
+        assert response.json()["title"] == "Title 1"
+    response: Response = await async_client.get("/api/stats", headers=headers)
+    assert response.json()["todo_json_cache"]["hits"] == 1
+
+    payload = {
+        "title": "Updated",
+        "description": "Updated Description",
+        "due_date": "1970-01-01T00:00:00Z",
+        "completed": False,
+    }
+    response: Response = await async_client.put(
+        "/api/todos/1", json=payload, headers=headers
+    )
+    assert response.json() == {**payload, "id": 1}
+
+    response: Response = await async_client.get(
+        "/api/todos?page=1&page_size=1&sort_by=id", headers=headers
+    )
+    assert response.json() == {
+        "page": 1,
+        "page_size": 1,
+        "pages": 3,
+        "result": [{**payload, "id": 1}],
+        "next_cursor": response.json()["next_cursor"],
+    }
+
+
+@patch("routes.todos.todos", mock_todos())
+@patch("mock_data.mock_user_database.MockUserDatabase.get_user", side_effect=get_user)
+async def test_conditional_get(mock_get_user, async_client: AsyncClient):
+    data = await get_bearer_token(async_client)
+    headers = {"Authorization": f"Bearer {data['access_token']}"}
+    payload = {
+        "title": "Updated",
+        "description": "Updated Description",
+        "due_date": "1970-01-01T00:00:00Z",
+        "completed": False,
+    }
+
+    response: Response = await async_client.get("/api/todos/1", headers=headers)
+    todo_etag = response.headers["etag"]
+    response: Response = await async_client.get(
+        "/api/todos?page=1&page_size=2", headers=headers
+    )
+    list_etag = response.headers["etag"]
+
+    # Unchanged resources are not sent again
+    response: Response = await async_client.get(
+        "/api/todos/1", headers={**headers, "If-None-Match": f'"x", W/{todo_etag}'}
+    )
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+    assert response.content == b""
+
+    # The ETag of a todo never matches another (or a missing) todo
+    for _id in (2, 42):
+        response: Response = await async_client.get(
+            f"/api/todos/{_id}", headers={**headers, "If-None-Match": todo_etag}
+        )
+        assert response.status_code != status.HTTP_304_NOT_MODIFIED
+    response: Response = await async_client.get(
+        "/api/todos?page=1&page_size=2",
+        headers={**headers, "If-None-Match": list_etag},
+    )
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+    # Writing another todo only changes the ETag of the list
+    await async_client.put("/api/todos/2", json=payload, headers=headers)
+    response: Response = await async_client.get(
+        "/api/todos/1", headers={**headers, "If-None-Match": todo_etag}
+    )
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+    response: Response = await async_client.get(
+        "/api/todos?page=1&page_size=2",
+        headers={**headers, "If-None-Match": list_etag},
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["etag"] != list_etag
+
+    # Updated and deleted todos are sent (or reported missing) again
+    response: Response = await async_client.put(
+        "/api/todos/1", json=payload, headers=headers
+    )
+    assert response.headers["etag"] != todo_etag
+    response: Response = await async_client.get(
+        "/api/todos/1", headers={**headers, "If-None-Match": todo_etag}
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["title"] == "Updated"
+
+    await async_client.delete("/api/todos/1", headers=headers)
+    response: Response = await async_client.get(
+        "/api/todos/1", headers={**headers, "If-None-Match": response.headers["etag"]}
+    )
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+async def read_first_chunk(url: str, query_string: bytes, headers: dict) -> bytes:
+    """Call the app until the first chunk of an (endless) streamed response, then
+    disconnect"""
+
+    chunks, disconnected = [], asyncio.Event()
+    requested = False
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.body" and message.get("body"):
+            chunks.append(message["body"])
+            disconnected.set()
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "server": ("testserver", 80),
+        "path": url,
+        "raw_path": url.encode(),
+        "root_path": "",
+        "query_string": query_string,
+        "headers": [(k.lower().encode(), v.encode()) for k, v in headers.items()],
+    }
+    await app(scope, receive, send)
+    return b"".join(chunks)
+
+
+@patch("routes.todos.change_feed", ChangeFeed(size=10, token="feed"))
+@patch("routes.todos.todos", mock_todos())
+@patch("mock_data.mock_user_database.MockUserDatabase.get_user", side_effect=get_user)
+async def test_change_feed(mock_get_user, async_client: AsyncClient):
+    data = await get_bearer_token(async_client)
+    headers = {"Authorization": f"Bearer {data['access_token']}"}
+    todo = {
+        "title": "New todo",
+        "description": "New description",
+        "due_date": "1970-01-01T00:00:00Z",
+        "completed": False,
+    }
+
+    # Every write handler publishes its changes, deleting a missing todo changes
+    # nothing
+    await async_client.post("/api/todos", json=todo, headers=headers)
+    await async_client.put("/api/todos/1", json=todo, headers=headers)
+    await async_client.delete("/api/todos/2", headers=headers)
+    await async_client.delete("/api/todos/42", headers=headers)
+
+    stream = await read_first_chunk("/api/todos/changes", b"after=feed-1", headers)
+    events = [frame.split("\n") for frame in stream.decode().split("\n\n")[:-1]]
+    assert [event[:2] for event in events] == [
+        ["id: feed-2", "event: updated"],
+        ["id: feed-3", "event: deleted"],
+    ]
+    assert json.loads(events[0][2].removeprefix("data: ")) == {
+        "sequence": 2,
+        "type": "updated",
+        "id": 1,
+        "todo": {"id": 1, **todo},
+    }
+    assert json.loads(events[1][2].removeprefix("data: ")) == {
+        "sequence": 3,
+        "type": "deleted",
+        "id": 2,
+    }
+
+    # An EventSource resumes with the id of the last event it received, ids of
+    # another feed (e.g. of a previous run) are answered with a reset
+    stream = await read_first_chunk(
+        "/api/todos/changes", b"", {**headers, "Last-Event-ID": "feed-2"}
+    )
+    assert stream.startswith(b"id: feed-3\nevent: deleted\n")
+    stream = await read_first_chunk("/api/todos/changes", b"after=other-1", headers)
+    assert stream == b'id: feed-3\nevent: reset\ndata: {"sequence":3}\n\n'
+
+    # The changes are only known to the worker which made them
+    with patch("routes.todos.SERVER_WORKERS", 2):
+        response: Response = await async_client.get(
+            "/api/todos/changes", headers=headers
+        )
+    assert response.status_code == status.HTTP_501_NOT_IMPLEMENTED
+
+    response: Response = await async_client.get("/api/todos/changes")
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
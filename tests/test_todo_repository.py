@@ -0,0 +1,280 @@
+from copy import deepcopy
+from datetime import datetime, timedelta, timezone
+from mock_data.generate_todos import generate_todos
+from models.todo_models import ToDoModel
+from storage.base import TODO_VERSION_SLOTS, ToDoFilter
+from storage.todo_repository import ToDoRepository
+from tests.mock_functions import mock_todos
+
+
+def new_todo(title="New Todo"):
+    return ToDoModel(
+        title=title,
+        description="New Description",
+        due_date=datetime(1970, 1, 1, 0, 0, 0, tzinfo=timezone.utc),
+        completed=False,
+    )
+
+
+def test_repository_keeps_insertion_order():
+    repository = mock_todos()
+
+    assert [todo.id for todo in repository] == [3, 2, 1]
+    assert len(repository) == 3
+    assert repository.get(2).title == "Title 2"
+    assert repository.get(42) is None
+
+
+def test_repository_ids_are_monotonic():
+    repository = mock_todos()
+
+    assert repository.create(new_todo()).id == 4
+
+    # Deleting the highest id must not hand it out again
+    assert repository.delete(4) is True
+    assert repository.delete(4) is False
+    assert repository.create(new_todo()).id == 5
+
+
+def test_repository_update_keeps_position():
+    repository = mock_todos()
+
+    assert repository.update(42, new_todo()) is None
+    updated = repository.update(2, new_todo("Updated"))
+
+    assert updated.id == 2
+    assert [todo.title for todo in repository] == ["Mock 3", "Updated", "Title 1"]
+
+
+def test_repository_title_search_follows_writes():
+    repository = mock_todos()
+
+    total, todos, _ = repository.query(title="title", sort_by="id")
+    assert total == 2
+    assert todos == [repository.get(1), repository.get(2)]
+
+    repository.update(2, new_todo("Renamed"))
+    repository.delete(1)
+    repository.create(new_todo("Another title"))
+
+    assert repository.query(title="TITLE") == (1, [repository.get(4)], None)
+    assert repository.query(title="ti") == (0, [], None)
+
+
+def test_repository_query_only_returns_the_requested_slice():
+    repository = mock_todos()
+
+    total, todos, _ = repository.query(sort_by="id", offset=1, limit=1)
+    assert total == 3
+    assert [todo.id for todo in todos] == [2]
+
+    total, todos, _ = repository.query(title="Title", sort_by="title", offset=0, limit=1)
+    assert total == 2
+    assert [todo.id for todo in todos] == [1]
+
+
+def test_repository_sorted_indexes_follow_writes():
+    repository = mock_todos()
+    repository.update(3, new_todo("A first"))
+    repository.create(new_todo("Z last"))
+
+    total, todos, _ = repository.query(sort_by="title")
+    assert total == 4
+    assert [todo.id for todo in todos] == [3, 1, 2, 4]
+
+    total, todos, _ = repository.query(sort_by="title", offset=1, limit=2, descending=True)
+    assert [todo.id for todo in todos] == [2, 1]
+
+
+def test_repository_keyset_pagination():
+    repository = mock_todos()
+    for title in ("Title 4", "Title 5", "Title 6"):
+        repository.create(new_todo(title))
+
+    for kwargs in (
+        {},
+        {"sort_by": "title"},
+        {"sort_by": "due_date", "descending": True},
+        {"title": "title"},
+        {"title": "title", "sort_by": "description", "descending": True},
+    ):
+        expected = repository.query(**kwargs).todos
+
+        # Walk the listing two todos at a time
+        walked, after = [], None
+        while True:
+            result = repository.query(limit=2, after=after, **kwargs)
+            walked.extend(result.todos)
+            after = result.next_key
+            if after is None:
+                break
+
+        assert walked == expected
+
+
+def test_repository_keyset_pagination_survives_inserts():
+    repository = mock_todos()
+
+    result = repository.query(sort_by="id", limit=2)
+    assert [todo.id for todo in result.todos] == [1, 2]
+
+    # Writes before the cursor do not shift the next page
+    repository.delete(1)
+    repository.create(new_todo())
+    result = repository.query(sort_by="id", limit=2, after=result.next_key)
+    assert [todo.id for todo in result.todos] == [3, 4]
+
+
+def test_repository_iteration_reads_a_snapshot():
+    repository = mock_todos()
+    expected = repository.query(sort_by="title").todos
+
+    batches = repository.iter_batches(sort_by="title", batch_size=1)
+    walked = next(batches)
+
+    # Writes during the iteration are not visible to it
+    repository.update(expected[2].id, new_todo("AAA"))
+    repository.delete(expected[1].id)
+    repository.create(new_todo("A new todo"))
+    for batch in batches:
+        walked.extend(batch)
+
+    assert walked == expected
+    assert repository.get(expected[2].id).title == "AAA"
+
+    # Finished iterations drop their snapshot
+    assert len(repository._snapshots) == 0
+    assert repository.query(sort_by="title").todos[0].title == "A new todo"
+
+
+def test_repository_title_iteration_is_batched():
+    repository = ToDoRepository(deepcopy(generate_todos(100, 1, datetime(2030, 1, 1))))
+
+    # Keyset batches list the matches in the ranked order
+    for batch_size, kwargs in (
+        (2, {"title": "sed"}),
+        (7, {"search": "sed", "sort_by": "due_date"}),
+    ):
+        expected = repository.query(**kwargs).todos
+        batches = list(repository.iter_batches(batch_size=batch_size, **kwargs))
+        assert len(batches) == -(-len(expected) // batch_size)
+        assert [todo for batch in batches for todo in batch] == expected
+
+
+def test_repository_filters():
+    repository = ToDoRepository(deepcopy(generate_todos(300, 1, datetime(2030, 1, 1))))
+    start = datetime(2030, 3, 1, tzinfo=timezone.utc)
+    title = repository.get(0).title.split()[0]
+
+    for filters in (
+        ToDoFilter(completed=True),
+        ToDoFilter(completed=False, due_before=start),
+        ToDoFilter(due_after=start, due_before=start + timedelta(days=60)),
+        ToDoFilter(True, datetime(2030, 3, 1)),
+    ):
+        matches = filters.predicate()
+        for kwargs in (
+            {},
+            {"sort_by": "title"},
+            {"sort_by": "due_date", "descending": True},
+            {"title": title, "sort_by": "id"},
+        ):
+            expected = list(filter(matches, repository.query(**kwargs).todos))
+
+            result = repository.query(offset=5, limit=10, filters=filters, **kwargs)
+            assert result.total == len(expected)
+            assert result.todos == expected[5:15]
+
+            # Walk the filtered listing seven todos at a time
+            walked, after = [], None
+            while True:
+                result = repository.query(
+                    limit=7, after=after, filters=filters, **kwargs
+                )
+                walked.extend(result.todos)
+                after = result.next_key
+                if after is None:
+                    break
+            assert walked == expected
+
+
+def test_repository_rare_completed_filter():
+    todos = deepcopy(generate_todos(300, 1, datetime(2030, 1, 1)))
+    for todo in todos:
+        todo.completed = todo.id % 50 == 0
+    repository = ToDoRepository(todos)
+
+    # Rare values are ranked, common ones walked, both list the same todos
+    for completed in (True, False):
+        filters = ToDoFilter(completed=completed)
+        for kwargs in ({}, {"sort_by": "title", "descending": True}):
+            expected = [
+                todo
+                for todo in repository.query(**kwargs).todos
+                if todo.completed is completed
+            ]
+            walked, after = [], None
+            while True:
+                result = repository.query(
+                    limit=4, after=after, filters=filters, **kwargs
+                )
+                assert result.total == len(expected)
+                walked.extend(result.todos)
+                after = result.next_key
+                if after is None:
+                    break
+            assert walked == expected
+            result = repository.query(offset=2, limit=3, filters=filters, **kwargs)
+            assert result.todos == expected[2:5]
+
+
+def test_repository_completed_filter_follows_writes():
+    repository = mock_todos()
+    completed = ToDoFilter(completed=True)
+    assert repository.query(filters=completed).total == 1
+
+    done = new_todo("Done")
+    done.completed = True
+    repository.create(done)
+    repository.update(1, done.model_copy(update={"id": None}))
+    repository.delete(2)
+
+    result = repository.query(filters=completed)
+    assert result.total == 2
+    assert [todo.id for todo in result.todos] == [1, 4]
+    assert repository.query(filters=ToDoFilter(completed=False)).total == 1
+
+
+def test_repository_json_follows_due_date_offset():
+    repository = mock_todos()
+    todo = new_todo()
+    todo.due_date = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    repository.update(1, todo)
+    assert b'"due_date":"2024-01-01T00:00:00Z"' in repository.todo_json(
+        repository.get(1)
+    )
+
+    # The same instant in another time zone compares equal, but is a different JSON
+    todo.due_date = datetime(2024, 1, 1, 1, tzinfo=timezone(timedelta(hours=1)))
+    repository.update(1, todo)
+    assert b'"due_date":"2024-01-01T01:00:00+01:00"' in repository.todo_json(
+        repository.get(1)
+    )
+
+
+def test_repository_todo_etags():
+    repository = mock_todos()
+    etag, other_etag = repository.todo_etag(1), repository.todo_etag(2)
+
+    # A failed write still changes the ETag, the todo may have changed
+    try:
+        with repository.writing([1]):
+            raise RuntimeError
+    except RuntimeError:
+        pass
+    assert repository.todo_etag(1) != etag
+    assert repository.todo_etag(2) == other_etag != etag
+
+    # Versions are kept in a fixed number of slots, however many ids are written
+    repository.touch(range(100_000))
+    assert len(repository.todo_versions) == TODO_VERSION_SLOTS